@@ -0,0 +1,44 @@
+"""
+benchmark the compact candidate store against the candidate tables it is built from, on synthetic catalogs
+prints the bytes per candidate of the tables (with wds ids encoded, as wsi_xmatch.py reads them) and of the store,
+the time to build the store, and the time of the crossmatch on it
+"""
+
+import time
+import warnings
+
+from utils_synthetic import synthetic_catalog
+from utils_ids import id_dictionary, encode_ids
+from utils_candidates import candidate_store, store_summary
+from utils_xmatch import candidate_xmatch
+
+warnings.simplefilter(action='ignore', category=FutureWarning)
+
+# catalog sizes (wsi observations)
+sizes = [ 10**3, 10**4, 10**5 ]
+
+######################################################################################################################################################
+
+print( f'{"size":>8} {"candidates":>11} {"sources":>9} {"table B/cand":>13} {"store B/cand":>13} {"ratio":>7} {"build s":>8} {"xmatch s":>9}' )
+
+for size in sizes:
+
+    tables = synthetic_catalog( size )
+    prepped, gaia_pri, gaia_sec = tables['prepped'], tables['gaia_pri'], tables['gaia_sec']
+
+    ids = id_dictionary( prepped, gaia_pri, gaia_sec )
+    prepped, gaia_pri, gaia_sec = [ encode_ids( table, ids ) for table in (prepped, gaia_pri, gaia_sec) ]
+
+    t0 = time.perf_counter()
+    store = candidate_store( gaia_pri, gaia_sec )
+    build = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    candidate_xmatch( prepped, store )
+    xmatch = time.perf_counter() - t0
+
+    s = store_summary( gaia_pri, gaia_sec, store )
+    ratio = s['table_bytes_per_candidate'] / s['store_bytes_per_candidate']
+
+    print( f"{size:>8} {s['candidates']:>11} {s['sources']:>9} {s['table_bytes_per_candidate']:>13.0f} {s['store_bytes_per_candidate']:>13.0f} "
+           f"{ratio:>6.1f}x {build:>8.3f} {xmatch:>9.2f}" )
@@ -0,0 +1,88 @@
+"""
+benchmark the batch epoch propagation against the original row by row loop, and the memoized batch propagation
+prints rows/sec for each catalog size, then the cost of propagating to several epochs at once against one pass per epoch
+"""
+
+import time
+import warnings
+import numpy as np
+import pandas as pd
+
+from utils_wsi_epoch_prop import wsi_J2016_prop, wsi_J2016_prop_loop, memoized_propagation, wsi_epoch_prop
+
+warnings.simplefilter(action='ignore', category=FutureWarning)
+
+# catalog sizes to time, the loop is only run on the smaller ones (it takes ~3 ms a row)
+sizes = [ 10**3, 10**4, 10**5, 10**6 ]
+loop_max = 10**3
+
+# fraction of rows that are repeat observations of an earlier row's primary (same coordinate and pm), like wsi24's ~25%
+repeat_rate = 0.25
+
+# epochs for the multi epoch comparison (on the largest size), the observation date is a per row column of years
+epochs = [ 2016.0, 'wsi_date', 2017.0, 2015.5 ]
+
+# random wsi-like catalog with the columns needed for propagation
+def random_wsi( n, seed=0 ):
+
+    rng = np.random.default_rng( seed )
+
+    # precise coordinates in the 'hh mm ss.ss +dd mm ss.s' format used in the wds csv
+    ra = rng.uniform( 0, 24, n )
+    dec = np.degrees( np.arcsin( rng.uniform( -1, 1, n ) ) )
+    sign = np.where( dec < 0, '-', '+' )
+    dec = np.abs( dec )
+
+    hh, mm, ss = ra.astype(int), (ra*60 % 60).astype(int), np.round( ra*3600 % 60, 2 ) % 60
+    dd, dm, ds = dec.astype(int), (dec*60 % 60).astype(int), np.round( dec*3600 % 60, 1 ) % 60
+    coords = [ f'{hh[i]:02d} {mm[i]:02d} {ss[i]:05.2f} {sign[i]}{dd[i]:02d} {dm[i]:02d} {ds[i]:04.1f}' for i in range(n) ]
+
+    # secondary pm missing for ~20% of rows
+    pm2_ra = rng.normal( 0, 50, n ).astype(object)
+    pm2_dec = rng.normal( 0, 50, n ).astype(object)
+    missing = rng.random( n ) < 0.2
+    pm2_ra[ missing ] = '%'
+    pm2_dec[ missing ] = '%'
+
+    wsi = pd.DataFrame({ 'wds_coord1': coords,
+                         'wds_pm1_ra': rng.normal( 0, 50, n ), 'wds_pm1_dec': rng.normal( 0, 50, n ),
+                         'wds_pm2_ra': pm2_ra, 'wds_pm2_dec': pm2_dec,
+                         'wsi_pa': rng.uniform( 0, 360, n ), 'wsi_sep': rng.uniform( 0.1, 60, n ),
+                         'wsi_date': rng.uniform( 2019, 2023, n ) })
+
+    # repeat observations take the primary of a random row from the first part of the catalog
+    repeats = np.flatnonzero( rng.random( n ) < repeat_rate )
+    source = rng.integers( 0, n, len(repeats) ) % np.maximum( repeats, 1 )
+    for col in ['wds_coord1', 'wds_pm1_ra', 'wds_pm1_dec']:
+        wsi.loc[ repeats, col ] = wsi[ col ].to_numpy()[ source ]
+
+    return wsi
+
+# time a propagation function, return rows per second
+def rows_per_sec( func, wsi ):
+    t0 = time.perf_counter()
+    func( wsi.copy() )
+    return len(wsi) / ( time.perf_counter() - t0 )
+
+print( f'{"rows":>10} {"loop rows/s":>14} {"batch rows/s":>14} {"memo rows/s":>14} {"memo hits":>10}' )
+
+for n in sizes:
+    wsi = random_wsi( n )
+
+    batch = rows_per_sec( wsi_J2016_prop, wsi )
+    loop = rows_per_sec( wsi_J2016_prop_loop, wsi ) if n <= loop_max else np.nan
+
+    # fresh memo, so only the repeats within the catalog hit
+    memo = memoized_propagation()
+    memoized = rows_per_sec( lambda df: wsi_J2016_prop( df, memo=memo ), wsi )
+
+    print( f'{n:>10} {loop:>14.0f} {batch:>14.0f} {memoized:>14.0f} {memo.stats["hits"]:>10}' )
+
+# k epochs in one call vs k single epoch calls
+print( f'\n{"epochs":>10} {"one call s":>14} {"k calls s":>14}' )
+
+as_epochs = lambda k: [ wsi.wsi_date if e == 'wsi_date' else e for e in epochs[:k] ]
+for k in range( 1, len(epochs) + 1 ):
+    together = len(wsi) / rows_per_sec( lambda df: wsi_epoch_prop( df, as_epochs( k ) ), wsi )
+    apart = sum( len(wsi) / rows_per_sec( lambda df: wsi_epoch_prop( df, [e] ), wsi ) for e in as_epochs( k ) )
+    print( f'{k:>10} {together:>14.3f} {apart:>14.3f}' )
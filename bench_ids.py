@@ -0,0 +1,106 @@
+"""
+benchmark carrying identifiers as strings against integer keys, on synthetic catalogs
+prints the memory of the wds_id, wds_comp and gaia designation columns as object strings and as categorical codes / int64 source ids,
+and the time of the joins that used to compare strings: the simbad check, the secondary exclusion, the synthetic photometry lookup
+and the (wds_id, wds_comp) lookup
+"""
+
+import time
+import warnings
+import numpy as np
+import pandas as pd
+
+from utils_synthetic import synthetic_catalog
+from utils_misc import wds_index, wds_lookup
+from utils_ids import id_dictionary, encode_ids, pair_keys, designation_to_source_id, source_id_array, same_source
+from utils_syn_phot import syn_lookup
+
+warnings.simplefilter(action='ignore', category=FutureWarning)
+
+# catalog sizes (wsi observations)
+sizes = [ 10**4, 10**5, 10**6 ]
+
+# each join is timed this many times and the fastest kept
+repeats = 3
+
+######################################################################################################################################################
+
+# fastest of some runs, in seconds
+def best_time( func ):
+
+    seconds = np.inf
+    for _ in range( repeats ):
+        t0 = time.perf_counter()
+        func()
+        seconds = min( seconds, time.perf_counter() - t0 )
+
+    return seconds
+
+# memory of some columns, MB
+def column_mb( table, columns ):
+    return table[ columns ].memory_usage( deep=True, index=False ).sum() / 2**20
+
+######################################################################################################################################################
+
+# the pair key lookup matches the string join, with the wds' own dictionary and with a shared one that misses some wds pairs,
+# on a catalog with ids that are not in the wds and a missing id
+wds_check = wds_index( pd.DataFrame( { 'wds_id': ['a', 'b', 'c', 'd'], 'wds_comp': ['AB', 'AB', 'AC', 'AB'], 'wds_mag1': [1.0, 2.0, 3.0, 4.0] } ) )
+catalog_check = pd.DataFrame( { 'wds_id': ['a', 'b', 'x', np.nan, 'c', 'a'], 'wds_comp': ['AB', 'AC', 'AB', 'AB', 'AC', 'AB'] } )
+
+expected = wds_check[ ['wds_mag1'] ].reindex( pd.MultiIndex.from_arrays( [ catalog_check['wds_id'], catalog_check['wds_comp'] ] ) )['wds_mag1'].to_numpy()
+for shared in [ None, id_dictionary( catalog_check ) ]:
+    joined, matched = wds_lookup( catalog_check, wds_check, ['wds_mag1'], ids=shared )
+    if not ( np.array_equal( joined['wds_mag1'].to_numpy(), expected, equal_nan=True ) and ( matched.to_numpy() == ~np.isnan( expected ) ).all() ):
+        print( f'wds_lookup differs from the string join ({"shared" if shared else "wds"} dictionary)' )
+
+######################################################################################################################################################
+
+print( f'{"size":>8} {"measure":>22} {"strings":>10} {"integers":>10} {"ratio":>7}' )
+
+for size in sizes:
+
+    tables = synthetic_catalog( size )
+    prepped, wds, gaia_pri, gaia_sec = tables['prepped'], tables['wds'], tables['gaia_pri'], tables['gaia_sec']
+
+    # a stand in for the matched primaries and simbad ids, the nearest candidate of each target
+    nearest = gaia_pri.sort_values( 'target_sep', kind='stable' ).drop_duplicates( 'target_oid' ).set_index( 'target_oid' ).reindex( prepped.wsi_oid )
+    designation, source_id = nearest.designation.to_numpy( dtype=object ), source_id_array( nearest.source_id )
+    sb_id = np.where( np.arange( len(prepped) ) % 3 == 0, None, designation )
+    sb_source_id = designation_to_source_id( sb_id )
+
+    # integer versions of every table, one dictionary for all of them
+    ids = id_dictionary( prepped, wds, gaia_pri, gaia_sec )
+    prepped_codes, wds_codes = encode_ids( prepped.copy(), ids ), encode_ids( wds.copy(), ids )
+    wds_keys = pd.Index( pair_keys( wds_codes, ids ) )
+    wds_keys = wds_keys[ ~wds_keys.duplicated( keep='first' ) ]
+    wds_keyed = wds_index( wds, duplicates='first' )
+
+    rows = []
+
+    # memory of the identifier columns
+    for name, table in [ ('prepped', prepped), ('gaia_pri', gaia_pri) ]:
+        before = column_mb( table, ['wds_id', 'wds_comp'] + ( ['designation'] if 'designation' in table else [] ) )
+        encoded = encode_ids( table[ ['wds_id', 'wds_comp'] ].copy(), ids )
+        after = column_mb( encoded, ['wds_id', 'wds_comp'] ) + ( table.source_id.to_numpy( dtype=np.int64 ).nbytes / 2**20 if 'source_id' in table else 0 )
+        rows.append( ( f'{name} ids MB', before, after ) )
+
+    # simbad check, designation strings vs source ids
+    rows.append( ( 'simbad check s', best_time( lambda: designation == sb_id ),
+                                     best_time( lambda: same_source( source_id, sb_source_id ) ) ) )
+
+    # secondary exclusion, isin on designations vs source ids
+    rows.append( ( 'exclusion s', best_time( lambda: ~gaia_sec.designation.isin( np.unique( designation.astype( str ) ) ) ),
+                                  best_time( lambda: ~np.isin( source_id_array( gaia_sec.source_id ), np.unique( source_id ) ) ) ) )
+
+    # synthetic photometry lookup, parsing designations vs carried source ids
+    syn = tables['STG1']
+    rows.append( ( 'syn lookup s', best_time( lambda: syn_lookup( designation_to_source_id( designation ), syn, ['StromgrenStd_mag_y'] ) ),
+                                   best_time( lambda: syn_lookup( source_id, syn, ['StromgrenStd_mag_y'] ) ) ) )
+
+    # (wds_id, wds_comp) lookup, string multiindex vs pair keys of encoded tables
+    string_keys = lambda: pd.MultiIndex.from_arrays( [ prepped['wds_id'], prepped['wds_comp'] ] )
+    rows.append( ( 'wds lookup s', best_time( lambda: wds_keyed.index.get_indexer( string_keys() ) ),
+                                   best_time( lambda: wds_keys.get_indexer( pair_keys( prepped_codes, ids ) ) ) ) )
+
+    for name, before, after in rows:
+        print( f'{size:>8} {name:>22} {before:>10.4f} {after:>10.4f} {before/after:>6.1f}x' )
@@ -0,0 +1,71 @@
+"""
+benchmark the concurrent simbad resolver against a local simbad stand-in
+prints rows/sec for the wsi component searches at increasing numbers of workers
+"""
+
+import os
+import time
+import tempfile
+import numpy as np
+import pandas as pd
+from functools import partial
+
+from simbad_stub import serve, wsi_identifiers
+from utils_simbad import wsi_component_search, query_gaia_by_wds_tap, query_gaia_by_wds_batch, throttled_query, cached_query, resolve_concurrently, resolve_batched, batch_resolve
+
+# simulated network delay per request (seconds), and the fraction of requests that fail and get retried
+latency = 0.02
+fail_rate = 0.02
+
+# number of wsi rows to resolve, worker counts to try, and the largest batch the stand-in accepts
+rows = 1000
+workers = [ 1, 4, 16, 32 ]
+max_batch = 200
+
+wsi = pd.read_csv('data/wsi24.csv').replace({'wds_comp':np.nan},'AB')
+server, url = serve( wsi_identifiers( wsi ), latency=latency, fail_rate=fail_rate, max_batch=max_batch )
+
+# compare against the simbad results stored in wsi24
+expected = list( zip( wsi.sb_id1.fillna(''), wsi.sb_flg1, wsi.sb_id2.fillna(''), wsi.sb_flg2 ) )[:rows]
+
+args = list( zip( wsi.wds_id, wsi.wds_comp ) )[:rows]
+query = throttled_query( partial( query_gaia_by_wds_tap, url=url, timeout=5 ), retries=5, backoff=0.01 )
+
+print( f'{"mode":>12} {"rows/s":>10} {"matches wsi24":>14}' )
+
+for max_workers in workers:
+    t0 = time.perf_counter()
+    results = resolve_concurrently( wsi_component_search, args, query, max_workers=max_workers )
+    rate = rows / ( time.perf_counter() - t0 )
+
+    same = sum( r == e for r, e in zip( results, expected ) )
+
+    print( f'{f"{max_workers} workers":>12} {rate:>10.1f} {same:>9}/{rows}' )
+
+# batch mode, batches are packed by query length and split when the stand-in rejects them
+resolve = lambda ids: batch_resolve( ids, throttled_query( partial( query_gaia_by_wds_batch, url=url, timeout=5 ), retries=5, backoff=0.01 ), query )
+
+t0 = time.perf_counter()
+results = resolve_batched( wsi_component_search, args, resolve )
+rate = rows / ( time.perf_counter() - t0 )
+same = sum( r == e for r, e in zip( results, expected ) )
+
+print( f'{"batch":>12} {rate:>10.1f} {same:>9}/{rows}' )
+
+# batch mode behind a fresh cache, the first run fills it and the second is answered from it
+cache = os.path.join( tempfile.mkdtemp(), 'simbad.cache.sqlite' )
+cached = cached_query( query, path=cache )
+resolve = lambda ids: batch_resolve( ids, throttled_query( partial( query_gaia_by_wds_batch, url=url, timeout=5 ), retries=5, backoff=0.01 ), cached )
+
+for mode in [ 'batch cold', 'batch warm' ]:
+    t0 = time.perf_counter()
+    results = resolve_batched( wsi_component_search, args, resolve )
+    rate = rows / ( time.perf_counter() - t0 )
+    same = sum( r == e for r, e in zip( results, expected ) )
+
+    print( f'{mode:>12} {rate:>10.1f} {same:>9}/{rows}' )
+
+print( cached.stats )
+cached.close()
+
+server.shutdown()
@@ -0,0 +1,115 @@
+"""
+benchmark loading the pipeline intermediates from csv against the memory mapped arrow tables
+prints load time and peak memory for the full tables and a few projected columns
+each load runs in a fresh process so the peak memory is for that load alone
+then loads float and int columns of the xmatch table tiled to ~1M rows, where the float columns should add next to nothing from
+arrow (views of the mapped file) and the nullable ints a copy each
+"""
+
+import os
+import sys
+import subprocess
+import tempfile
+import pandas as pd
+
+from utils_storage import pa, read_table, write_table, prepped_schema, gaia_candidate_schema, xmatch_schema, syn_schema
+
+# intermediates to load (skipped if the csv hasn't been made yet), and the columns for the projected loads
+tables = { 'data/wsi24.prepped': prepped_schema,
+           'data/gaia.results/pri.04mag.05as-result': gaia_candidate_schema,
+           'data/gaia.results/sec.04mag.10as-result': gaia_candidate_schema,
+           'data/wsi24.xmatch': xmatch_schema,
+           'data/syn.phot/wsi24.syn': syn_schema }
+
+projections = { 'data/wsi24.prepped': ['wsi_oid', 'wds_ra1', 'wds_dec1'],
+                'data/gaia.results/pri.04mag.05as-result': ['target_oid', 'source_id', 'target_dm', 'target_sep'],
+                'data/gaia.results/sec.04mag.10as-result': ['target_oid', 'source_id', 'target_dm', 'target_sep'],
+                'data/wsi24.xmatch': ['wsi_oid', 'gaia_source_id1', 'gaia_source_id2'],
+                'data/syn.phot/wsi24.syn': ['wsi_oid', 'syn1', 'syn2', 'syn_dm'] }
+
+# number of loads to average the time over
+repeats = 5
+
+# the xmatch table is tiled to this many rows for the copy check, float columns without missing values and int columns
+scaled_rows = 10**6
+scaled_projections = { 'float': ['wds_ra1', 'wds_dec1', 'wds_ra2', 'wds_dec2'],
+                       'int': ['wsi_oid', 'gaia_source_id1'] }
+
+# loads a table in a fresh process, prints seconds per load and the memory the loads added to the peak rss (kB)
+# the peak is reset after the imports (a forked process can inherit its parent's peak), linux only
+loader = '''
+import sys, time
+import utils_storage
+path, name, columns, repeats = sys.argv[1], sys.argv[2], sys.argv[3], int(sys.argv[4])
+columns = columns.split(',') if columns else None
+schema = getattr( utils_storage, name )
+
+def status( field ):
+    with open( '/proc/self/status' ) as f:
+        return int( next( line for line in f if line.startswith( field ) ).split()[1] )
+
+with open( '/proc/self/clear_refs', 'w' ) as f:
+    f.write( '5' )
+rss = status( 'VmRSS' )
+
+t0 = time.perf_counter()
+for _ in range( repeats ):
+    df = utils_storage.read_table( path, schema, columns )
+print( ( time.perf_counter() - t0 ) / repeats, status( 'VmHWM' ) - rss )
+'''
+
+def run( code, *args ):
+    env = dict( os.environ, PYTHONPATH=os.pathsep.join( filter( None, [ os.path.dirname( os.path.abspath(__file__) ), os.environ.get('PYTHONPATH') ] ) ) )
+    out = subprocess.run( [sys.executable, '-c', code, *map(str, args)], capture_output=True, text=True, check=True, env=env ).stdout.split()
+    return float( out[0] ), int( out[1] )
+
+if pa is None:
+    sys.exit('pyarrow is not available, nothing to compare against')
+
+names = { id(schema): name for name, schema in [('prepped_schema', prepped_schema), ('gaia_candidate_schema', gaia_candidate_schema),
+                                                ('xmatch_schema', xmatch_schema), ('syn_schema', syn_schema)] }
+
+print( f'{"table":>40} {"format":>7} {"columns":>8} {"ms/load":>10} {"peak +MB":>10}' )
+
+with tempfile.TemporaryDirectory() as tmp:
+
+    for path, schema in tables.items():
+
+        if not os.path.exists( path + '.csv' ):
+            continue
+
+        # csv copy, and arrow table written from it, side by side in the temp dir
+        csv_path = os.path.join( tmp, 'csv', path )
+        arrow_path = os.path.join( tmp, 'arrow', path )
+        os.makedirs( os.path.dirname( csv_path ), exist_ok=True )
+        os.makedirs( os.path.dirname( arrow_path ), exist_ok=True )
+
+        df = pd.read_csv( path + '.csv' )
+        df.to_csv( csv_path + '.csv', index=False )
+        write_table( read_table( path, schema ), arrow_path, schema )
+
+        for fmt, table in [ ('csv', csv_path), ('arrow', arrow_path) ]:
+            for columns in [ '', ','.join( projections[path] ) ]:
+                seconds, rss = run( loader, table, names[ id(schema) ], columns, repeats )
+                label = 'all' if not columns else str( len( projections[path] ) )
+                print( f'{path:>40} {fmt:>7} {label:>8} {seconds*1e3:>10.1f} {rss/1024:>10.1f}' )
+
+    # copies only show at scale, each column of the tiled table is ~8 MB
+    if os.path.exists( 'data/wsi24.xmatch.csv' ):
+
+        xmatch = read_table( 'data/wsi24.xmatch', xmatch_schema )
+        xmatch = pd.concat( [ xmatch ] * ( scaled_rows // len(xmatch) + 1 ), ignore_index=True ).iloc[ :scaled_rows ]
+
+        scaled = os.path.join( tmp, 'scaled', 'xmatch' )
+        os.makedirs( os.path.dirname( scaled ), exist_ok=True )
+        write_table( xmatch, scaled, xmatch_schema, csv=True )
+
+        print( f'\n{"scaled xmatch":>40} {"format":>7} {"columns":>8} {"ms/load":>10} {"peak +MB":>10}' )
+        for fmt in [ 'csv', 'arrow' ]:
+            if fmt == 'csv':
+                os.rename( scaled + '.arrow', scaled + '.arrow.off' )
+            for label, columns in scaled_projections.items():
+                seconds, rss = run( loader, scaled, 'xmatch_schema', ','.join( columns ), repeats )
+                print( f'{f"{len(xmatch)} rows":>40} {fmt:>7} {f"{len(columns)} {label}":>8} {seconds*1e3:>10.1f} {rss/1024:>10.1f}' )
+            if fmt == 'csv':
+                os.rename( scaled + '.arrow.off', scaled + '.arrow' )
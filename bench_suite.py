@@ -0,0 +1,200 @@
+"""
+benchmark the pipeline stages on synthetic catalogs from 10^3 to 10^6 wsi observations
+times and memory profiles the wsi_prep join and normalization, the epoch propagation, the gaia crossmatch, the crude selection and the
+synthetic photometry join, saves the results as json and compares them against a saved baseline
+exits with status 1 if any stage got slower than the baseline by more than the tolerance
+"""
+
+import sys
+import json
+import time
+import platform
+import warnings
+import tracemalloc
+import numpy as np
+import pandas as pd
+import astropy
+
+from utils_synthetic import synthetic_catalog
+from utils_misc import wds_index, wds_lookup
+from utils_prep import normalize_wsi
+from utils_wsi_epoch_prop import wsi_J2016_prop
+from utils_xmatch import wsi_gaia_xmatch
+from utils_xmatch_crude_select import crude_selection
+from utils_syn_phot import syn_filters, add_gaia_colors, add_syn_mags, merge_filters
+
+warnings.simplefilter(action='ignore', category=FutureWarning)
+
+# catalog sizes (wsi observations) to run every stage at
+sizes = [ 10**3, 10**4, 10**5, 10**6 ]
+
+# largest size for the stages that still loop in python (xmatch ~0.2 ms a row, crude selection ~1 ms a target), skipped past this
+max_rows = { 'xmatch': 10**5, 'crude_selection': 10**4 }
+
+# each stage is timed this many times and the fastest kept, then run once more under tracemalloc for its peak memory
+repeats = 3
+
+# baseline to compare against, and where this run's results are written
+# with update_baseline = True (or no baseline yet) the results are saved as the new baseline instead
+baseline_path = 'bench_baseline.json'
+results_path = 'bench_results.json'
+update_baseline = False
+
+# a stage has regressed if it takes more than tolerance x its baseline time, and at least min_seconds longer (small runs are noisy)
+tolerance = 1.5
+min_seconds = 0.05
+
+######################################################################################################################################################
+
+# the wsi_prep join, index the wds and look up every observation's entry
+def prep_join( wsi, wds ):
+    return wds_lookup( wsi, wds_index( wds, duplicates='first' ), ['wds_coord', 'wds_mag1', 'wds_mag2', 'wds_pm1_ra', 'wds_pm1_dec',
+                                                                   'wds_pm2_ra', 'wds_pm2_dec', 'wds_notes'] )
+
+# crude selection for every target, given each target's candidates
+def crude_loop( targets ):
+    return [ crude_selection( matches ) for matches in targets ]
+
+# the syn_photometry join, synthetic mags for every filter then merged back in wsi_oid order (catalogs already in memory)
+def syn_join( xmatch, tables ):
+
+    wsi = add_gaia_colors( xmatch.copy() )
+
+    frames = []
+    for wsi_filter, band in syn_filters.items():
+        df = wsi.loc[ wsi.wsi_filter==wsi_filter ].reset_index(drop=True)
+        df = add_syn_mags( df, tables[ band['catalog'] + '1' ], tables[ band['catalog'] + '2' ], band )
+        df['syn_dm'] = np.abs( df.syn1 - df.syn2 )
+        frames.append( df )
+
+    return merge_filters( frames )
+
+######################################################################################################################################################
+
+# a stand in for the crossmatch output, the nearest candidate to each star, so the syn join can run at sizes the xmatch is skipped at
+def nearest_matches( prepped, gaia_pri, gaia_sec ):
+
+    xmatch = prepped.copy()
+    for n, gaia in [ (1, gaia_pri), (2, gaia_sec) ]:
+        nearest = gaia.sort_values( 'target_sep', kind='stable' ).drop_duplicates( 'target_oid' ).set_index( 'target_oid' )
+        nearest = nearest[ ['designation', 'source_id', 'ra', 'dec', 'phot_bp_mean_mag', 'phot_rp_mean_mag'] ].reindex( prepped.wsi_oid )
+        for col in nearest.columns:
+            xmatch[ f'gaia_{col}{n}' ] = nearest[ col ].to_numpy()
+
+    return xmatch
+
+# the inputs of each stage for a synthetic catalog, as stage name -> (rows, function to time)
+# stages in skip are left out (and their inputs never built)
+def bench_stages( tables, skip=() ):
+
+    wsi, wds, prepped = tables['wsi'], tables['wds'], tables['prepped']
+    gaia_pri, gaia_sec = tables['gaia_pri'], tables['gaia_sec']
+
+    # propagation input, the prepped proper motions with the J2000 coordinate the join finds
+    match, _ = prep_join( prepped, wds )
+    prop = prepped[ ['wds_pm1_ra', 'wds_pm1_dec', 'wds_pm2_ra', 'wds_pm2_dec', 'wsi_pa', 'wsi_sep'] ].assign( wds_coord1=match.wds_coord.to_numpy() )
+
+    # normalization input, every observation with its wds columns joined on
+    match, matched = prep_join( wsi, wds )
+    joined = wsi.assign( **{ ( 'wds_coord1' if col == 'wds_coord' else col ): match[ col ].to_numpy() for col in match.columns } )
+
+    stages = { 'prep_join': ( len(wsi), lambda: prep_join( wsi, wds ) ),
+               'prep_normalize': ( len(joined), lambda: normalize_wsi( joined, matched ) ),
+               'J2016_prop': ( len(prop), lambda: wsi_J2016_prop( prop.copy() ) ),
+               'xmatch': ( len(prepped), lambda: wsi_gaia_xmatch( prepped, gaia_pri, gaia_sec ) ) }
+
+    # candidates of each primary, in the frame crude_selection takes
+    if 'crude_selection' not in skip:
+        pri = gaia_pri.reset_index( names='original_index' ).rename( columns={'designation':'gaia_id'} )
+        pri = pri[ ['target_oid', 'gaia_id', 'original_index', 'target_sep', 'target_dm'] ]
+        targets = [ matches.drop( columns='target_oid' ).reset_index( drop=True ) for _, matches in pri.groupby( 'target_oid' ) ]
+        stages['crude_selection'] = ( len(targets), lambda: crude_loop( targets ) )
+
+    xmatch = nearest_matches( prepped, gaia_pri, gaia_sec )
+    stages['syn_join'] = ( len(xmatch), lambda: syn_join( xmatch, tables ) )
+
+    return { name: stage for name, stage in stages.items() if name not in skip }
+
+######################################################################################################################################################
+
+# fastest of some runs (seconds), and the peak memory traced during one more (MB)
+def measure( func, repeats ):
+
+    seconds = np.inf
+    for _ in range( repeats ):
+        t0 = time.perf_counter()
+        func()
+        seconds = min( seconds, time.perf_counter() - t0 )
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+
+    return seconds, peak
+
+# stages that ran slower than their baseline, as (stage, size, seconds, baseline seconds)
+def regressions( results, baseline, tolerance, min_seconds ):
+
+    slower = []
+    for name, runs in results.items():
+        for size, run in runs.items():
+            base = baseline.get( name, {} ).get( size )
+            if run is None or base is None:
+                continue
+            if run['seconds'] > tolerance * base['seconds'] and run['seconds'] - base['seconds'] > min_seconds:
+                slower.append( ( name, size, run['seconds'], base['seconds'] ) )
+
+    return slower
+
+######################################################################################################################################################
+
+results = {}
+
+print( f'{"stage":>16} {"size":>8} {"rows":>8} {"seconds":>9} {"rows/s":>10} {"peak MB":>9}' )
+
+for size in sizes:
+
+    # stages skipped at this size are saved as null
+    skip = [ name for name, limit in max_rows.items() if size > limit ]
+    for name in skip:
+        results.setdefault( name, {} )[ str(size) ] = None
+
+    stages = bench_stages( synthetic_catalog( size ), skip )
+
+    for name, ( rows, func ) in stages.items():
+
+        seconds, peak = measure( func, repeats )
+        results.setdefault( name, {} )[ str(size) ] = { 'rows': rows, 'seconds': seconds, 'rows_per_sec': rows / seconds, 'peak_mb': peak }
+
+        print( f'{name:>16} {size:>8} {rows:>8} {seconds:>9.3f} {rows/seconds:>10.0f} {peak:>9.1f}' )
+
+run = { 'created': time.strftime( '%Y-%m-%dT%H:%M:%S' ),
+        'machine': { 'platform': platform.platform(), 'processor': platform.processor(), 'python': platform.python_version(),
+                     'numpy': np.__version__, 'pandas': pd.__version__, 'astropy': astropy.__version__ },
+        'repeats': repeats,
+        'results': results }
+
+try:
+    with open( baseline_path ) as f:
+        baseline = json.load( f )
+except FileNotFoundError:
+    baseline = None
+
+if update_baseline or baseline is None:
+    with open( baseline_path, 'w' ) as f:
+        json.dump( run, f, indent=2 )
+    print( f'saved baseline to {baseline_path}' )
+    sys.exit()
+
+with open( results_path, 'w' ) as f:
+    json.dump( run, f, indent=2 )
+
+slower = regressions( results, baseline['results'], tolerance, min_seconds )
+for name, size, seconds, base in slower:
+    print( f'regression: {name} at {size} rows took {seconds:.3f} s, baseline {base:.3f} s ({seconds/base:.1f}x)' )
+
+if slower:
+    sys.exit( 1 )
+
+print( f'no regressions against {baseline_path} (created {baseline["created"]})' )
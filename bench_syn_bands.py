@@ -0,0 +1,65 @@
+"""
+benchmark loading one synthetic photometry band through the band store against reading the whole catalog, on synthetic catalogs
+prints the time and peak memory of a lookup of every source in the catalog with the full csv read (what filter_syn_phot did),
+through the band store the first time (reads the band's columns and caches them) and once the band is cached (memory mapped)
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import warnings
+import tracemalloc
+import pandas as pd
+
+from utils_synthetic import synthetic_catalog
+from utils_syn_phot import band, syn_lookup, band_lookup, band_cache
+
+warnings.simplefilter(action='ignore', category=FutureWarning)
+
+# catalog sizes (wsi observations)
+sizes = [ 10**4, 10**5, 10**6 ]
+
+# band to load
+name = 'y'
+
+######################################################################################################################################################
+
+# time (seconds) and traced peak memory (MB) of one call
+def measure( func ):
+
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+
+    return seconds, peak
+
+######################################################################################################################################################
+
+b = band( name )
+folder = tempfile.mkdtemp()
+
+print( f'{"size":>8} {"rows":>8} {"columns":>8} {"load":>12} {"seconds":>9} {"peak MB":>9}' )
+
+try:
+    for size in sizes:
+
+        catalog = synthetic_catalog( size )[ b['catalog'] + '1' ]
+        path = os.path.join( folder, f'{b["catalog"]}1.syn.csv' )
+        catalog.to_csv( path, index=False )
+        shutil.rmtree( band_cache( path ), ignore_errors=True )
+
+        source_ids = catalog.source_id.to_numpy()
+        loads = { 'full csv': lambda: syn_lookup( source_ids, pd.read_csv( path ), [ b['mag'] ] ),
+                  'store, cold': lambda: band_lookup( source_ids, path, [ b['mag'] ] ),
+                  'store, cached': lambda: band_lookup( source_ids, path, [ b['mag'] ] ) }
+
+        for load, func in loads.items():
+            seconds, peak = measure( func )
+            print( f'{size:>8} {len(catalog):>8} {catalog.shape[1]:>8} {load:>12} {seconds:>9.3f} {peak:>9.1f}' )
+
+finally:
+    shutil.rmtree( folder )
@@ -0,0 +1,134 @@
+"""
+benchmark the streaming wds summary reader against the astropy fixed width reader used in wds_to_csv
+writes a synthetic wds summary in the same fixed width layout, checks both readers agree on it,
+then prints the parse time and peak memory for the full file and for a pushed down wds_id subset
+"""
+
+import os
+import time
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+from astropy.io import ascii
+
+from utils_wds import wds_fields, read_wds
+
+# lines in the synthetic summary (the real one is ~150k), lines checked against astropy, systems in the subset
+lines = 150_000
+check_lines = 5_000
+subset = 3_000
+
+# write a synthetic wds summary with n lines, blanks and '.' placeholders included
+def fake_wds( path, n, seed=0 ):
+
+    rng = np.random.default_rng( seed )
+
+    ra = rng.uniform( 0, 24, n )
+    dec = np.degrees( np.arcsin( rng.uniform( -1, 1, n ) ) )
+    sign = np.where( dec < 0, '-', '+' )
+    adec = np.abs( dec )
+
+    hh, mm, ss = ra.astype(int), (ra*60 % 60).astype(int), np.round( ra*3600 % 60, 2 ) % 60
+    dd, dm, ds = adec.astype(int), (adec*60 % 60).astype(int), np.round( adec*3600 % 60, 1 ) % 60
+
+    mag1 = rng.uniform( 2, 15, n )
+    mag2 = mag1 + rng.uniform( 0, 5, n )
+    no_mag2 = rng.random( n ) < 0.05
+    no_pm2 = rng.random( n ) < 0.2
+    notes = rng.choice( [ '', 'N', 'P', 'NP', 'V', 'O' ], n, p=[ 0.6, 0.2, 0.05, 0.05, 0.05, 0.05 ] )
+    comps = rng.choice( [ '', 'AB', 'AC', 'BC', 'Aa,Ab', 'AB,C' ], n )
+
+    def put( line, name, text ):
+        first, last, _ = wds_fields[ name ]
+        text = text[ : last - first + 1 ]
+        line[ first : first + len(text) ] = text
+
+    with open( path, 'w' ) as f:
+        for i in range( n ):
+            line = [' '] * 135
+
+            put( line, 'wds_id', f'{hh[i]:02d}{mm[i]:02d}{int(ss[i]/6):1d}{sign[i]}{dd[i]:02d}{dm[i]:02d}' )
+            put( line, 'wds_dd', f'STF{i % 9999:4d}' )
+            put( line, 'wds_comp', comps[i] )
+            put( line, 'wds_date_first', f'{rng.integers(1780, 2000):4d}' )
+            put( line, 'wds_date_last', f'{rng.integers(2000, 2024):4d}' )
+            put( line, 'wds_num_obs', f'{rng.integers(1, 999):4d}' )
+            put( line, 'wds_pa_first', f'{rng.integers(0, 360):3d}' )
+            put( line, 'wds_pa_last', f'{rng.integers(0, 360):3d}' )
+            put( line, 'wds_sep_first', f'{rng.uniform(0.1, 99):5.1f}' )
+            put( line, 'wds_sep_last', f'{rng.uniform(0.1, 99):5.1f}' )
+            put( line, 'wds_mag1', f'{mag1[i]:5.2f}' )
+            put( line, 'wds_mag2', '    .' if no_mag2[i] else f'{mag2[i]:5.2f}' )
+            put( line, 'wds_spt', 'G5V+A0V' )
+            put( line, 'wds_pm1_ra', f'{rng.integers(-999, 999):+04d}' )
+            put( line, 'wds_pm1_dec', f'{rng.integers(-999, 999):+04d}' )
+            if not no_pm2[i]:
+                put( line, 'wds_pm2_ra', f'{rng.integers(-999, 999):+04d}' )
+                put( line, 'wds_pm2_dec', f'{rng.integers(-999, 999):+04d}' )
+            put( line, 'wds_durch_num', f'N+74{i % 9999:4d}' )
+            put( line, 'wds_notes', notes[i] )
+            put( line, 'wds_coord', f'{hh[i]:02d} {mm[i]:02d} {ss[i]:05.2f} {sign[i]}{dd[i]:02d} {dm[i]:02d} {ds[i]:04.1f}' )
+
+            f.write( ''.join( line ) + '\n' )
+
+# the reader used in wds_to_csv
+def astropy_wds( path ):
+    return ascii.read( path, format="fixed_width_no_header", delimiter=' ',
+                       col_starts=[ first for first, _, _ in wds_fields.values() ],
+                       col_ends=[ last for _, last, _ in wds_fields.values() ],
+                       names=list( wds_fields ) ).to_pandas()
+
+# seconds and peak traced memory (MB) of a call
+def measure( func ):
+    t0 = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - t0
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+
+    return seconds, peak
+
+with tempfile.TemporaryDirectory() as tmp:
+
+    path = os.path.join( tmp, 'wds.summ' )
+    fake_wds( path, lines )
+
+    # same values as astropy on the first lines ('.' placeholders are nan)
+    # trailing spaces are stripped here, so the ragged line path gets checked too
+    small = os.path.join( tmp, 'wds.small' )
+    with open( path ) as f, open( small, 'w' ) as g:
+        g.writelines( f.readline().rstrip() + '\n' for _ in range( check_lines ) )
+
+    # and full width lines with no newline after the last one, so the fixed width path gets checked without its trailing newline
+    unterminated = os.path.join( tmp, 'wds.unterminated' )
+    with open( path ) as f, open( unterminated, 'w' ) as g:
+        g.write( ''.join( f.readline() for _ in range( check_lines ) ).rstrip( '\n' ) )
+
+    for checked in [ small, unterminated ]:
+        expected = astropy_wds( checked ).replace( '.', np.nan )
+        parsed = read_wds( checked )
+        for name, (_, _, kind) in wds_fields.items():
+            a, b = expected[ name ], parsed[ name ]
+            if kind == 'str':
+                same = ( a.fillna('').astype(str) == b.fillna('') ).all()
+            else:
+                same = np.allclose( a.astype(float), b.astype(float), equal_nan=True )
+            if not same or len(a) != len(b):
+                print( f'{name} differs from astropy in {os.path.basename( checked )}' )
+
+    wanted = pd.Series( read_wds( path, columns=['wds_id'] ).wds_id.unique() ).sample( subset, random_state=0 )
+
+    print( f'{"reader":>28} {"rows":>8} {"seconds":>8} {"peak MB":>8}' )
+
+    runs = { 'astropy': lambda: astropy_wds( path ),
+             'streaming': lambda: read_wds( path ),
+             'streaming, 1 MB chunks': lambda: read_wds( path, chunk_bytes=1<<20 ),
+             f'streaming, {subset} ids': lambda: read_wds( path, wds_ids=wanted ) }
+
+    for name, func in runs.items():
+        seconds, peak = measure( func )
+        print( f'{name:>28} {len(func()):>8} {seconds:>8.2f} {peak:>8.1f}' )
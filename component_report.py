@@ -0,0 +1,30 @@
+import os
+import numpy as np
+import pandas as pd
+
+from utils_components import component_savings
+
+# catalogs to report on, skipped if not there
+# each row of wsi24 is an observation, each row of the wds summary is an entry (one per pair)
+catalogs = { 'wsi24': 'data/wsi24.csv',
+             'wds': 'data/wds.summ.csv' }
+
+# how much redundant work the component graph avoids on each catalog
+for name, path in catalogs.items():
+
+    if not os.path.exists( path ):
+        print( f'{name}: {path} not found, skipping' )
+        continue
+
+    catalog = pd.read_csv( path, usecols=lambda c: c in ['wds_id', 'wds_comp', 'wsi_sep_e'] ).replace({'wds_comp':np.nan},'AB')
+    catalog = catalog.astype( {'wds_id':str, 'wds_comp':str} )
+
+    savings = component_savings( catalog )
+
+    print( f'{name}: {savings["rows"]} rows, {savings["systems"]} systems, {savings["components"]} components' )
+    print( f'  components positioned from a precise coordinate: {savings["positioned_from_precise_coord"]}' )
+    print( f'  secondaries with a precise coordinate of their own: {savings["secondaries_with_precise_coord"]}' )
+
+    for work in ['propagations', 'simbad_searches', 'gaia_primary_selections']:
+        before, after = savings[ work ]
+        print( f'  {work}: {before} -> {after} ({before - after} avoided, {1 - after/before:.0%})' )
@@ -1,31 +1,23 @@
 import numpy as np
 import pandas as pd
 
-# import wds as dataframe
-wds = pd.read_csv('data/wds_components.summ.csv').replace(np.NaN, '')
-wsi = pd.read_csv('data/wsi24.csv').replace(np.NaN, '')
+from utils_misc import stream_reduce_targets
+from utils_skycoords import parse_wds_coords
 
-# filter wds based on wsi targets
+# import wsi as dataframe
+wsi = pd.read_csv('data/wsi24.csv').replace(np.nan, '')
 
-# list of unique targets remaining in wsi (using WDS ID)
-wsi_unique_targets = list( np.unique( wsi['wds_id'] ) )
+# import wds as dataframe, filtered to the wsi targets as it streams in
+wds, _, _ = stream_reduce_targets('data/wds_components.summ.csv', wsi, dtype={'wds_id':str})
+wds = wds.replace(np.nan, '')
 
-# reduce wds catalog based on the wsi unique targets
-wds = wds.loc[ wds['wds_id'].isin(wsi_unique_targets) ]
+# find blank (or malformed) coordinates
 
-# reset index
-wds = wds.reset_index(drop=True)
+# coordinates that don't parse as wds precise coordinates
+_, _, valid = parse_wds_coords( wds.wds_coord )
 
-# find number of empty coordinates
-
-# get list of unique coordinates
-uniq_coord = np.unique(wds.wds_coord)
-
-# 'empty coord'
-empty_coord = uniq_coord[0]
-
-# entries in the wds with this coordinate
-wds_blanks = wds.loc[ wds.wds_coord == empty_coord ]
+# entries in the wds with these coordinates
+wds_blanks = wds.loc[ ~valid ]
 
 # unique targets with this coord
 targ_list = np.unique( wds_blanks.wds_id )
@@ -5,18 +5,19 @@ check for errors in wds ID in the wsi24 list, by matching unique WDS IDs in wsi2
 import numpy as np
 import pandas as pd
 
-# read in wds and wsi24 catalog
-wds = pd.read_csv('data/wds.summ.csv')
+from utils_misc import stream_reduce_targets
+
+# read in wsi24 catalog
 wsi = pd.read_csv('data/wsi24.csv')
 
 # get list of unique targets in wsi24 catalog and sort them
 wsi_unique_targets = np.sort( np.unique( wsi['wds_id'] ) )
 
-# filter wds catalog based on this list
-wds_reduced = wds.loc[ wds['wds_id'].isin(wsi_unique_targets) ]
+# filter wds catalog based on this list as it streams in, only the ids are read
+wds_reduced, found, missing = stream_reduce_targets('data/wds.summ.csv', wsi, usecols=['wds_id'], dtype={'wds_id':str})
 
-# find unique targets in reduced wds catalog and sort
-wds_reduced_unique_targets = np.sort( np.unique( wds_reduced['wds_id'] ) )
+# unique targets in reduced wds catalog, sorted
+wds_reduced_unique_targets = np.sort( list( found ) )
 
 # compare the unique target lists
 if list(wsi_unique_targets) == list(wds_reduced_unique_targets):
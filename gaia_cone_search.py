@@ -0,0 +1,32 @@
+"""
+builds the primary and secondary gaia candidate tables locally from a gaia source extract, instead of querying the archive
+output has the same schema as the archive results in data/gaia.results
+"""
+
+import time
+import pandas as pd
+
+from utils_cone_search import read_gaia_extract, gaia_index, gaia_candidates
+
+# search tolerances, (radius in arcsec, magnitude window)
+pri_radius, pri_mag_window = 5, 4
+sec_radius, sec_mag_window = 10, 4
+
+# load in data
+wsi = pd.read_csv('data/wsi24.prepped.csv')
+gaia = read_gaia_extract('data/gaia.extract.parquet')
+
+# index the extract, zones about the size of the largest search
+t0 = time.perf_counter()
+index = gaia_index( gaia, zone_height=max(pri_radius, sec_radius)/3600 )
+print(f'indexed {len(gaia)} sources in {time.perf_counter()-t0:.2f} s')
+
+# run the cone searches
+t0 = time.perf_counter()
+gaia_pri = gaia_candidates( wsi, index, component=1, radius=pri_radius, mag_window=pri_mag_window )
+gaia_sec = gaia_candidates( wsi, index, component=2, radius=sec_radius, mag_window=sec_mag_window )
+print(f'{2*len(wsi)} cone searches in {time.perf_counter()-t0:.2f} s')
+
+# save results, named like the archive results
+gaia_pri.to_csv(f'data/gaia.results/pri.{pri_mag_window:02d}mag.{pri_radius:02d}as-local.csv', index=False)
+gaia_sec.to_csv(f'data/gaia.results/sec.{sec_mag_window:02d}mag.{sec_radius:02d}as-local.csv', index=False)
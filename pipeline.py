@@ -0,0 +1,73 @@
+"""
+runs prep -> xmatch -> synthetic photometry, only re-running the stages whose inputs, code or parameters changed
+the y and V synthetic photometry branches run at the same time, a manifest of the run is written to data/pipeline.manifest.json
+"""
+
+import utils_profile as profile
+from utils_pipeline import stage, script, local_imports, run_pipeline
+from utils_syn_phot import syn_filters, add_gaia_colors, filter_syn_phot, merge_filters
+from utils_storage import read_table, write_table, table_files, table_source, xmatch_schema, syn_schema
+
+# stages to run even if they are up to date, e.g. ['xmatch']
+force = []
+
+# instrument the run, e.g. 'data/profile' writes data/profile.json and data/profile.trace.json (None to leave it off)
+profile_path = None
+
+# synthetic photometry for the observations in one wsi filter
+def syn_branch( wsi_filter ):
+
+    wsi = add_gaia_colors( read_table('data/wsi24.xmatch', xmatch_schema) )
+    df = filter_syn_phot( wsi, wsi_filter )
+
+    write_table( df, f'data/syn.phot/{wsi_filter.lower()}.syn', syn_schema, csv=True )
+
+# combine the filter branches
+def syn_merge():
+
+    frames = [ read_table(f'data/syn.phot/{wsi_filter.lower()}.syn', syn_schema) for wsi_filter in syn_filters ]
+
+    write_table( merge_filters( frames ), 'data/syn.phot/wsi24.syn', syn_schema, csv=True )
+
+# code each stage runs, the scripts and the local modules they import (changes to any of it re-run the stage)
+# the synthetic photometry stages are the functions above, their own source is part of the fingerprint
+prep_code = local_imports('wsi_prep.py')
+xmatch_code = local_imports('wsi_xmatch.py')
+syn_code = local_imports('utils_syn_phot.py', 'utils_storage.py')
+
+# tables are declared by all the files write_table makes, so a stale .arrow next to a fresh .csv can't be read as up to date
+stages = {
+    'prep': stage( script('wsi_prep.py'),
+                   inputs = prep_code + ['data/wsi24.csv', 'data/wds.summ.csv'],
+                   outputs = table_files('data/wsi24.prepped') ),
+
+    'xmatch': stage( script('wsi_xmatch.py'),
+                     inputs = xmatch_code + table_files('data/wsi24.prepped') + [
+                                             table_source('data/gaia.results/pri.04mag.05as-result'),
+                                             table_source('data/gaia.results/sec.04mag.10as-result')],
+                     outputs = table_files('data/wsi24.xmatch') ),
+
+    # one branch per filter
+    **{ f'syn_{wsi_filter}': stage( syn_branch,
+                                    inputs = syn_code + table_files('data/wsi24.xmatch') + [
+                                                         f'data/syn.phot/{band["catalog"]}1.syn.csv',
+                                                         f'data/syn.phot/{band["catalog"]}2.syn.csv'],
+                                    outputs = table_files(f'data/syn.phot/{wsi_filter.lower()}.syn'),
+                                    params = {'wsi_filter': wsi_filter} )
+        for wsi_filter, band in syn_filters.items() },
+
+    'syn_merge': stage( syn_merge,
+                        inputs = syn_code + [ path for wsi_filter in syn_filters for path in table_files(f'data/syn.phot/{wsi_filter.lower()}.syn') ],
+                        outputs = table_files('data/syn.phot/wsi24.syn') ),
+}
+
+if profile_path:
+    profile.enable()
+
+run = run_pipeline( stages, force=force )
+
+if profile_path:
+    profile.save( profile_path )
+
+hits = sum( record['cached'] for record in run['stages'].values() )
+print(f'{len(stages)} stages in {run["seconds"]:.2f} s, {hits} cached')
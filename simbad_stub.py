@@ -0,0 +1,126 @@
+"""
+local stand-in for the simbad tap service, for testing and benchmarking the simbad queries without the network
+answers the single and batch identifier queries made by utils_simbad with csv results, with optional latency and random failures
+
+run on its own with: python simbad_stub.py (serves the wsi24 simbad results on http://127.0.0.1:8765/sim-tap/sync)
+"""
+
+import re
+import csv
+import io
+import time
+import random
+import threading
+import urllib.parse
+import numpy as np
+import pandas as pd
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+#######################################################################################################################################
+
+# identifier table from the simbad results already in wsi24
+# maps the identifier searched for each star ('WDS J' + wds_id + component) to the identifiers simbad returned
+def wsi_identifiers( wsi ):
+
+    idents = {}
+
+    for wds_id, comp, sb1, sb2, flg1, flg2 in zip( wsi.wds_id, wsi.wds_comp, wsi.sb_id1, wsi.sb_id2, wsi.sb_flg1, wsi.sb_flg2 ):
+
+        # component labels of the primary and secondary
+        pri, sec = ( comp[0], comp[1] ) if len( comp ) == 2 else comp.split( ',' )
+
+        for label, sb_id, flag in [ (pri, sb1, flg1), (sec, sb2, flg2) ]:
+
+            # '!' means the first search failed and the fallback found it
+            # the fallback for an AB format comp is the full comp, for a two letter star it is the first letter
+            if flag == '!':
+                label = comp if len( comp ) == 2 else label[0]
+
+            if flag in ('.', '!'):
+                name = 'WDS J' + wds_id + label
+                idents[ name ] = [ name, sb_id ]
+
+    return idents
+
+#######################################################################################################################################
+
+# serve the identifier table on a local port (0 picks a free one) in a background thread
+# latency is the delay (seconds) added to every request, fail_rate the fraction of requests answered with a 503
+# batch queries (id1.id IN (...)) with more than max_batch identifiers are answered with a 413
+# returns the server (call server.shutdown() when done) and the url of its sync endpoint
+def serve( idents, port=0, latency=0.0, fail_rate=0.0, max_batch=None ):
+
+    pattern = re.compile( r"WHERE\s+id1\.id\s*=\s*'((?:[^']|'')*)'", re.IGNORECASE )
+    batch_pattern = re.compile( r"WHERE\s+id1\.id\s+IN\s*\((.*)\)\s+AND\s+id2\.id\s+LIKE\s+'Gaia DR3%'", re.IGNORECASE | re.DOTALL )
+    quoted = re.compile( r"'((?:[^']|'')*)'" )
+
+    class Handler( BaseHTTPRequestHandler ):
+
+        def log_message( self, *args ):
+            pass
+
+        def answer( self, params ):
+            time.sleep( latency )
+
+            if random.random() < fail_rate:
+                self.send_error( 503 )
+                return
+
+            query = params.get( 'QUERY', [''] )[0]
+            out = io.StringIO()
+            writer = csv.writer( out )
+
+            # batch query, one row for each gaia id of each identifier
+            batch = batch_pattern.search( query )
+            if batch is not None:
+                names = [ name.replace( "''", "'" ) for name in quoted.findall( batch.group(1) ) ]
+
+                if max_batch is not None and len( names ) > max_batch:
+                    self.send_error( 413, 'too many identifiers' )
+                    return
+
+                writer.writerow( ['id', 'id'] )
+                for name in names:
+                    for ident in idents.get( name, [] ):
+                        if ident.startswith( 'Gaia DR3' ):
+                            writer.writerow( [name, ident] )
+
+            # single identifier query, header then one row per identifier of the object
+            else:
+                match = pattern.search( query )
+                if match is None:
+                    self.send_error( 400, 'unsupported query' )
+                    return
+
+                writer.writerow( ['id'] )
+                for ident in idents.get( match.group(1).replace( "''", "'" ), [] ):
+                    writer.writerow( [ident] )
+
+            body = out.getvalue().encode()
+            self.send_response( 200 )
+            self.send_header( 'Content-Type', 'text/csv' )
+            self.send_header( 'Content-Length', str( len(body) ) )
+            self.end_headers()
+            self.wfile.write( body )
+
+        def do_GET( self ):
+            self.answer( urllib.parse.parse_qs( urllib.parse.urlparse( self.path ).query ) )
+
+        def do_POST( self ):
+            length = int( self.headers.get( 'Content-Length', 0 ) )
+            self.answer( urllib.parse.parse_qs( self.rfile.read( length ).decode() ) )
+
+    server = ThreadingHTTPServer( ('127.0.0.1', port), Handler )
+    server.daemon_threads = True
+    threading.Thread( target=server.serve_forever, daemon=True ).start()
+
+    return server, f'http://127.0.0.1:{server.server_address[1]}/sim-tap/sync'
+
+#######################################################################################################################################
+
+if __name__ == '__main__':
+
+    wsi = pd.read_csv('data/wsi24.csv').replace({'wds_comp':np.nan},'AB')
+    server, url = serve( wsi_identifiers( wsi ), port=8765 )
+    print('serving', url)
+    threading.Event().wait()
@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+
+from utils_storage import gaia_source_schema
+from utils_ids import source_id_array
+
+######################################################################################################################################################
+
+# compact candidate store
+# every row of the gaia candidate tables repeats its target (wds_id, wds_comp, wsi_sep, target_ra/dec/mag), and a star near both
+# components of a pair is in the primary and the secondary table with all its gaia columns. the store keeps each of them once:
+#
+#   'sources':    one row per gaia star (distinct source_id over both tables), the gaia_source_schema columns
+#   'source_ids': int64 source_id of each source (-1 for none), what the selections and the exclusion compare
+#   'pri', 'sec': one phase per query, each a csr matrix from targets to sources
+#       'targets':    one row per target_oid, sorted, the target columns
+#       'offsets':    the links of target i are offsets[i]:offsets[i+1]
+#       'source':     int32 row in sources of each link
+#       'target_sep', 'target_dm': the columns that belong to a (target, star) pair
+#
+# links keep the candidates' original order within each target, so the selections see the same candidates in the same order
+
+# gaia columns of a star, kept once per source
+source_columns = list( gaia_source_schema )
+
+# columns of a target, kept once per target
+header_columns = ['target_oid', 'wds_id', 'wds_comp', 'wsi_sep', 'target_ra', 'target_dec', 'target_mag']
+
+# columns of a (target, star) pair, kept once per link
+link_columns = ['target_sep', 'target_dm']
+
+######################################################################################################################################################
+
+# build the store from the primary and secondary candidate tables (gaia_candidate_schema)
+def candidate_store( gaia_pri, gaia_sec ):
+
+    both = pd.concat( [ gaia_pri[ source_columns ], gaia_sec[ source_columns ] ], ignore_index=True )
+
+    # one source per source_id, numbered in order of first appearance (a star has the same gaia columns in both tables)
+    # candidates without a source_id are each their own source
+    ids = source_id_array( both['source_id'] )
+    keys = np.where( ids >= 0, ids, -1 - np.arange( len(ids) ) )
+    rows, _ = pd.factorize( keys )
+    first = np.unique( rows, return_index=True )[1]
+
+    sources = both.iloc[ first ].reset_index( drop=True )
+
+    # a handful of distinct flags, as a categorical they take a byte a source instead of a string
+    sources['phot_variable_flag'] = sources['phot_variable_flag'].astype( 'category' )
+
+    return { 'sources': sources,
+             'source_ids': ids[ first ],
+             'pri': candidate_links( gaia_pri, rows[ :len(gaia_pri) ] ),
+             'sec': candidate_links( gaia_sec, rows[ len(gaia_pri): ] ) }
+
+# one phase of the store from a candidate table and the source row of each of its candidates
+def candidate_links( gaia, rows ):
+
+    # stable sort keeps candidates in their original order within each target
+    oids = gaia['target_oid'].to_numpy( dtype=np.int64 )
+    order = np.argsort( oids, kind='stable' )
+    oids = oids[ order ]
+
+    # first link of each target
+    first = np.flatnonzero( np.r_[ True, oids[1:] != oids[:-1] ] ) if len(oids) else np.array( [], dtype=np.int64 )
+
+    targets = gaia.iloc[ order[ first ] ][ header_columns ].reset_index( drop=True )
+    targets['target_oid'] = oids[ first ]
+
+    return { 'targets': targets,
+             'offsets': np.r_[ first, len(oids) ].astype( np.int64 ),
+             'source': rows[ order ].astype( np.int32 ),
+             **{ col: gaia[ col ].to_numpy( dtype=float )[ order ] for col in link_columns } }
+
+######################################################################################################################################################
+
+# start/end offsets of the links of each oid, an empty slice (start == end) if a target has no candidates
+def target_slices( phase, oids ):
+
+    oids = np.asarray( oids, dtype=np.int64 )
+    targets = phase['targets']['target_oid'].to_numpy()
+    offsets = phase['offsets']
+
+    at = np.searchsorted( targets, oids )
+    known = at < len(targets)
+    known[ known ] = targets[ at[known] ] == oids[ known ]
+
+    starts = np.where( known, offsets[ np.minimum( at, len(targets) ) ], 0 )
+    ends = np.where( known, offsets[ np.minimum( at + 1, len(targets) ) ], 0 )
+
+    return starts, ends
+
+# the link columns the selections read, with each link's star columns gathered from the sources
+# original_index is the link number, phase['source'][ original_index ] is the star
+def link_candidates( store, phase, columns ):
+
+    source = phase['source']
+    candidates = {}
+
+    for col in columns:
+        if col == 'original_index':
+            candidates[ col ] = np.arange( len(source) )
+        elif col == 'source_id':
+            candidates[ col ] = store['source_ids'][ source ]
+        elif col in link_columns:
+            candidates[ col ] = phase[ col ]
+        else:
+            candidates[ col ] = store['sources'][ col ].to_numpy( dtype=float )[ source ]
+
+    return pd.DataFrame( candidates )
+
+# a phase without the links to some source rows (the primary choices, for the secondary search), same targets
+def drop_sources( store, phase, rows ):
+
+    dropped = np.zeros( len( store['sources'] ), dtype=bool )
+    dropped[ rows ] = True
+    keep = ~dropped[ phase['source'] ]
+
+    # each offset moves back by the links dropped before it
+    kept = np.r_[ 0, np.cumsum( keep ) ]
+
+    return { 'targets': phase['targets'],
+             'offsets': kept[ phase['offsets'] ],
+             'source': phase['source'][ keep ],
+             **{ col: phase[ col ][ keep ] for col in link_columns } }
+
+######################################################################################################################################################
+
+# bytes of a table or of a store (deep, so strings count)
+def table_bytes( table ):
+    return int( table.memory_usage( deep=True, index=False ).sum() )
+
+def store_bytes( store ):
+
+    total = table_bytes( store['sources'] ) + store['source_ids'].nbytes
+    for phase in ( store['pri'], store['sec'] ):
+        total += table_bytes( phase['targets'] ) + phase['offsets'].nbytes + phase['source'].nbytes
+        total += sum( phase[ col ].nbytes for col in link_columns )
+
+    return total
+
+# size of the candidate tables against the store built from them
+def store_summary( gaia_pri, gaia_sec, store ):
+
+    candidates = len( gaia_pri ) + len( gaia_sec )
+    tables, compact = table_bytes( gaia_pri ) + table_bytes( gaia_sec ), store_bytes( store )
+
+    return { 'candidates': candidates,
+             'sources': len( store['sources'] ),
+             'targets': len( store['pri']['targets'] ) + len( store['sec']['targets'] ),
+             'table_bytes_per_candidate': tables / max( candidates, 1 ),
+             'store_bytes_per_candidate': compact / max( candidates, 1 ) }
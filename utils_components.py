@@ -0,0 +1,141 @@
+import numpy as np
+import pandas as pd
+
+import utils_profile as profile
+from utils_wsi_epoch_prop import J2016_prop_batch
+
+######################################################################################################################################################
+
+# component graph of each system
+# every observation (or wds entry) of a pair is an edge from its primary component to its secondary component, with the
+# components named by wds_id + the labels from splitting wds_comp ('AB' -> A, B   'A,BC' -> A, BC   'AB,CD' -> AB, CD)
+# a system observed as AB, AC and BC has three components, not six, so each one only needs to be positioned, propagated and
+# looked up once, and the result fanned out to every observation it is in
+#
+# the best determined position of a component is the precise wds coordinate of an entry it is the primary of, and otherwise
+# the offset from the primary of the observation with the smallest separation error
+
+######################################################################################################################################################
+
+# primary and secondary labels of a wds component string
+def split_comp( comp ):
+
+    if ',' in comp:
+        pri, sec = comp.split( ',', 1 )
+        return pri, sec
+
+    # 'AB', 'BC', ...
+    if len( comp ) == 2:
+        return comp[0], comp[1]
+
+    # anything else, e.g. 'Aa1Aa2', splits after the first component's letters
+    for i in range( 1, len(comp) ):
+        if comp[i].isupper():
+            return comp[:i], comp[i:]
+
+    return comp, ''
+
+# labels of every row, each distinct comp string is only split once
+def comp_labels( comps ):
+
+    comps = pd.Series( comps, dtype=object ).fillna( 'AB' ).astype( str )
+    split = { comp: split_comp( comp ) for comp in comps.unique() }
+
+    return comps.map( lambda c: split[c][0] ).to_numpy( dtype=object ), comps.map( lambda c: split[c][1] ).to_numpy( dtype=object )
+
+######################################################################################################################################################
+
+# build the component graph of a catalog with wds_id and wds_comp columns (and wsi_sep_e, used to pick the best measurement)
+# returns a dict with
+#   'components': one row per component (wds_id, label, source_row, source_role, n_obs), indexed by component number
+#   'pri', 'sec': the component number of the primary and secondary of every row of the catalog
+# source_role is 1 if the component's position comes from the precise coordinate of source_row, 2 if from its measured offset
+def component_graph( catalog ):
+
+    n = len( catalog )
+    pri_label, sec_label = comp_labels( catalog['wds_comp'] )
+    sep_e = catalog['wsi_sep_e'].to_numpy( dtype=float ) if 'wsi_sep_e' in catalog else np.zeros( n )
+
+    # every place a component shows up, as the primary or the secondary of a row
+    wds_ids = catalog['wds_id'].to_numpy( dtype=object )
+    places = pd.DataFrame({ 'wds_id': np.concatenate( [ wds_ids, wds_ids ] ),
+                            'label': np.concatenate( [ pri_label, sec_label ] ),
+                            'row': np.tile( np.arange(n), 2 ),
+                            'role': np.repeat( [1, 2], n ),
+                            'sep_e': np.concatenate( [ np.zeros(n), sep_e ] ) })
+
+    # components numbered in order of first appearance
+    places['component'] = places.groupby( ['wds_id', 'label'], sort=False ).ngroup().to_numpy()
+
+    # best position source: a precise coordinate first, then the smallest separation error, then the first row
+    best = places.sort_values( ['component', 'role', 'sep_e', 'row'], kind='stable' ).drop_duplicates( 'component' )
+
+    components = pd.DataFrame({ 'wds_id': best.wds_id.to_numpy(), 'label': best.label.to_numpy(),
+                                'source_row': best.row.to_numpy(), 'source_role': best.role.to_numpy(),
+                                'n_obs': np.bincount( places.component, minlength=len(best) ) })
+    components.index.name = 'component'
+
+    component = places.component.to_numpy()
+
+    return { 'components': components, 'pri': component[:n], 'sec': component[n:] }
+
+######################################################################################################################################################
+
+# wsi_J2016_prop, with every component propagated once from its best position source and fanned out to its observations
+# the secondary of an observation is no longer offset from that observation's own measurement when the component is positioned
+# better elsewhere (the precise coordinate of another pair, or a measurement with a smaller separation error)
+# memo: a memoized_propagation to propagate with instead of J2016_prop_batch
+@profile.timed()
+def component_J2016_prop( wsi, graph=None, memo=None ):
+
+    if len(wsi) == 0:
+        for col in ['wds_ra1', 'wds_dec1', 'wds_ra2', 'wds_dec2']:
+            wsi[col] = np.array( [], dtype=float )
+        return wsi
+
+    graph = graph or component_graph( wsi )
+    components = graph['components']
+
+    # propagate just the rows some component takes its position from
+    rows = np.unique( components.source_row )
+    source = wsi.iloc[ rows ]
+    prop = ( memo or J2016_prop_batch )( source.wds_coord1, source.wds_pm1_ra, source.wds_pm1_dec,
+                                         source.wds_pm2_ra, source.wds_pm2_dec, source.wsi_pa, source.wsi_sep )
+
+    # position of each component, from the primary or secondary half of its source row
+    at = np.searchsorted( rows, components.source_row.to_numpy() )
+    primary = components.source_role.to_numpy() == 1
+    ra = np.where( primary, prop.wds_ra1.to_numpy()[ at ], prop.wds_ra2.to_numpy()[ at ] )
+    dec = np.where( primary, prop.wds_dec1.to_numpy()[ at ], prop.wds_dec2.to_numpy()[ at ] )
+
+    # fan out to every observation
+    wsi['wds_ra1']  = ra[ graph['pri'] ]
+    wsi['wds_dec1'] = dec[ graph['pri'] ]
+    wsi['wds_ra2']  = ra[ graph['sec'] ]
+    wsi['wds_dec2'] = dec[ graph['sec'] ]
+
+    return wsi
+
+######################################################################################################################################################
+
+# the work the component graph saves on a catalog, per observation (or wds entry) vs per component
+# propagations: 2 stars per row vs one per component
+# simbad searches: 2 component searches per row vs one per distinct (wds_id, comp) pair (the searches of a pair run once)
+# gaia selections: a primary selection per row vs one per primary component
+def component_savings( catalog ):
+
+    graph = component_graph( catalog )
+    components = graph['components']
+    n = len( catalog )
+
+    pairs = len( catalog[['wds_id', 'wds_comp']].drop_duplicates() )
+    secondaries = np.unique( graph['sec'] )
+
+    return { 'rows': n,
+             'systems': catalog['wds_id'].nunique(),
+             'components': len( components ),
+             'positioned_from_precise_coord': int( ( components.source_role == 1 ).sum() ),
+             'secondaries_with_precise_coord': int( ( components.source_role.to_numpy()[ secondaries ] == 1 ).sum() ),
+             'propagations': ( 2*n, len( components ) ),
+             'simbad_searches': ( 2*n, 2*pairs ),
+             'gaia_primary_selections': ( n, len( np.unique( graph['pri'] ) ) ) }
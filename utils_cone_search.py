@@ -0,0 +1,175 @@
+import numpy as np
+import pandas as pd
+
+import astropy.units as u
+from astropy.coordinates import angular_separation
+
+######################################################################################################################################################
+
+# gaia columns carried into the candidate tables, in the order the archive query returned them
+gaia_columns = ['designation', 'source_id', 'ra', 'dec', 'parallax', 'pmra', 'pmdec', 'pm',
+                'phot_g_mean_mag', 'phot_bp_mean_mag', 'phot_rp_mean_mag',
+                'has_xp_continuous', 'ruwe', 'phot_variable_flag', 'non_single_star']
+
+# offset between zones in the sort key, anything above 360 keeps the zones apart
+zone_stride = 400.0
+
+######################################################################################################################################################
+
+# read a local gaia source extract (csv or parquet)
+def read_gaia_extract( path ):
+
+    if str(path).endswith( ('.parquet', '.pq') ):
+        return pd.read_parquet( path, columns=gaia_columns )
+
+    return pd.read_csv( path, usecols=gaia_columns )
+
+######################################################################################################################################################
+
+# index gaia sources for cone searches
+# sources are split into declination zones of zone_height degrees, and sorted by ra within each zone
+# the index is a dict holding the sorted sources and a single sorted key (zone * zone_stride + ra) to binary search on
+# zone_height should be around the largest search radius, larger zones mean fewer searches but more candidates to reject
+def gaia_index( sources, zone_height=10/3600 ):
+
+    ra = sources['ra'].to_numpy( dtype=float ) % 360.0
+    dec = sources['dec'].to_numpy( dtype=float )
+
+    n_zones = int( np.ceil( 180.0 / zone_height ) )
+    zones = np.clip( np.floor( (dec + 90.0) / zone_height ).astype(int), 0, n_zones - 1 )
+
+    # sort by zone then ra, keep magnitudes in the same order for the magnitude window
+    keys = zones * zone_stride + ra
+    order = np.argsort( keys, kind='stable' )
+
+    return { 'sources': sources.iloc[ order ].reset_index(drop=True),
+             'keys': keys[ order ],
+             'ra': ra[ order ],
+             'dec': dec[ order ],
+             'mag': sources['phot_g_mean_mag'].to_numpy( dtype=float )[ order ],
+             'zone_height': zone_height,
+             'n_zones': n_zones }
+
+######################################################################################################################################################
+
+# half-width in ra (degrees) of a cone of radius r at declination dec, 180 if the cone covers a pole
+def ra_half_width( dec, r ):
+
+    # widen slightly so floating point never clips a source on the edge
+    r = r * (1 + 1e-9)
+
+    with np.errstate( invalid='ignore', divide='ignore' ):
+        x = np.sqrt( np.abs( np.cos( np.radians(dec - r) ) * np.cos( np.radians(dec + r) ) ) )
+        alpha = np.degrees( np.arctan( np.sin( np.radians(r) ) / x ) )
+
+    return np.where( np.abs(dec) + r >= 90.0, 180.0, alpha )
+
+######################################################################################################################################################
+
+# expand [starts, ends) ranges into one flat array of positions, along with the number of the range each position came from
+def expand_ranges( starts, ends ):
+
+    counts = np.maximum( ends - starts, 0 )
+    owners = np.repeat( np.arange( len(starts) ), counts )
+    positions = np.arange( counts.sum() ) - np.repeat( np.cumsum(counts) - counts, counts ) + np.repeat( starts, counts )
+
+    return positions, owners
+
+######################################################################################################################################################
+
+# cone search every target at once
+# ra, dec in degrees, radius in arcsec (scalar or per target), optional magnitude window around target mags
+# returns the target number, the position of the source in index['sources'], and the separation (arcsec) of each match
+def cone_search( index, ra, dec, radius, mags=None, mag_window=None ):
+
+    ra = np.asarray( ra, dtype=float ) % 360.0
+    dec = np.asarray( dec, dtype=float )
+    r = np.broadcast_to( np.asarray( radius, dtype=float ) / 3600, ra.shape )
+    h = index['zone_height']
+
+    # zones touched by each cone
+    zone_lo = np.clip( np.floor( (dec - r + 90.0) / h ).astype(int), 0, index['n_zones'] - 1 )
+    zone_hi = np.clip( np.floor( (dec + r + 90.0) / h ).astype(int), 0, index['n_zones'] - 1 )
+    zones, targets = expand_ranges( zone_lo, zone_hi + 1 )
+
+    # ra window for each (target, zone), split in two where it wraps through ra = 0
+    alpha = ra_half_width( dec, r )[ targets ]
+    lo = ra[ targets ] - alpha
+    hi = ra[ targets ] + alpha
+    full = alpha >= 180.0
+
+    # window 1 is the part inside [0, 360), window 2 is the part that wrapped around
+    lo1 = np.where( full, 0.0, np.maximum( lo, 0.0 ) )
+    hi1 = np.where( full, 360.0, np.minimum( hi, 360.0 ) )
+    lo2 = np.where( lo < 0, lo + 360.0, 0.0 )
+    hi2 = np.where( lo < 0, 360.0, hi - 360.0 )
+    wrapped = ~full & ( (lo < 0) | (hi > 360.0) )
+
+    window_targets = np.concatenate( [ targets, targets[ wrapped ] ] )
+    window_zones = np.concatenate( [ zones, zones[ wrapped ] ] ) * zone_stride
+    window_lo = np.concatenate( [ lo1, lo2[ wrapped ] ] )
+    window_hi = np.concatenate( [ hi1, hi2[ wrapped ] ] )
+
+    # binary search each window in the sorted keys
+    starts = np.searchsorted( index['keys'], window_zones + window_lo, side='left' )
+    ends = np.searchsorted( index['keys'], window_zones + window_hi, side='right' )
+    sources, windows = expand_ranges( starts, ends )
+    targets = window_targets[ windows ]
+
+    # magnitude window first, it's cheaper than the separation
+    if mag_window is not None:
+        keep = np.abs( index['mag'][ sources ] - np.asarray( mags, dtype=float )[ targets ] ) < mag_window
+        sources, targets = sources[ keep ], targets[ keep ]
+
+    # exact separation (vincenty formula), only keep sources inside the cone
+    separations = angular_separation( ra[ targets ] * u.degree, dec[ targets ] * u.degree,
+                                      index['ra'][ sources ] * u.degree, index['dec'][ sources ] * u.degree ).to_value( u.arcsec )
+
+    keep = separations <= r[ targets ] * 3600
+    targets, sources, separations = targets[ keep ], sources[ keep ], separations[ keep ]
+
+    # order by target, then by separation
+    order = np.lexsort( ( separations, targets ) )
+
+    return targets[ order ], sources[ order ], separations[ order ]
+
+######################################################################################################################################################
+
+# build a gaia candidate table for the primaries (component=1) or secondaries (component=2) of a prepped wsi
+# same schema as the archive query results in data/gaia.results
+# target_mag is the component's wds mag, target_dm is the difference to the primary's wds mag (as in the archive queries)
+def gaia_candidates( wsi, index, component=1, radius=5.0, mag_window=4.0 ):
+
+    target_ra = wsi[ f'wds_ra{component}' ].to_numpy( dtype=float )
+    target_dec = wsi[ f'wds_dec{component}' ].to_numpy( dtype=float )
+    target_mag = wsi[ f'wds_mag{component}' ].to_numpy( dtype=float )
+
+    # observations of the same component search the same cone, search each distinct (ra, dec, mag) once and fan out
+    inverse = pd.DataFrame({ 'ra': target_ra, 'dec': target_dec, 'mag': target_mag }).groupby( ['ra', 'dec', 'mag'], sort=False, dropna=False ).ngroup().to_numpy()
+    unique = np.unique( inverse, return_index=True )[1]
+    found, sources, separations = cone_search( index, target_ra[ unique ], target_dec[ unique ], radius, target_mag[ unique ], mag_window )
+
+    # each target gets its cone's matches, still ordered by target then separation
+    starts = np.searchsorted( found, inverse, side='left' )
+    ends = np.searchsorted( found, inverse, side='right' )
+    positions, targets = expand_ranges( starts, ends )
+    sources, separations = sources[ positions ], separations[ positions ]
+
+    # target columns for every candidate
+    oids = wsi['wsi_oid'].to_numpy() if 'wsi_oid' in wsi else wsi.index.to_numpy()
+    candidates = pd.DataFrame({ 'target_oid': oids[ targets ],
+                                'wds_id': wsi['wds_id'].to_numpy()[ targets ],
+                                'wds_comp': wsi['wds_comp'].to_numpy()[ targets ],
+                                'wsi_sep': wsi['wsi_sep'].to_numpy( dtype=float )[ targets ],
+                                'target_ra': target_ra[ targets ],
+                                'target_dec': target_dec[ targets ],
+                                'target_mag': target_mag[ targets ] })
+
+    # gaia columns for every candidate
+    gaia = index['sources'][ gaia_columns ].iloc[ sources ].reset_index(drop=True)
+    candidates = pd.concat( [ candidates, gaia ], axis=1 )
+
+    candidates['target_dm'] = np.abs( candidates['phot_g_mean_mag'].to_numpy() - wsi['wds_mag1'].to_numpy( dtype=float )[ targets ] )
+    candidates['target_sep'] = separations
+
+    return candidates
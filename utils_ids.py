@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+
+######################################################################################################################################################
+
+# identifiers as integers
+# gaia stars are carried by their int64 source_id (-1 for no star) instead of the 'Gaia DR3 <source_id>' designation string, and
+# wds_id/wds_comp are encoded as categorical codes against one shared dictionary, so the same id has the same code in the wsi,
+# wds, gaia candidate and simbad tables and joins between them compare integers instead of strings
+
+# wds identifier columns that are encoded
+id_columns = ['wds_id', 'wds_comp']
+
+######################################################################################################################################################
+
+# gaia designations ('Gaia DR3 <source_id>') to int64 source ids, -1 where there is no designation
+def designation_to_source_id( designations ):
+
+    ids = pd.Series( designations, dtype=object ).str.slice( 9 )
+    valid = ids.str.fullmatch( r'\d+' ) == True
+
+    return ids.where( valid, '-1' ).to_numpy( dtype=str ).astype( np.int64 )
+
+# a source_id column (int64, nullable Int64, or float with nans) as an int64 array, -1 where there is no source
+def source_id_array( source_ids ):
+
+    return pd.Series( source_ids ).astype( 'Int64' ).to_numpy( dtype=np.int64, na_value=-1 )
+
+# whether two columns of source ids (from source_id_array or designation_to_source_id) are the same star, False if either has none
+def same_source( source_ids_1, source_ids_2 ):
+
+    return ( source_ids_1 == source_ids_2 ) & ( source_ids_1 >= 0 )
+
+######################################################################################################################################################
+
+# shared dictionary of the wds identifiers in a set of tables, the sorted distinct values of each id column
+# build it from every table that will be encoded, a value missing from the dictionary can't be encoded
+def id_dictionary( *tables, columns=id_columns ):
+
+    dictionary = {}
+    for col in columns:
+        values = [ pd.unique( table[ col ].dropna().astype( str ) ) for table in tables if col in table ]
+        dictionary[ col ] = pd.Index( np.unique( np.concatenate( values ) ) if values else [], dtype=object )
+
+    return dictionary
+
+# encode the id columns of a table as categoricals with the dictionary's categories (int16/int32 codes under the labels)
+# the labels are unchanged, so the table reads and writes as before, but equal ids have equal codes in every encoded table
+def encode_ids( table, dictionary ):
+
+    for col, categories in dictionary.items():
+
+        if col not in table:
+            continue
+
+        values = table[ col ].astype( object ).where( table[ col ].notna(), None )
+        encoded = pd.Categorical( values, categories=categories )
+
+        unknown = encoded.isna() & values.notna().to_numpy()
+        if unknown.any():
+            raise ValueError( f'{unknown.sum()} {col} values not in the id dictionary, e.g. {list( values[ unknown ][:5] )}' )
+
+        table[ col ] = encoded
+
+    return table
+
+# integer codes of an id column against the dictionary's categories, -1 for missing or unknown values
+# a column already encoded with the same categories just hands back its codes
+def id_codes( values, categories ):
+
+    values = pd.Series( values )
+    if isinstance( values.dtype, pd.CategoricalDtype ) and values.cat.categories.equals( categories ):
+        return values.cat.codes.to_numpy( dtype=np.int64 )
+
+    return categories.get_indexer( values.astype( object ) ).astype( np.int64 )
+
+# one int64 key per (wds_id, wds_comp) pair, -1 where either isn't in the dictionary
+def pair_keys( table, dictionary ):
+
+    ids = id_codes( table['wds_id'], dictionary['wds_id'] )
+    comps = id_codes( table['wds_comp'], dictionary['wds_comp'] )
+
+    return np.where( ( ids >= 0 ) & ( comps >= 0 ), ids * len( dictionary['wds_comp'] ) + comps, -1 )
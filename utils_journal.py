@@ -0,0 +1,96 @@
+import os
+import csv
+import time
+import threading
+
+######################################################################################################################################################
+
+# journal of simbad results for long runs, one csv line per resolved (wds_id, comp): wds_id, comp, sb_id, flag
+# lines are only ever appended, so writing a result costs the same however far into the run we are
+
+journal_columns = ['wds_id', 'wds_comp', 'sb_id', 'sb_flag']
+
+######################################################################################################################################################
+
+# read the results already in a journal, returns a dict of (wds_id, comp) -> (sb_id, flag)
+# a torn last line (from a crash mid-write) is ignored, that key just gets resolved again
+def read_journal( path ):
+
+    done = {}
+    if not os.path.exists( path ):
+        return done
+
+    with open( path, newline='' ) as f:
+        text = f.read()
+
+    # drop anything after the last complete line
+    text = text[ : text.rfind('\n') + 1 ]
+
+    for row in list( csv.reader( text.splitlines() ) )[1:]:
+        if len( row ) == 4:
+            done[ (row[0], row[1]) ] = ( row[2], row[3] )
+
+    return done
+
+######################################################################################################################################################
+
+# open a journal for appending, writes the header if the journal is new
+# returns a function to record one result, record( wds_id, comp, sb_id, flag ), and a function to flush and close the journal
+# the journal is fsynced every fsync_every records or fsync_interval seconds, whichever comes first (safe to call from threads)
+def journal_writer( path, fsync_every=1000, fsync_interval=5.0 ):
+
+    new = not os.path.exists( path ) or os.path.getsize( path ) == 0
+
+    # a crash can leave a torn last line, start on a fresh line so it stays separate
+    if not new:
+        with open( path, 'rb' ) as f:
+            f.seek( -1, os.SEEK_END )
+            torn = f.read( 1 ) != b'\n'
+
+    f = open( path, 'a', newline='' )
+    writer = csv.writer( f )
+    lock = threading.Lock()
+
+    if new:
+        writer.writerow( journal_columns )
+    elif torn:
+        f.write( '\n' )
+
+    state = { 'unsynced': 0, 'last_sync': time.monotonic() }
+
+    def sync():
+        f.flush()
+        os.fsync( f.fileno() )
+        state['unsynced'] = 0
+        state['last_sync'] = time.monotonic()
+
+    def record( wds_id, comp, sb_id, flag ):
+        with lock:
+            writer.writerow( [ wds_id, comp, sb_id, flag ] )
+            state['unsynced'] += 1
+            if state['unsynced'] >= fsync_every or time.monotonic() - state['last_sync'] > fsync_interval:
+                sync()
+
+    def close():
+        with lock:
+            sync()
+            f.close()
+
+    return record, close
+
+######################################################################################################################################################
+
+# merge the journal back onto a catalog with wds_id and wds_comp columns, adds sb_id and sb_flag columns
+# rows missing from the journal are left empty
+def compact_journal( catalog, path ):
+
+    done = read_journal( path )
+
+    keys = zip( catalog['wds_id'], catalog['wds_comp'] )
+    results = [ done.get( key, ('', '') ) for key in keys ]
+
+    catalog = catalog.copy()
+    catalog['sb_id'] = [ r[0] for r in results ]
+    catalog['sb_flag'] = [ r[1] for r in results ]
+
+    return catalog
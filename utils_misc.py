@@ -1,6 +1,8 @@
 import numpy as np
 import pandas as pd
 
+from utils_ids import id_dictionary, pair_keys
+
 ######################################################################################################################################################
 
 # reduce targets in slave catalog, based off of unique targets in a master catalog
@@ -16,6 +18,42 @@ def reduce_targets(slave_catalog, master_catalog):
 
 ######################################################################################################################################################
 
+# stream a catalog csv in chunks of chunksize rows, yielding the rows of each chunk whose wds_id is in master_ids
+# master_ids is hashed once into a set, so each row is a single lookup and the master catalog is never sorted or listed
+# found (a set, if given) collects the master ids seen along the way
+# read_csv_args go to pd.read_csv, give a dtype for columns that have to come out the same type in every chunk
+def target_chunks( path, master_ids, found=None, chunksize=100_000, **read_csv_args ):
+
+    master_ids = pd.Index( list( set( master_ids ) ), dtype=object )
+
+    for chunk in pd.read_csv( path, chunksize=chunksize, **read_csv_args ):
+
+        chunk = chunk.loc[ master_ids.get_indexer( chunk['wds_id'].astype( str ) ) >= 0 ]
+
+        if found is not None:
+            found.update( chunk['wds_id'].astype( str ).unique() )
+
+        if len(chunk):
+            yield chunk
+
+# reduce_targets for a slave catalog csv too big to read at once, peak memory is one chunk plus the rows kept
+# returns the reduced catalog, and the set of master catalog targets it has and the set it is missing
+# (what compare_targets checks: the reduced catalog has the same targets as the master when nothing is missing)
+def stream_reduce_targets( path, master_catalog, chunksize=100_000, **read_csv_args ):
+
+    master_ids = set( master_catalog['wds_id'].astype( str ) )
+    found = set()
+
+    chunks = list( target_chunks( path, master_ids, found, chunksize, **read_csv_args ) )
+
+    # header only, for the columns of an empty result
+    if not chunks:
+        chunks = [ pd.read_csv( path, nrows=0, **read_csv_args ) ]
+
+    return pd.concat( chunks, ignore_index=True ), found, master_ids - found
+
+######################################################################################################################################################
+
 # check that two lists of unique targets are identical
 def compare_targets(catalog_1, catalog_2):
 
@@ -42,3 +80,56 @@ def show_unique_items( input_list ):
     for i in range( len( uniq_items[0] ) ):
         print( uniq_items[0][i], ':', uniq_items[1][i] )
 
+
+######################################################################################################################################################
+
+# index the wds on (wds_id, wds_comp) so observations can be looked up by hash instead of scanning the catalog for every row
+# duplicated keys are handled by policy:
+#   'first' keeps the first wds entry for the key (what match.iloc[0] used to pick)
+#   'last'  keeps the last entry
+#   'raise' raises a ValueError listing the duplicated keys
+def wds_index(wds, duplicates='first'):
+
+    if duplicates not in ('first', 'last', 'raise'):
+        raise ValueError(f"duplicates must be 'first', 'last' or 'raise', not {duplicates!r}")
+
+    keyed = wds.set_index( ['wds_id', 'wds_comp'] )
+
+    # find the duplicated keys
+    dup_mask = keyed.index.duplicated( keep=False )
+
+    if dup_mask.any():
+
+        if duplicates == 'raise':
+            dup_keys = keyed.index[ dup_mask ].unique()
+            raise ValueError(f'{len(dup_keys)} duplicated (wds_id, wds_comp) keys in wds: {list(dup_keys[:10])}')
+
+        keyed = keyed.loc[ ~keyed.index.duplicated( keep=duplicates ) ]
+
+    return keyed
+
+######################################################################################################################################################
+
+# look up wds data for every (wds_id, wds_comp) in a catalog in a single join against a wds_index
+# the pairs are joined as int64 pair keys (see utils_ids) against the wds ids' dictionary, or a shared one if given (e.g. the catalog is encoded)
+# returns the requested wds columns aligned to the catalog's index (nan where there was no match) and a boolean mask of matched rows
+def wds_lookup(catalog, wds_keyed, columns, ids=None):
+
+    wds_pairs = wds_keyed.index.to_frame( index=False, name=['wds_id', 'wds_comp'] )
+    if ids is None:
+        ids = id_dictionary( wds_pairs )
+
+    # wds pairs outside a shared dictionary are key -1 like the catalog's unknown pairs, they can't be looked up so they're left out
+    wds_keys = pair_keys( wds_pairs, ids )
+    known = np.flatnonzero( wds_keys != -1 )
+
+    # position of every key in the wds, -1 if missing (a catalog pair with key -1 finds nothing, the index has no -1)
+    positions = pd.Index( wds_keys[ known ] ).get_indexer( pair_keys( catalog, ids ) )
+    matched = positions != -1
+    positions = np.where( matched, known[ positions ], -1 )
+
+    # rows by position, -1 isn't a row so the missing ones come out nan
+    joined = wds_keyed[ columns ].reset_index( drop=True ).reindex( positions )
+    joined.index = catalog.index
+
+    return joined, pd.Series( matched, index=catalog.index )
@@ -0,0 +1,227 @@
+import os
+import ast
+import json
+import time
+import runpy
+import hashlib
+import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import utils_profile as profile
+
+######################################################################################################################################################
+
+# small incremental pipeline runner
+# each stage declares the files it reads (data and code), its parameters and the files it writes
+# a stage is fingerprinted by the content hash of its inputs, its parameters and its function, and only runs if the fingerprint
+# changed since the last run (or an output is missing or was modified), stages whose inputs are ready run concurrently
+# every run writes a manifest with the fingerprints, hashes, timings and cache hits of each stage, the next run reads it back
+
+######################################################################################################################################################
+
+# declare a stage
+# func is called as func( **params ), inputs and outputs are file paths (relative to the directory the pipeline runs in)
+# stages that read a file another stage writes run after it
+def stage( func, inputs, outputs, params=None ):
+
+    return { 'func': func, 'inputs': list( inputs ), 'outputs': list( outputs ), 'params': dict( params or {} ) }
+
+######################################################################################################################################################
+
+# a stage function that runs a pipeline script (with its hard-coded paths) as if from the command line
+def script( path ):
+
+    def run_script():
+        runpy.run_path( path, run_name='__main__' )
+
+    # the script's source is already hashed as an input, the name keeps stages apart in the fingerprint
+    run_script.__qualname__ = f'script({path})'
+
+    return run_script
+
+######################################################################################################################################################
+
+# the code a script runs: the script and every local module it imports, directly or through other local modules
+# a module is local if there is a .py file of its name next to the script that imports it (numpy, astropy etc. are not)
+# pass the result as a stage's inputs so a change to any of the code re-runs the stage
+def local_imports( *paths ):
+
+    found = []
+    todo = list( paths )
+
+    while todo:
+        path = todo.pop()
+        if path in found:
+            continue
+        found.append( path )
+
+        # a missing script is left in, the stage reports it as a missing input
+        if not os.path.exists( path ):
+            continue
+
+        with open( path ) as f:
+            tree = ast.parse( f.read(), path )
+
+        for node in ast.walk( tree ):
+            if isinstance( node, ast.Import ):
+                names = [ alias.name for alias in node.names ]
+            elif isinstance( node, ast.ImportFrom ) and node.level == 0:
+                names = [ node.module ]
+            else:
+                continue
+
+            for name in names:
+                module = os.path.join( os.path.dirname( path ), name.split('.')[0] + '.py' )
+                if os.path.exists( module ):
+                    todo.append( module )
+
+    return sorted( found )
+
+######################################################################################################################################################
+
+# sha256 of a file's contents, None if it doesn't exist
+def file_hash( path, block_size=1<<20 ):
+
+    if not os.path.exists( path ):
+        return None
+
+    digest = hashlib.sha256()
+    with open( path, 'rb' ) as f:
+        for block in iter( lambda: f.read( block_size ), b'' ):
+            digest.update( block )
+
+    return digest.hexdigest()
+
+######################################################################################################################################################
+
+# fingerprint of a stage, from the hashes of its inputs, its parameters, and the source of its function
+def stage_fingerprint( stage, input_hashes ):
+
+    try:
+        source = inspect.getsource( stage['func'] )
+    except (OSError, TypeError):
+        source = ''
+
+    key = { 'func': stage['func'].__qualname__, 'source': source, 'params': stage['params'], 'inputs': input_hashes }
+
+    return hashlib.sha256( json.dumps( key, sort_keys=True, default=str ).encode() ).hexdigest()
+
+######################################################################################################################################################
+
+# order the stages, returns a dict of stage name -> set of stages it waits on
+# raises ValueError if two stages write the same file or the stages depend on each other in a loop
+def stage_dependencies( stages ):
+
+    writers = {}
+    for name, s in stages.items():
+        for path in s['outputs']:
+            if path in writers:
+                raise ValueError( f'{path} is written by both {writers[path]} and {name}' )
+            writers[ path ] = name
+
+    depends = { name: { writers[path] for path in s['inputs'] if path in writers } - {name} for name, s in stages.items() }
+
+    # check for loops by peeling off stages with nothing left to wait on
+    remaining = { name: set( waits ) for name, waits in depends.items() }
+    while remaining:
+        ready = [ name for name, waits in remaining.items() if not waits ]
+        if not ready:
+            raise ValueError( f'stages depend on each other in a loop: {sorted(remaining)}' )
+        for name in ready:
+            del remaining[ name ]
+        for waits in remaining.values():
+            waits.difference_update( ready )
+
+    return depends
+
+######################################################################################################################################################
+
+# read the manifest of the last run, empty if there isn't one
+def read_manifest( path ):
+
+    if not os.path.exists( path ):
+        return { 'stages': {} }
+
+    with open( path ) as f:
+        return json.load( f )
+
+######################################################################################################################################################
+
+# run a pipeline, only re-running stages whose fingerprint changed
+# stages: dict of name -> stage(...)
+# manifest: where the record of this run is written (and the last one read from)
+# force: names of stages to run even if they look up to date
+# returns the manifest of this run
+def run_pipeline( stages, manifest='data/pipeline.manifest.json', max_workers=4, force=() ):
+
+    depends = stage_dependencies( stages )
+    previous = read_manifest( manifest )['stages']
+
+    record = {}
+    lock = threading.Lock()
+
+    # fingerprint a stage (its upstream stages are done by now), and run it unless the last run already made the same outputs
+    def run_stage( name ):
+
+        s = stages[ name ]
+        t0 = time.perf_counter()
+
+        input_hashes = { path: file_hash( path ) for path in s['inputs'] }
+        missing = [ path for path, digest in input_hashes.items() if digest is None ]
+        if missing:
+            raise FileNotFoundError( f'stage {name} is missing inputs: {missing}' )
+
+        fingerprint = stage_fingerprint( s, input_hashes )
+
+        # up to date if nothing changed and the outputs are still the ones the last run wrote
+        last = previous.get( name, {} )
+        output_hashes = { path: file_hash( path ) for path in s['outputs'] }
+        cached = name not in force and last.get( 'fingerprint' ) == fingerprint and output_hashes == last.get( 'outputs' )
+
+        if not cached:
+            with profile.span( f'stage {name}', **s['params'] ):
+                s['func']( **s['params'] )
+            output_hashes = { path: file_hash( path ) for path in s['outputs'] }
+
+        missing = [ path for path, digest in output_hashes.items() if digest is None ]
+        if missing:
+            raise FileNotFoundError( f'stage {name} did not write: {missing}' )
+
+        with lock:
+            record[ name ] = { 'fingerprint': fingerprint, 'cached': cached, 'seconds': time.perf_counter() - t0,
+                               'params': s['params'], 'inputs': input_hashes, 'outputs': output_hashes }
+
+    # submit every stage as soon as the stages it waits on are done
+    started = time.time()
+    t0 = time.perf_counter()
+    done = set()
+    running = {}
+
+    try:
+        with ThreadPoolExecutor( max_workers=max_workers ) as pool:
+            while len( done ) < len( stages ):
+
+                for name, waits in depends.items():
+                    if name not in done and name not in running.values() and waits <= done:
+                        running[ pool.submit( run_stage, name ) ] = name
+
+                finished, _ = wait( running, return_when=FIRST_COMPLETED )
+                for future in finished:
+                    future.result() # raises the stage's error, once the stages already running have finished
+                    name = running.pop( future )
+                    done.add( name )
+                    print( f'{name}: {"cached" if record[name]["cached"] else "ran"} ({record[name]["seconds"]:.2f} s)' )
+
+    # write the manifest even if a stage failed, so the stages that finished are not re-run next time
+    finally:
+        run = { 'started': time.strftime( '%Y-%m-%dT%H:%M:%S', time.localtime( started ) ),
+                'seconds': time.perf_counter() - t0,
+                'stages': { name: record[ name ] for name in stages if name in record } }
+
+        # atomically, a crash mid-write keeps the last manifest
+        with open( manifest + '.tmp', 'w' ) as f:
+            json.dump( run, f, indent=2 )
+        os.replace( manifest + '.tmp', manifest )
+
+    return run
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+
+from utils_proper_motion import total_pm
+
+######################################################################################################################################################
+
+# normalization of the wsi observations once the wds columns are joined on
+# every step is a mask or an array operation on the columns it needs, and rows are only dropped once, at the end:
+#   sentinels:      a wds value that is empty or '.' (the wds placeholder for a value still to be located) is missing
+#   filters:        drop observations missing a magnitude or the primary's pm, and targets brighter than mag 3
+#   substitution:   a secondary with no pm gets the primary's, flagged '!' in epoch_prop_flag ('.' if it has its own)
+#   P notes:        wds pms flagged P in the notes are 10x too small, scaled up by 10
+#   total pm:       wds_pm1 and wds_pm2 from the (corrected) components
+
+# wds columns joined onto the observations, parsed as floats
+mag_columns = ['wds_mag1', 'wds_mag2']
+pm_columns = ['wds_pm1_ra', 'wds_pm1_dec', 'wds_pm2_ra', 'wds_pm2_dec']
+
+# marks a missing coordinate or note ('.' in the wds)
+missing_mark = '%'
+
+######################################################################################################################################################
+
+# which values are missing, empty in the csv (nan) or '.'
+def missing_values( values ):
+
+    values = pd.Series( values )
+    missing = values.isna().to_numpy()
+
+    # only text columns can hold a '.'
+    if pd.api.types.is_object_dtype( values ) or pd.api.types.is_string_dtype( values ):
+        missing = missing | ( values == '.' ).to_numpy( dtype=bool, na_value=False )
+
+    return missing
+
+# wds values as floats, only the rows in parse are converted (a value that isn't a number in a dropped row can't fail) and the rest are nan
+def wds_floats( values, parse ):
+
+    return pd.Series( values ).where( parse ).astype( float ).to_numpy()
+
+# wds key columns (wds_id, wds_comp) as strings, an empty comp is AB and anything else missing is marked
+def wds_keys( wds ):
+
+    wds['wds_comp'] = wds['wds_comp'].fillna( 'AB' )
+
+    for col in ['wds_id', 'wds_comp']:
+        wds[ col ] = wds[ col ].where( ~missing_values( wds[ col ] ), missing_mark ).astype( str )
+
+    return wds
+
+######################################################################################################################################################
+
+# normalize the joined observations, keep: rows to consider (the ones with a wds entry)
+# returns the kept rows renumbered from 0, with wds_mag1/2 and the pms as floats, epoch_prop_flag, wds_pm1 and wds_pm2
+def normalize_wsi( wsi, keep ):
+
+    keep = np.asarray( keep, dtype=bool ).copy()
+
+    # drop rows with missing mags or primaries with no pm data
+    for col in mag_columns + ['wds_pm1_ra']:
+        keep &= ~missing_values( wsi[ col ] )
+
+    # remove targets brighter than mag 3
+    mags = { col: wds_floats( wsi[ col ], keep ) for col in mag_columns }
+    keep &= ( mags['wds_mag1'] > 3.0 ) & ( mags['wds_mag2'] > 3.0 )
+
+    # pms of the kept rows, nan where missing
+    pms = { col: wds_floats( wsi[ col ], keep & ~missing_values( wsi[ col ] ) ) for col in pm_columns }
+
+    # if the secondary is missing proper motion data, substitute the primary's pm and flag it
+    substitute = np.isnan( pms['wds_pm2_ra'] )
+    pms['wds_pm2_ra']  = np.where( substitute, pms['wds_pm1_ra'], pms['wds_pm2_ra'] )
+    pms['wds_pm2_dec'] = np.where( substitute, pms['wds_pm1_dec'], pms['wds_pm2_dec'] )
+
+    # notes and coordinates, '' for no notes
+    notes = wsi['wds_notes'].astype( object )
+    notes = notes.where( notes.isna() | ~missing_values( notes ), missing_mark ).fillna( '' ).astype( str )
+    coords = wsi['wds_coord1'].astype( object ).where( ~missing_values( wsi['wds_coord1'] ), missing_mark ).astype( str )
+
+    # fix proper motions for wds entries with a P flag
+    P_flag = notes.str.contains( 'P' ).to_numpy()
+    for col in pm_columns:
+        pms[ col ] = np.where( P_flag, pms[ col ] * 10, pms[ col ] )
+
+    # the kept rows, the only copy of the table
+    rows = np.flatnonzero( keep )
+    wsi = wsi.iloc[ rows ].reset_index( drop=True )
+
+    wsi['wds_coord1'] = coords.to_numpy()[ rows ]
+    for col, values in { **mags, **pms }.items():
+        wsi[ col ] = values[ rows ]
+    wsi['wds_notes'] = notes.to_numpy()[ rows ]
+
+    wsi['epoch_prop_flag'] = np.where( substitute[ rows ], '!', '.' ).astype( object )
+
+    # calculate total proper motions
+    wsi['wds_pm1'] = total_pm( wsi.wds_pm1_ra, wsi.wds_pm1_dec )
+    wsi['wds_pm2'] = total_pm( wsi.wds_pm2_ra, wsi.wds_pm2_dec )
+
+    return wsi
@@ -0,0 +1,363 @@
+import os
+import sys
+import json
+import math
+import time
+import atexit
+import resource
+import threading
+import functools
+import tracemalloc
+import numpy as np
+from collections import Counter
+
+######################################################################################################################################################
+
+# opt-in instrumentation for the pipeline stages and the hot loops
+# off by default, every call below returns straight away (or hands back a shared do-nothing span) until enable() is called
+# or WSI_PROFILE is set in the environment, in which case the results are saved when the process exits:
+#
+#   WSI_PROFILE=data/profile python wsi_xmatch.py        -> data/profile.json (summary) and data/profile.trace.json (chrome trace)
+#   WSI_PROFILE_MEMORY=1                                 also trace python memory (slower), for the peak of each span
+#   WSI_PROFILE_SAMPLE=0.005                             sample the stack of the sampled() loops every 5 ms -> data/profile.stacks.txt
+#
+# spans record wall time, cpu time, peak memory and rows in/out, counts record which branch each item took (the selection flags),
+# and item latencies go into histograms with power of 2 microsecond buckets
+# the trace opens in chrome://tracing or ui.perfetto.dev, the stacks are in the folded format flamegraph.pl and speedscope read
+
+######################################################################################################################################################
+
+enabled = False
+
+# called as sampling_hook( name ) for each sampled() loop instead of the built in sampler, must return a context manager
+# so an external profiler can be started and stopped around just the hot loops
+sampling_hook = None
+
+_lock = threading.Lock()
+_state = {}
+
+######################################################################################################################################################
+
+# start recording (clears anything recorded before)
+# memory: trace python allocations with tracemalloc for the peak memory of each span
+# sample_interval: seconds between stack samples inside sampled() blocks, None to not sample
+def enable( memory=False, sample_interval=None ):
+
+    global enabled
+
+    reset()
+    _state.update( memory=memory, sample_interval=sample_interval )
+
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    enabled = True
+
+# stop recording, what was recorded is kept until the next enable()
+def disable():
+
+    global enabled
+    enabled = False
+
+    if _state.get( 'memory' ) and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def reset():
+
+    with _lock:
+        _state.clear()
+        _state.update( t0=time.perf_counter(), memory=False, sample_interval=None,
+                       spans=[], open=[], counts={}, latencies={}, stacks={} )
+
+reset()
+
+######################################################################################################################################################
+
+# stand in for a span while instrumentation is off, ignores anything set on it
+class NullSpan:
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *exc ):
+        return False
+
+    def __setattr__( self, name, value ):
+        pass
+
+null_span = NullSpan()
+
+######################################################################################################################################################
+
+# a timed section, set rows_out (or anything else in args) on it before it closes
+class Span:
+
+    def __init__( self, name, rows_in, args ):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.args = args
+        self.peak = 0
+
+    def __enter__( self ):
+
+        self.thread = threading.get_ident()
+        if _state['memory']:
+            with _lock:
+                fold_peak()
+                self.traced = tracemalloc.get_traced_memory()[0]
+                _state['open'].append( self )
+
+        self.cpu = time.thread_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__( self, *exc ):
+
+        end = time.perf_counter()
+        cpu = time.thread_time() - self.cpu
+
+        record = { 'name': self.name, 'thread': self.thread,
+                   'start': self.start - _state['t0'], 'wall': end - self.start, 'cpu': cpu,
+                   'rows_in': self.rows_in, 'rows_out': self.rows_out,
+                   'max_rss_mb': resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss / 1024,
+                   'error': exc[0].__name__ if exc[0] else None, 'args': self.args }
+
+        with _lock:
+            if _state['memory'] and self in _state['open']:
+                fold_peak()
+                _state['open'].remove( self )
+                record['peak_mb'] = max( self.peak - self.traced, 0 ) / 2**20
+            _state['spans'].append( record )
+
+        return False
+
+# tracemalloc only keeps one peak, so before it is reset the peak so far is credited to every open span
+# (spans open at the same time in different threads share the process's peak)
+def fold_peak():
+
+    peak = tracemalloc.get_traced_memory()[1]
+    for s in _state['open']:
+        s.peak = max( s.peak, peak )
+    tracemalloc.reset_peak()
+
+######################################################################################################################################################
+
+# time a section of code
+#   with span( 'primary_loop', rows_in=len(wsi) ) as s:
+#       ...
+#       s.rows_out = len(xmatch)
+def span( name, rows_in=None, **args ):
+
+    if not enabled:
+        return null_span
+
+    return Span( name, rows_in, args )
+
+# len() of a table, None for anything without one
+def rows( obj ):
+    return len( obj ) if hasattr( obj, '__len__' ) else None
+
+# decorator that runs a function in a span, rows in/out are the lengths of its first argument and of what it returns
+def timed( name=None ):
+
+    def wrap( func ):
+
+        label = name or func.__name__
+
+        @functools.wraps( func )
+        def timed_func( *args, **kwargs ):
+
+            if not enabled:
+                return func( *args, **kwargs )
+
+            with span( label, rows_in=rows( args[0] ) if args else None ) as s:
+                result = func( *args, **kwargs )
+                s.rows_out = rows( result )
+
+            return result
+
+        return timed_func
+
+    return wrap
+
+######################################################################################################################################################
+
+# count an item taking a branch, e.g. count( 'primary_selection', flag )
+def count( name, key, n=1 ):
+
+    if not enabled:
+        return
+
+    with _lock:
+        counts = _state['counts'].setdefault( name, Counter() )
+        counts[ key ] += n
+
+# count every value of an array at once (the flags from a vectorized selection)
+def count_values( name, values ):
+
+    if not enabled:
+        return
+
+    for key, n in zip( *np.unique( np.asarray( values ).astype( str ), return_counts=True ) ):
+        count( name, str( key ), int( n ) )
+
+######################################################################################################################################################
+
+# per item latency, t0 = item_start() before an item and item_end( name, t0 ) after it
+def item_start():
+
+    if not enabled:
+        return None
+
+    return time.perf_counter()
+
+def item_end( name, t0 ):
+
+    if t0 is None:
+        return
+
+    latency( name, time.perf_counter() - t0 )
+
+# add a latency (seconds) to a histogram, bucket k holds latencies between 2^(k-1) and 2^k microseconds
+def latency( name, seconds ):
+
+    if not enabled:
+        return
+
+    bucket = max( math.frexp( seconds * 1e6 )[1], 0 )
+
+    with _lock:
+        h = _state['latencies'].setdefault( name, { 'count': 0, 'total': 0.0, 'min': math.inf, 'max': 0.0, 'buckets': Counter() } )
+        h['count'] += 1
+        h['total'] += seconds
+        h['min'] = min( h['min'], seconds )
+        h['max'] = max( h['max'], seconds )
+        h['buckets'][ bucket ] += 1
+
+######################################################################################################################################################
+
+# samples the stack of one thread every interval seconds, counting each stack in the folded format (outermost frame first)
+class StackSampler:
+
+    def __init__( self, name, interval ):
+        self.name = name
+        self.interval = interval
+        self.thread = threading.get_ident()
+        self.stop = threading.Event()
+
+    def __enter__( self ):
+        self.sampler = threading.Thread( target=self.run, daemon=True )
+        self.sampler.start()
+        return self
+
+    def __exit__( self, *exc ):
+        self.stop.set()
+        self.sampler.join()
+        return False
+
+    def run( self ):
+
+        stacks = Counter()
+        while not self.stop.wait( self.interval ):
+            frame = sys._current_frames().get( self.thread )
+            frames = []
+            while frame is not None:
+                frames.append( f'{os.path.basename( frame.f_code.co_filename )}:{frame.f_code.co_name}' )
+                frame = frame.f_back
+            stacks[ ';'.join( reversed( frames ) ) ] += 1
+
+        with _lock:
+            _state['stacks'].setdefault( self.name, Counter() ).update( stacks )
+
+# sample the stack while a hot loop runs, with sampling_hook if one is set, otherwise the built in sampler (if sampling is on)
+def sampled( name ):
+
+    if not enabled:
+        return null_span
+
+    if sampling_hook is not None:
+        return sampling_hook( name )
+
+    if not _state['sample_interval']:
+        return null_span
+
+    return StackSampler( name, _state['sample_interval'] )
+
+######################################################################################################################################################
+
+# summary of everything recorded: each span, the totals per span name, branch counts and latency histograms
+def report():
+
+    with _lock:
+        spans = list( _state['spans'] )
+        counts = { name: dict( c ) for name, c in _state['counts'].items() }
+        latencies = { name: dict( h ) for name, h in _state['latencies'].items() }
+
+    totals = {}
+    for s in spans:
+        t = totals.setdefault( s['name'], { 'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'rows_in': 0, 'rows_out': 0 } )
+        t['calls'] += 1
+        t['wall'] += s['wall']
+        t['cpu'] += s['cpu']
+        t['rows_in'] += s['rows_in'] or 0
+        t['rows_out'] += s['rows_out'] or 0
+        if 'peak_mb' in s:
+            t['peak_mb'] = max( t.get( 'peak_mb', 0 ), s['peak_mb'] )
+
+    for h in latencies.values():
+        h['mean'] = h['total'] / h['count']
+        h['buckets'] = { f'<={2**k}us': n for k, n in sorted( h['buckets'].items() ) }
+
+    return { 'spans': spans, 'totals': totals, 'counts': counts, 'latencies': latencies }
+
+# spans as complete events in the chrome trace event format
+def trace_events():
+
+    pid = os.getpid()
+    with _lock:
+        spans = list( _state['spans'] )
+
+    events = []
+    for s in spans:
+        args = { key: s[ key ] for key in ('rows_in', 'rows_out', 'cpu', 'peak_mb', 'error') if s.get( key ) is not None }
+        events.append({ 'name': s['name'], 'ph': 'X', 'pid': pid, 'tid': s['thread'],
+                        'ts': s['start'] * 1e6, 'dur': s['wall'] * 1e6, 'args': { **args, **s['args'] } })
+
+    return events
+
+def write_report( path ):
+
+    with open( path, 'w' ) as f:
+        json.dump( report(), f, indent=2, default=str )
+
+def write_trace( path ):
+
+    with open( path, 'w' ) as f:
+        json.dump( { 'traceEvents': trace_events(), 'displayTimeUnit': 'ms' }, f, default=str )
+
+def write_stacks( path ):
+
+    with _lock:
+        stacks = sum( _state['stacks'].values(), Counter() )
+
+    with open( path, 'w' ) as f:
+        for stack, n in stacks.most_common():
+            f.write( f'{stack} {n}\n' )
+
+# write prefix.json and prefix.trace.json, and prefix.stacks.txt if any stacks were sampled
+def save( prefix ):
+
+    write_report( prefix + '.json' )
+    write_trace( prefix + '.trace.json' )
+
+    if _state['stacks']:
+        write_stacks( prefix + '.stacks.txt' )
+
+######################################################################################################################################################
+
+# turned on from the environment, saved when the process exits
+if os.environ.get( 'WSI_PROFILE' ):
+    enable( memory=os.environ.get( 'WSI_PROFILE_MEMORY', '' ) not in ('', '0'),
+            sample_interval=float( os.environ['WSI_PROFILE_SAMPLE'] ) if os.environ.get( 'WSI_PROFILE_SAMPLE' ) else None )
+    atexit.register( save, os.environ['WSI_PROFILE'] )
@@ -1,37 +1,34 @@
 import numpy as np
 import pandas as pd
 
+# values as a float array, anything that doesn't convert to a float is nan (the target is missing pm data)
+def pm_floats(values):
+
+    values = pd.Series( values )
+
+    try:
+        return values.astype( float ).to_numpy()
+
+    # some entry isn't a number, convert one at a time
+    except ( TypeError, ValueError ):
+        return np.array( [ to_float(v) for v in values ], dtype=float )
+
+def to_float(value):
+
+    try:
+        return float( value )
+    except ( TypeError, ValueError ):
+        return np.nan
+
 # function to calculate total proper motions in wsi catalog
 def total_pm(ras, decs):
-    
-    # convert to lists
-    ra_list = list( ras )
-    dec_list = list( decs )
-    
-    # only proceed if lists are the same size
-    if len(ra_list) == len(dec_list):
-
-        # calculate total pm for each index in list
-        total_pms = []
-        for i in range( len(ra_list) ):
-            
-            # try to convert indexed items to float & calculate total pm
-            try:
-                ra = float( ra_list[i] )
-                dec = float( dec_list[i] )
-
-                # calculate total pm
-                pm = np.sqrt( ra**2 + dec**2 )
-
-                # append value to list
-                total_pms.append( pm )
-
-            # if it fails to convert to float, the target is missing pm data
-            # flag it instead
-            except:
-                total_pms.append( np.nan )
-                
-        return total_pms
-    
+
+    # only proceed if the inputs are the same size
+    if len(ras) == len(decs):
+
+        # calculate total pm for every entry at once, nan where either component is missing
+        ra, dec = pm_floats( ras ), pm_floats( decs )
+        return np.sqrt( ra**2 + dec**2 )
+
     else:
         print('inputs are different sizes/shapes')
@@ -1,19 +1,66 @@
 import re
+import csv
+import time
+import atexit
+import sqlite3
 import warnings
-from astroquery.simbad import Simbad
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+import requests
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from astroquery.simbad import SimbadClass
+from astroquery.exceptions import RemoteServiceError, TableParseError, TimeoutError as QueryTimeoutError
 from astropy.utils.exceptions import AstropyWarning
 warnings.simplefilter('ignore', category=AstropyWarning)
 
+# newer astroquery queries simbad through pyvo, whose service errors aren't OSErrors
+try:
+    from pyvo.dal import DALServiceError
+except ImportError:
+    DALServiceError = OSError
+
+import utils_profile as profile
+
 #######################################################################################################################################
 
+# requests session that gives every request a timeout (seconds) unless it sets its own
+class TimeoutSession( requests.Session ):
+
+    def __init__( self, timeout ):
+        super().__init__()
+        self.timeout = timeout
+
+    def request( self, *args, **kwargs ):
+        kwargs.setdefault( 'timeout', self.timeout )
+        return super().request( *args, **kwargs )
+
+# one astroquery simbad instance per timeout, shared by all threads
+# Simbad.timeout only limits async jobs, the sync queries query_objectids runs are bounded by the timeout of the session they go through
+@lru_cache( maxsize=None )
+def simbad_client( timeout ):
+
+    simbad = SimbadClass()
+    session = TimeoutSession( timeout )
+    session.headers.update( simbad._session.headers )
+    simbad._session = session
+
+    return simbad
+
 # given a wds id, look for a gaia match
-def query_gaia_by_wds( wds_id ):
+# from astroquery 0.4.8 query_objectids is a tap query matching the identifier exactly against ident.id
+# (WHERE id_typed.id = '<wds_id>', checked on astroquery 0.4.11), the same match as query_gaia_by_wds_tap and query_gaia_by_wds_batch,
+# before 0.4.8 it went through simbad's name resolver instead
+# timeout (seconds) is applied to every request to simbad, None waits as long as the server takes
+def query_gaia_by_wds( wds_id, timeout=30 ):
 
     # query simbad with wds id
-    results = Simbad.query_objectids( wds_id )
+    results = simbad_client( timeout ).query_objectids( wds_id )
 
-    # astropy table to list of strings
-    results_list = [ results[i][0] for i in range( len(results) ) ]
+    # astropy table to list of strings, nothing comes back for an unknown identifier
+    results_list = [ results[i][0] for i in range( len(results) ) ] if results is not None else []
         
     # perform a regex search to find wds id in list of results
     regex_result = list( filter(lambda id: re.match('Gaia DR3', id), results_list) )
@@ -22,14 +69,18 @@ def query_gaia_by_wds( wds_id ):
 
 #######################################################################################################################################
 
+# the searches below flag an identifier with no gaia id (IndexError from the query) as not found, '$'
+# any other failure (a request that still failed after its retries, an OSError) is raised, so it isn't mistaken for a definitive miss
+# and isn't cached as one, the query scripts catch it and flag the whole component '$' for this run
+
 # simple search for single letter component
-def A_search(wds_id, A):
+def A_search(wds_id, A, query=query_gaia_by_wds):
     try:
-        A = query_gaia_by_wds( 'WDS J' + wds_id + A )
+        A = query( 'WDS J' + wds_id + A )
         flag = '.'
         return A, flag
 
-    except:
+    except IndexError:
         A = ''
         flag = '$'
         return A, flag
@@ -38,26 +89,26 @@ def A_search(wds_id, A):
 
 # tries to direct match A component first, then searches for match using AB
 # for when a complete component is of an AB format ("AB", "AC", "BC", etc.)
-def AB_search(wds_id, AB):
+def AB_search(wds_id, AB, query=query_gaia_by_wds):
 
     # split components
-    A,B = wds_comp
+    A,B = AB
     
     # try to find match for A
     try:
-        pri = query_gaia_by_wds( 'WDS J' + wds_id + A )
+        pri = query( 'WDS J' + wds_id + A )
         pri_flag = '.'
         return pri, pri_flag
         
     # if nothing is found, try AB
-    except: 
+    except IndexError:
         try:
-            pri = query_gaia_by_wds( 'WDS J' + wds_id + AB )
+            pri = query( 'WDS J' + wds_id + AB )
             pri_flag = '!' # flag that first choice wasnt found
             return pri, pri_flag
             
         # if nothing is still found, flag it
-        except:
+        except IndexError:
             pri = ''
             pri_flag = '$'
             return pri, pri_flag        
@@ -66,21 +117,478 @@ def AB_search(wds_id, AB):
 
 # opposite of AB search
 # for when an individual component is of an AB format ( total comp is "AB,C", "A,BC", "AB,CD", etc.)
-def AB_rev_search(wds_id, AB):
+def AB_rev_search(wds_id, AB, query=query_gaia_by_wds):
     A,B = AB
     
     try:
-        AB = query_gaia_by_wds( 'WDS J' + wds_id + AB ) # try to find match for AB
+        AB = query( 'WDS J' + wds_id + AB ) # try to find match for AB
         flag = '.'
         return AB, flag
         
-    except: 
+    except IndexError:
         try:
-            A = query_gaia_by_wds( 'WDS J' + wds_id + A ) # if nothing is found, try A
+            A = query( 'WDS J' + wds_id + A ) # if nothing is found, try A
             flag = '!' # flag that first choice wasnt found
             return A, flag 
             
-        except:
+        except IndexError:
             AB = '' # if nothing is still found, flag it
             flag = '$'
             return AB, flag
+
+#######################################################################################################################################
+
+# search for both stars of a wsi component ("AB", "A,BC", "AB,C", "Aa,Ab", etc.)
+# returns the primary and secondary gaia ids and their flags
+def wsi_component_search(wds_id, comp, query=query_gaia_by_wds):
+
+    # if it's an AB format comp, run AB_search
+    if len( comp ) == 2:
+
+        # query primary
+        res1, flg1 = AB_search( wds_id, comp, query )
+
+        # query secondary with A search
+        res2, flg2 = A_search( wds_id, comp[1], query )
+
+    # if not, split the components
+    else:
+        pri, sec = comp.split( ',' )
+
+        # query primary
+        if len( pri ) == 1: # check for single letter comp first
+            res1, flg1 = A_search( wds_id, pri, query )
+        else:
+            res1, flg1 = AB_rev_search( wds_id, pri, query )
+
+        # query secondary
+        if len( sec ) == 1:
+            res2, flg2 = A_search( wds_id, sec, query )
+        else:
+            res2, flg2 = AB_rev_search( wds_id, sec, query )
+
+    return res1, flg1, res2, flg2
+
+#######################################################################################################################################
+
+# search for a single wds component, as done for the full wds component list
+# an A component falls back to AB if A isn't found, flags are '' if found, '!' if the fallback was used, '$' if nothing was found
+def wds_component_search(wds_id, comp, query=query_gaia_by_wds):
+
+    if comp == 'A':
+        result, flag = AB_search( wds_id, 'AB', query )
+    else:
+        result, flag = A_search( wds_id, comp, query )
+
+    # this search flags direct matches as empty
+    return result, ( '' if flag == '.' else flag )
+
+#######################################################################################################################################
+
+# simbad tap service, can be pointed at a local stand-in (see simbad_stub.py)
+simbad_tap_url = 'https://simbad.cds.unistra.fr/simbad/sim-tap/sync'
+
+# run an adql query on a tap service, returns the rows of the result as lists of strings (header row removed)
+def tap_query( adql, url=simbad_tap_url, timeout=30 ):
+
+    data = urllib.parse.urlencode( {'REQUEST':'doQuery', 'LANG':'ADQL', 'FORMAT':'csv', 'QUERY':adql} ).encode()
+
+    with urllib.request.urlopen( url, data=data, timeout=timeout ) as response:
+        text = response.read().decode( 'utf-8' )
+
+    return list( csv.reader( text.splitlines() ) )[1:]
+
+#######################################################################################################################################
+
+# same as query_gaia_by_wds, but sent straight to a tap service (which can be a local stand-in, see simbad_stub.py) instead of through astroquery
+# raises IndexError if there is no gaia id, network errors come through as OSError
+# the identifier is matched exactly against ident.id, the same query astroquery's query_objectids runs
+def query_gaia_by_wds_tap( wds_id, url=simbad_tap_url, timeout=30 ):
+
+    # every identifier of the object that has wds_id as one of its identifiers
+    ident = wds_id.replace( "'", "''" )
+    adql = ( "SELECT id2.id FROM ident AS id1 JOIN ident AS id2 USING(oidref) "
+             f"WHERE id1.id = '{ident}'" )
+
+    results_list = [ row[0] for row in tap_query( adql, url, timeout ) ]
+
+    # perform a regex search to find gaia id in list of results
+    regex_result = list( filter(lambda id: re.match('Gaia DR3', id), results_list) )
+
+    return regex_result[0]
+
+#######################################################################################################################################
+
+# returns a function that blocks until the next request is allowed, spacing requests 1/rate seconds apart across all threads
+def rate_limiter( rate ):
+
+    lock = threading.Lock()
+    next_slot = [ time.monotonic() ]
+
+    def wait():
+        if rate is None:
+            return
+
+        # reserve the next slot, then sleep outside the lock until it comes up
+        with lock:
+            now = time.monotonic()
+            slot = max( now, next_slot[0] )
+            next_slot[0] = slot + 1 / rate
+
+        time.sleep( max( 0, slot - now ) )
+
+    return wait
+
+#######################################################################################################################################
+
+# errors a request can fail with: network errors (OSError, which includes timeouts, http errors and requests' connection errors),
+# and the errors astroquery and pyvo raise when simbad answers with an error, times out or sends back a table that can't be parsed
+request_errors = ( OSError, RemoteServiceError, TableParseError, QueryTimeoutError, DALServiceError )
+
+# wrap a query function with a shared rate limit and retries with exponential backoff
+# only failed requests (request_errors) are retried, a missing gaia id is not
+# http client errors (4xx, like a query that is too long) would fail the same way again, so they aren't retried either
+# a request that still fails after its retries is raised as an OSError, whatever it failed with, so callers only catch OSError
+def throttled_query( query, rate=None, retries=3, backoff=0.5 ):
+
+    wait = rate_limiter( rate )
+
+    def throttled( wds_id ):
+        for attempt in range( retries + 1 ):
+            wait()
+            t0 = profile.item_start()
+            try:
+                result = query( wds_id )
+                profile.count( 'simbad_query', 'found' )
+                return result
+
+            # no gaia id in simbad
+            except IndexError:
+                profile.count( 'simbad_query', 'not found' )
+                raise
+
+            except request_errors as error:
+                client_error = isinstance( error, urllib.error.HTTPError ) and error.code < 500
+                if attempt == retries or client_error:
+                    profile.count( 'simbad_query', 'failed' )
+                    if isinstance( error, OSError ):
+                        raise
+                    raise OSError( f'simbad request failed after {retries} retries: {error}' ) from error
+                profile.count( 'simbad_query', 'retry' )
+                time.sleep( backoff * 2**attempt )
+
+            finally:
+                profile.item_end( 'simbad_query', t0 )
+
+    return throttled
+
+#######################################################################################################################################
+
+# run a search function over a list of argument tuples with a pool of threads, results come back in input order
+# each call of search is passed its arguments plus the throttled query function
+# callback (optional) is called with the arguments and result of each search as soon as it finishes, from the worker thread
+def resolve_concurrently( search, args, query, max_workers=8, callback=None ):
+
+    def run( a ):
+        result = search( *a, query )
+        if callback is not None:
+            callback( a, result )
+        return result
+
+    with ThreadPoolExecutor( max_workers=max_workers ) as pool:
+        return list( pool.map( run, args ) )
+
+#######################################################################################################################################
+
+# wrap a query function with a persistent sqlite cache, keyed on the query string ('WDS J...')
+# found ids and misses (no gaia id, IndexError) are both cached, network errors are not
+# entries older than ttl seconds are queried again, and the least recently used entries are dropped past max_entries
+# identical lookups running at the same time in different threads share a single query
+# the row count is kept in memory, and the access times of hits are written (and committed) flush_every hits at a time, on the next
+# write, and when the returned function's close() is called (also at exit), so a warm rerun doesn't commit once per identifier
+# hit/miss counts are kept in the returned function's stats dict
+# lookup( wds_ids ) and store( results ) on the returned function read and fill the cache many identifiers at a time, see batch_resolve
+def cached_query( query, path='data/simbad.cache.sqlite', ttl=30*24*3600, max_entries=1_000_000, flush_every=1000 ):
+
+    db = sqlite3.connect( path, check_same_thread=False )
+    db.execute( 'CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, created REAL, accessed REAL)' )
+    db.execute( 'CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)' )
+    db.commit()
+
+    db_lock = threading.Lock()
+    pending_lock = threading.Lock()
+    pending = {} # key -> [event, result, error] for lookups in progress
+
+    # rows in the cache, counted once here and kept up to date by every insert and delete
+    rows = [ db.execute( 'SELECT COUNT(*) FROM cache' ).fetchone()[0] ]
+
+    # access times of hits not written yet, key -> time
+    touched = {}
+
+    stats = { 'hits':0, 'negative_hits':0, 'misses':0, 'collapsed':0, 'expired':0, 'evicted':0 }
+    stats_lock = threading.Lock()
+
+    def count( name, n=1 ):
+        with stats_lock:
+            stats[ name ] += n
+
+    # write the pending access times (call with db_lock held), the caller commits
+    def write_touched():
+        if touched:
+            db.executemany( 'UPDATE cache SET accessed = ? WHERE key = ?', [ (t, key) for key, t in touched.items() ] )
+            touched.clear()
+
+    # cached entry for a key, None if it isn't cached (or has expired)
+    # a cached miss comes back as ('',) so it can be told apart from no entry
+    def read( key ):
+        now = time.time()
+        with db_lock:
+            row = db.execute( 'SELECT value, created FROM cache WHERE key = ?', (key,) ).fetchone()
+
+            if row is None:
+                return None
+
+            if now - row[1] > ttl:
+                db.execute( 'DELETE FROM cache WHERE key = ?', (key,) )
+                touched.pop( key, None )
+                rows[0] -= 1
+                count( 'expired' )
+                return None
+
+            touched[ key ] = now
+            if len( touched ) >= flush_every:
+                write_touched()
+                db.commit()
+
+        return ( row[0] or '', )
+
+    # store results (None for no gaia id), key -> value, and drop the least recently used entries if the cache is too big
+    def write( entries ):
+        now = time.time()
+        with db_lock:
+            for key, value in entries.items():
+                new = db.execute( 'SELECT 1 FROM cache WHERE key = ?', (key,) ).fetchone() is None
+                db.execute( 'INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)', (key, value, now, now) )
+                rows[0] += new
+
+            extra = rows[0] - max_entries
+            if extra > 0:
+                # recent hits count as recent before picking what to drop
+                write_touched()
+                db.execute( 'DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed LIMIT ?)', (extra,) )
+                rows[0] -= extra
+                count( 'evicted', extra )
+
+            write_touched()
+            db.commit()
+
+    # write what is pending and close the database
+    def close():
+        with db_lock:
+            write_touched()
+            db.commit()
+            db.close()
+
+    # answer from a cache entry
+    def from_entry( wds_id, entry ):
+        if entry[0] == '':
+            count( 'negative_hits' )
+            raise IndexError( f'no gaia id for {wds_id} (cached)' )
+        count( 'hits' )
+        return entry[0]
+
+    def cached( wds_id ):
+
+        entry = read( wds_id )
+        if entry is not None:
+            return from_entry( wds_id, entry )
+
+        # join a lookup already running for this key, or start one
+        with pending_lock:
+            owner = wds_id not in pending
+            if owner:
+                pending[ wds_id ] = [ threading.Event(), None, None ]
+            slot = pending[ wds_id ]
+
+        if not owner:
+            count( 'collapsed' )
+            slot[0].wait()
+            if slot[2] is not None:
+                raise slot[2]
+            return slot[1]
+
+        try:
+            # another thread may have finished this lookup between the cache read and taking ownership
+            entry = read( wds_id )
+            if entry is not None:
+                slot[1] = from_entry( wds_id, entry )
+                return slot[1]
+
+            count( 'misses' )
+            slot[1] = query( wds_id )
+            write( { wds_id: slot[1] } )
+            return slot[1]
+
+        except IndexError as error:
+            if entry is None:
+                write( { wds_id: None } )
+            slot[2] = error
+            raise
+
+        except Exception as error:
+            slot[2] = error
+            raise
+
+        finally:
+            with pending_lock:
+                del pending[ wds_id ]
+            slot[0].set()
+
+    # cached results for many identifiers, identifier -> gaia id (None for a cached miss), uncached identifiers are left out
+    def lookup( wds_ids ):
+        found = {}
+        for wds_id in wds_ids:
+            entry = read( wds_id )
+            if entry is not None:
+                count( 'hits' if entry[0] else 'negative_hits' )
+                found[ wds_id ] = entry[0] or None
+        return found
+
+    # cache results resolved elsewhere (batched queries), identifier -> gaia id or None for a confirmed miss
+    def store( results ):
+        count( 'misses', len( results ) )
+        write( results )
+
+    # only the first close does anything
+    closed = []
+    def close_once():
+        if not closed:
+            closed.append( True )
+            close()
+
+    atexit.register( close_once )
+
+    cached.stats = stats
+    cached.close = close_once
+    cached.lookup = lookup
+    cached.store = store
+    return cached
+
+#######################################################################################################################################
+
+# look up gaia ids for many identifiers in one tap query
+# returns a dict of identifier -> gaia id, identifiers without a gaia id are left out
+def query_gaia_by_wds_batch( wds_ids, url=simbad_tap_url, timeout=60 ):
+
+    idents = ', '.join( "'" + wds_id.replace( "'", "''" ) + "'" for wds_id in wds_ids )
+    adql = ( "SELECT id1.id, id2.id FROM ident AS id1 JOIN ident AS id2 USING(oidref) "
+             f"WHERE id1.id IN ({idents}) AND id2.id LIKE 'Gaia DR3%'" )
+
+    # keep the first gaia id found for each identifier
+    results = {}
+    for wds_id, gaia_id in tap_query( adql, url, timeout ):
+        results.setdefault( wds_id, gaia_id )
+
+    return results
+
+#######################################################################################################################################
+
+# resolve a list of identifiers in batches, returns a dict of identifier -> gaia id (None if there is no gaia id)
+# batches are packed up to max_query_length characters of identifiers (and at most max_batch identifiers)
+# a failed batch is split in half and retried, down to single queries, a single query that still fails is left out of the results
+# if single_query is a cached_query, identifiers are looked up in its cache first and only the rest are queried, the found ids and
+# confirmed misses of every batch are stored back in the cache (single queries cache their own results)
+def batch_resolve( wds_ids, batch_query, single_query, max_query_length=20000, max_batch=1000 ):
+
+    wds_ids = list( dict.fromkeys( wds_ids ) )
+    cached = hasattr( single_query, 'lookup' )
+
+    results = single_query.lookup( wds_ids ) if cached else {}
+
+    def run( batch ):
+        if len( batch ) == 1:
+            try:
+                results[ batch[0] ] = single_query( batch[0] )
+            except IndexError:
+                results[ batch[0] ] = None
+            except OSError:
+                pass # left out, it failed
+            return
+
+        try:
+            found = batch_query( batch )
+        except OSError:
+            half = len( batch ) // 2
+            run( batch[:half] )
+            run( batch[half:] )
+            return
+
+        resolved = { wds_id: found.get( wds_id ) for wds_id in batch }
+        results.update( resolved )
+        if cached:
+            single_query.store( resolved )
+
+    # pack the identifiers not in the cache into batches by length
+    batch, length = [], 0
+    for wds_id in wds_ids:
+        if wds_id in results:
+            continue
+        if batch and ( length + len(wds_id) + 4 > max_query_length or len(batch) == max_batch ):
+            run( batch )
+            batch, length = [], 0
+        batch.append( wds_id )
+        length += len( wds_id ) + 4 # quotes, comma and space
+
+    if batch:
+        run( batch )
+
+    return results
+
+#######################################################################################################################################
+
+# run a search function over a list of argument tuples, resolving identifiers in batches instead of one request each
+# the searches are run in rounds, each round collects the identifiers the unfinished searches asked for and resolves them together
+# (the first search asks for 'A', the next round asks for the 'AB' fallback only where 'A' wasn't found, and so on)
+# resolve is called with a list of identifiers and returns a dict of identifier -> gaia id or None, see batch_resolve
+# an identifier resolve leaves out failed, a search that asks for it gets an OSError (which the searches raise)
+def resolve_batched( search, args, resolve ):
+
+    failed = object()
+    known = {}
+    results = [ None ] * len( args )
+    unfinished = list( range( len(args) ) )
+
+    while unfinished:
+        needed = {}
+        still_unfinished = []
+
+        for i in unfinished:
+            asked = []
+
+            # answers from what is known so far, the first unknown identifier is recorded and treated as not found for now
+            def query( wds_id ):
+                if wds_id in known:
+                    if known[ wds_id ] is failed:
+                        raise OSError( f'{wds_id} could not be resolved' )
+                    if known[ wds_id ] is None:
+                        raise IndexError( f'no gaia id for {wds_id}' )
+                    return known[ wds_id ]
+                if not asked:
+                    asked.append( wds_id )
+                raise IndexError( f'{wds_id} not resolved yet' )
+
+            result = search( *args[i], query )
+
+            if asked:
+                needed[ asked[0] ] = None
+                still_unfinished.append( i )
+            else:
+                results[i] = result
+
+        # anything resolve leaves out is marked failed, so every round makes progress
+        if needed:
+            resolved = resolve( list( needed ) )
+            known.update( { wds_id: resolved.get( wds_id, failed ) for wds_id in needed } )
+        unfinished = still_unfinished
+
+    return results
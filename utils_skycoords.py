@@ -1,4 +1,3 @@
-import math
 import numpy as np
 import pandas as pd
 
@@ -9,6 +8,8 @@ from astropy.coordinates import SkyCoord
 import warnings                                                         
 from erfa import ErfaWarning
 
+from utils_wds import field_extent, field_numbers
+
 # ignore erfa warnings
 warnings.simplefilter('ignore', category=ErfaWarning)
 
@@ -71,3 +72,172 @@ def set_wds_skycoord(df, i):
         # flag = '!'
     
     return primary, secondary#, flag
+
+###################################################################################################################################################
+
+# wds precise coordinates come as 'hhmmss.ss+ddmmss.s' (18 characters), or spaced out as 'hh mm ss.ss +dd mm ss.s' (23 characters)
+# positions of the 18 compact characters in each layout, and where the spaced layout has its spaces
+wds_coord_layouts = { 18: np.arange( 18 ),
+                      23: np.array([ 0, 1, 3, 4, 6, 7, 8, 9, 10, 12, 13, 14, 16, 17, 19, 20, 21, 22 ]) }
+wds_coord_spaces = np.array([ 2, 5, 11, 15, 18 ])
+
+# fields of the compact layout (first character, last + 1)
+wds_coord_fields = { 'h':(0, 2), 'm':(2, 4), 's':(4, 9), 'd':(10, 12), 'dm':(12, 14), 'ds':(14, 18) }
+wds_coord_digits = np.array([ 0, 1, 2, 3, 4, 5, 7, 8, 10, 11, 12, 13, 14, 15, 17 ])
+
+###################################################################################################################################################
+
+# 2d array of character codes for a column of strings, one row per string, with leading spaces shifted out
+# anything that isn't a string (nans from blank csv fields) is an empty row, returns the array and the stripped lengths
+def string_chars( strings ):
+
+    text = pd.Series( strings, dtype=object ).fillna( '' ).astype( str ).to_numpy( dtype=str )
+    width = max( text.dtype.itemsize // 4, 1 )
+    chars = np.ascontiguousarray( text.astype( f'U{width}' ) ).view( np.uint32 ).reshape( len(text), width )
+
+    # blank padding is nulls, treat it as spaces
+    chars = np.where( chars == 0, ord(' '), chars )
+    first, last, present = field_extent( chars )
+
+    if first.any():
+        columns = np.arange( width )
+        chars = np.take_along_axis( chars, np.minimum( columns + first[:, None], width - 1 ), axis=1 )
+
+    return chars, np.where( present, last - first, 0 )
+
+###################################################################################################################################################
+
+# parse a column of wds precise coordinates without going through astropy's string parser
+# returns ra (degrees, or hours with hours=True), dec (degrees), and a mask of the coordinates that parsed
+# blank or malformed coordinates are nan and False in the mask instead of raising
+# the arithmetic is the same as astropy's, so SkyCoord(ra*u.hourangle, dec*u.deg) matches parsing the strings exactly
+def parse_wds_coords( coords, hours=False ):
+
+    chars, lengths = string_chars( coords )
+    n = len(chars)
+
+    # gather the 18 compact characters from whichever layout each coordinate uses
+    compact = np.full( (n, 18), ord(' '), dtype=np.uint32 )
+    valid = np.zeros( n, dtype=bool )
+    for length, positions in wds_coord_layouts.items():
+        rows = lengths == length
+        if not rows.any() or chars.shape[1] < length:
+            continue
+        compact[ rows ] = chars[ np.ix_( rows, positions ) ]
+        valid[ rows ] = True
+        if length == 23:
+            valid[ rows ] &= ( chars[ np.ix_( rows, wds_coord_spaces ) ] == ord(' ') ).all( axis=1 )
+
+    # digits, decimal points and sign where they belong
+    digits = compact[:, wds_coord_digits]
+    valid &= ( ( digits >= ord('0') ) & ( digits <= ord('9') ) ).all( axis=1 )
+    valid &= ( compact[:, 6] == ord('.') ) & ( compact[:, 16] == ord('.') )
+    valid &= ( compact[:, 9] == ord('+') ) | ( compact[:, 9] == ord('-') )
+
+    compact = np.where( valid[:, None], compact, ord(' ') ).astype( np.uint8 )
+    h, m, s, d, dm, ds = ( field_numbers( compact[:, first:last] ) for first, last in wds_coord_fields.values() )
+
+    # in range (astropy raises or warns on these)
+    valid &= ( h < 24 ) & ( m < 60 ) & ( s < 60 ) & ( d <= 90 ) & ( dm < 60 ) & ( ds < 60 )
+
+    # same order of operations as astropy
+    ra = h + m / 60.0
+    ra += s / 3600.0
+    dec = d + dm / 60.0
+    dec += ds / 3600.0
+    dec = np.where( compact[:, 9] == ord('-'), -dec, dec )
+
+    ra = np.where( valid, ra, np.nan )
+    dec = np.where( valid, dec, np.nan )
+
+    return ( ra if hours else ( ra * u.hourangle ).to_value( u.degree ) ), dec, valid
+
+###################################################################################################################################################
+
+# coarse position encoded in a wds id ('hhmmm+ddmm', ra to a tenth of a minute of time, dec to an arcminute), for bucketing
+# ids are truncated, not rounded, so the star is at or just past this position
+# returns ra, dec (degrees) and a mask of the ids that parsed
+def wds_id_coords( wds_ids ):
+
+    chars, lengths = string_chars( wds_ids )
+    chars = chars[:, :10] if chars.shape[1] >= 10 else np.full( (len(chars), 10), ord(' '), dtype=np.uint32 )
+
+    digits = chars[:, [ 0, 1, 2, 3, 4, 6, 7, 8, 9 ]]
+    valid = ( lengths == 10 ) & ( ( digits >= ord('0') ) & ( digits <= ord('9') ) ).all( axis=1 )
+    valid &= ( chars[:, 5] == ord('+') ) | ( chars[:, 5] == ord('-') )
+
+    chars = np.where( valid[:, None], chars, ord(' ') ).astype( np.uint8 )
+    h, m, d, dm = ( field_numbers( chars[:, first:last] ) for first, last in [ (0, 2), (2, 5), (6, 8), (8, 10) ] )
+
+    ra = ( ( h + m / 600.0 ) * u.hourangle ).to_value( u.degree )
+    dec = np.where( chars[:, 5] == ord('-'), -1.0, 1.0 ) * ( d + dm / 60.0 )
+
+    valid &= ( ra < 360 ) & ( np.abs(dec) <= 90 )
+
+    return np.where( valid, ra, np.nan ), np.where( valid, dec, np.nan ), valid
+
+###################################################################################################################################################
+
+# ra (hours) and dec (degrees) of a column of wds precise coordinates
+# coordinates in the wds layout are decoded directly, astropy parses the strings if any are in some other format
+def wds_positions( coords ):
+
+    ra, dec, valid = parse_wds_coords( coords, hours=True )
+    if not valid.all():
+        position = SkyCoord( np.asarray( coords, dtype=str ), unit=(u.hourangle, u.degree) )
+        ra, dec = position.ra.hourangle, position.dec.degree
+
+    return ra, dec
+
+# skycoord of every primary at J2000, from its position (SkyCoord, or ra in hours and dec in degrees) and pm
+def primary_skycoords( position, pm_ra, pm_dec ):
+
+    if not isinstance( position, SkyCoord ):
+        position = SkyCoord( position[0] * u.hourangle, position[1] * u.degree )
+
+    return SkyCoord(
+                    position,
+                    pm_ra_cosdec = np.asarray( pm_ra,  dtype=float ) * u.mas/u.yr,
+                    pm_dec = np.asarray( pm_dec, dtype=float ) * u.mas/u.yr,
+                    obstime = Time( 2000.0, format='jyear', scale='tcb' )
+    )
+
+# skycoord of every secondary at J2000, offset from its primary, and the flags for which ones had the primary's pm substituted
+def secondary_skycoords( primary, pm2_ra, pm2_dec, pa, sep ):
+
+    # calculate directional offset of every secondary
+    position_angle =   np.asarray( pa,  dtype=float ) * u.degree
+    separation_angle = np.asarray( sep, dtype=float ) * u.arcsec
+    secondary_coords = primary.directional_offset_by( position_angle, separation_angle )
+
+    # secondary pm may hold flags ('%', '.') or nans, anything that isn't a number is missing pm data
+    secondary_pm_ra  = pd.to_numeric( pd.Series( np.asarray(pm2_ra,  dtype=object) ), errors='coerce' ).to_numpy( dtype=float )
+    secondary_pm_dec = pd.to_numeric( pd.Series( np.asarray(pm2_dec, dtype=object) ), errors='coerce' ).to_numpy( dtype=float )
+    missing = np.isnan( secondary_pm_ra ) | np.isnan( secondary_pm_dec )
+
+    # substitute the primary's pm where the secondary is missing it
+    primary_pm_ra = primary.pm_ra_cosdec.to_value( u.mas/u.yr )
+    primary_pm_dec = primary.pm_dec.to_value( u.mas/u.yr )
+    secondary = SkyCoord(
+                         secondary_coords,
+                         pm_ra_cosdec = np.where( missing, primary_pm_ra,  secondary_pm_ra )  * u.mas/u.yr,
+                         pm_dec       = np.where( missing, primary_pm_dec, secondary_pm_dec ) * u.mas/u.yr,
+                         obstime = primary.obstime
+    )
+
+    # '!' if we used the primary's pm, '.' if the secondary has its own
+    flags = np.where( missing, '!', '.' )
+
+    return secondary, flags
+
+# vectorized version of set_wds_skycoord
+# takes whole columns (array-likes of equal length) and returns one skycoord holding every primary, one holding every secondary,
+# and an array of flags for which secondaries had the primary's pm substituted
+def set_wds_skycoords(coords, pm1_ra, pm1_dec, pm2_ra, pm2_dec, pa, sep):
+
+    # establish skycoord for all primaries at once
+    primary = primary_skycoords( wds_positions( coords ), pm1_ra, pm1_dec )
+
+    secondary, flags = secondary_skycoords( primary, pm2_ra, pm2_dec, pa, sep )
+
+    return primary, secondary, flags
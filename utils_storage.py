@@ -0,0 +1,144 @@
+import os
+import pandas as pd
+
+from utils_wds import wds_fields
+
+# arrow is optional, without it everything is read from and written to csv
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+######################################################################################################################################################
+
+# typed storage for the pipeline intermediates (prepped wsi, gaia candidates, xmatch, synthetic photometry)
+# tables are written as uncompressed arrow ipc files (.arrow) so they can be memory mapped, with an optional csv copy
+# paths are given without an extension, reads use the .arrow file if there is one and fall back to the .csv
+
+######################################################################################################################################################
+
+# column types for each intermediate, 'str', 'int', 'float' or 'bool'
+# ints and bools are nullable, so a missing secondary match doesn't turn its source_id into a float
+
+# the parsed wds summary
+wds_schema = { name: kind for name, (_, _, kind) in wds_fields.items() }
+
+prepped_schema = {
+    'wsi_oid':'int', 'wds_id':'str', 'wds_dd':'str', 'wds_comp':'str',
+    'wsi_date':'float', 'wsi_filter':'str',
+    'wsi_sep':'float', 'wsi_sep_e':'float', 'wsi_pa':'float', 'wsi_pa_e':'float',
+    'wsi_dm':'float', 'wsi_dm_e':'float', 'wsi_dm_flag':'str', 'wsi_nav':'int', 'wsi_avg':'int',
+    'sb_id1':'str', 'sb_id2':'str', 'sb_flg1':'str', 'sb_flg2':'str',
+    'wds_mag1':'float', 'wds_mag2':'float',
+    'wds_pm1_ra':'float', 'wds_pm1_dec':'float', 'wds_pm2_ra':'float', 'wds_pm2_dec':'float',
+    'wds_notes':'str', 'epoch_prop_flag':'str', 'wds_pm1':'float', 'wds_pm2':'float',
+    'wds_ra1':'float', 'wds_dec1':'float', 'wds_ra2':'float', 'wds_dec2':'float',
+}
+
+# gaia columns of a candidate or a match
+gaia_source_schema = {
+    'designation':'str', 'source_id':'int', 'ra':'float', 'dec':'float',
+    'parallax':'float', 'pmra':'float', 'pmdec':'float', 'pm':'float',
+    'phot_g_mean_mag':'float', 'phot_bp_mean_mag':'float', 'phot_rp_mean_mag':'float',
+    'has_xp_continuous':'bool', 'ruwe':'float', 'phot_variable_flag':'str', 'non_single_star':'int',
+}
+
+gaia_candidate_schema = {
+    'target_oid':'int', 'wds_id':'str', 'wds_comp':'str', 'wsi_sep':'float',
+    'target_ra':'float', 'target_dec':'float', 'target_mag':'float',
+    **gaia_source_schema,
+    'target_dm':'float', 'target_sep':'float',
+}
+
+xmatch_schema = {
+    **prepped_schema,
+    **{ f'gaia_{col}1': kind for col, kind in gaia_source_schema.items() }, 'gaia_flag1':'str',
+    **{ f'gaia_{col}2': kind for col, kind in gaia_source_schema.items() }, 'gaia_flag2':'str',
+    'xm_chk1':'bool', 'xm_chk2':'bool',
+}
+
+syn_schema = {
+    **xmatch_schema,
+    'gaia_sep':'float', 'gaia_br_diff1':'float', 'gaia_br_diff2':'float',
+    'syn1':'float', 'syn2':'float', 'syn_dm':'float',
+}
+
+# pandas dtypes used for each kind of column
+pandas_types = { 'str':object, 'int':'Int64', 'float':'float64', 'bool':'boolean' }
+
+######################################################################################################################################################
+
+# arrow type for each kind of column
+def arrow_type( kind ):
+    return { 'str':pa.string(), 'int':pa.int64(), 'float':pa.float64(), 'bool':pa.bool_() }[ kind ]
+
+######################################################################################################################################################
+
+# cast the columns of a dataframe to the types in a schema, columns not in the schema are left alone
+def apply_schema( df, schema ):
+
+    types = { col: pandas_types[ kind ] for col, kind in schema.items() if col in df.columns }
+
+    return df.astype( types )
+
+######################################################################################################################################################
+
+# write an intermediate table to path.arrow (if arrow is available), and to path.csv if csv=True
+# the csv is written from the dataframe as given, so it is the same as writing it with to_csv directly
+def write_table( df, path, schema, csv=False ):
+
+    if csv or pa is None:
+        df.to_csv( path + '.csv', index=False )
+
+    if pa is None:
+        return
+
+    typed = apply_schema( df.copy(), schema )
+
+    # schema types for known columns, inferred types for anything else
+    inferred = pa.Schema.from_pandas( typed, preserve_index=False )
+    fields = [ pa.field( field.name, arrow_type( schema[field.name] ) ) if field.name in schema else field for field in inferred ]
+    table = pa.Table.from_pandas( typed, schema=pa.schema( fields ), preserve_index=False )
+
+    # write to a temporary file first, so a reader never maps a half written table
+    with pa.OSFile( path + '.arrow.tmp', 'wb' ) as sink:
+        with pa.ipc.new_file( sink, table.schema ) as writer:
+            writer.write_table( table )
+
+    os.replace( path + '.arrow.tmp', path + '.arrow' )
+
+######################################################################################################################################################
+
+# the files write_table writes for a table, path.csv and (with pyarrow) path.arrow, which read_table reads first
+def table_files( path ):
+    return [ path + '.csv' ] + ( [ path + '.arrow' ] if pa is not None else [] )
+
+# the file read_table reads a table from
+def table_source( path ):
+    return path + '.arrow' if pa is not None and os.path.exists( path + '.arrow' ) else path + '.csv'
+
+######################################################################################################################################################
+
+# read an intermediate table, optionally just some of its columns
+# from path.arrow the file is memory mapped and only the requested columns are read from its record batches,
+# float columns without missing values are handed to pandas as views of the mapped file, not copied (ints and bools become
+# nullable pandas arrays and strings become objects, those are copied)
+# from path.csv (no arrow file, or arrow not installed) the schema types are applied while reading
+def read_table( path, schema, columns=None ):
+
+    if pa is not None and os.path.exists( path + '.arrow' ):
+
+        reader = pa.ipc.open_file( pa.memory_map( path + '.arrow', 'r' ) )
+        if columns is None:
+            table = reader.read_all()
+        else:
+            batches = [ reader.get_batch( i ).select( columns ) for i in range( reader.num_record_batches ) ]
+            table = pa.Table.from_batches( batches, schema=pa.schema( [ reader.schema.field( col ) for col in columns ] ) )
+
+        # nullable pandas types for ints and bools, so missing values don't turn them into floats or objects
+        # split_blocks keeps each column its own block, so the float columns aren't consolidated (copied) into one 2d block
+        return table.to_pandas( types_mapper={ pa.int64(): pd.Int64Dtype(), pa.bool_(): pd.BooleanDtype() }.get,
+                                split_blocks=True, self_destruct=True )
+
+    # ints are parsed straight into Int64, going through float would round large source ids
+    return pd.read_csv( path + '.csv', usecols=columns, dtype={ col: pandas_types[kind] for col, kind in schema.items() } )
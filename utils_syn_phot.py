@@ -0,0 +1,242 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import astropy.units as u
+from astropy.coordinates import SkyCoord
+
+from utils_ids import designation_to_source_id, source_id_array
+
+######################################################################################################################################################
+
+# filter systems of the gaia xp synthetic photometry (gaiaxpy), by name
+# catalog: name of the system's result files (<catalog>1.syn.csv for the primaries, <catalog>2.syn.csv for the secondaries)
+# prefix: column prefix of the system, its columns are <prefix>_mag_<band>, <prefix>_flux_<band> and <prefix>_flux_error_<band>
+# bands: the system's bands
+filter_systems = {}
+
+def register_filter_system( name, catalog, prefix, bands ):
+
+    filter_systems[ name ] = { 'catalog': catalog, 'prefix': prefix, 'bands': list( bands ) }
+
+# standardised systems first, so a bare band name ('y', 'V', 'b') picks the standardised version
+register_filter_system( 'StromgrenStd',  'STG',  'StromgrenStd',  'vby' )
+register_filter_system( 'JkcStd',        'JKC',  'JkcStd',        'UBVRI' )
+register_filter_system( 'Stromgren',     'STG',  'Stromgren',     'uvby' )
+register_filter_system( 'Jkc',           'JKC',  'Jkc',           'UBVRI' )
+register_filter_system( 'SdssStd',       'SDSS', 'SdssStd',       'ugriz' )
+register_filter_system( 'Panstarrs1Std', 'PS1',  'Panstarrs1Std', 'grizy' )
+
+# a band by name, either '<system>.<band>' ('Stromgren.u') or a bare band ('y'), which is taken from the first system registered with it
+# returns the system, its catalog and the band's mag, flux and flux error columns
+def band( name ):
+
+    system, _, label = name.rpartition( '.' )
+    systems = [ system ] if system else [ s for s, fs in filter_systems.items() if label in fs['bands'] ]
+
+    if not systems or systems[0] not in filter_systems or label not in filter_systems[ systems[0] ]['bands']:
+        raise KeyError( f'no synthetic photometry band {name!r}, registered: {sorted( f"{s}.{b}" for s, fs in filter_systems.items() for b in fs["bands"] )}' )
+
+    fs = filter_systems[ systems[0] ]
+
+    return { 'name': name, 'system': systems[0], 'catalog': fs['catalog'],
+             'mag': f'{fs["prefix"]}_mag_{label}', 'flux': f'{fs["prefix"]}_flux_{label}', 'flux_error': f'{fs["prefix"]}_flux_error_{label}' }
+
+######################################################################################################################################################
+
+# synthetic photometry band for each wsi filter, adding a filter is adding its band here
+wsi_bands = { 'y': 'StromgrenStd.y', 'V': 'JkcStd.V' }
+
+syn_filters = { wsi_filter: band( name ) for wsi_filter, name in wsi_bands.items() }
+
+######################################################################################################################################################
+
+# int64 source ids of the gaia primaries (n=1) or secondaries (n=2) of a catalog, -1 where there is no star
+# the xmatch carries them as gaia_source_id1/2, the designation is only parsed for catalogs without them
+def gaia_source_ids( catalog, n ):
+
+    if f'gaia_source_id{n}' in catalog:
+        return source_id_array( catalog[ f'gaia_source_id{n}' ] )
+
+    return designation_to_source_id( catalog[ f'gaia_designation{n}' ] )
+
+######################################################################################################################################################
+
+# look up columns of a synthetic photometry catalog for an array of source ids in one join
+# the first catalog entry is used if a source id is repeated, nan where the source isn't in the catalog
+def syn_lookup( source_ids, catalog, columns ):
+
+    keyed = catalog.drop_duplicates( 'source_id' ).set_index( 'source_id' )[ columns ]
+
+    return keyed.reindex( source_ids ).reset_index( drop=True )
+
+######################################################################################################################################################
+
+# band store
+# a synthetic photometry catalog has the mag, flux and flux error of every band of one or two systems (20-30 columns), and only a
+# band or two of it are used. the columns a caller asks for are read from the csv once (usecols, nothing else is parsed) and cached
+# next to it in <csv>.bands/ as one .npy file per column, sorted by source_id. later loads memory map the cached files, so memory
+# and load time go with the bands used instead of the width of the catalog, and a column the cache doesn't have yet is added to it
+# the cache is keyed on the csv's size and modification time, and rebuilt from scratch if the csv changes
+
+# cache directory of a catalog csv
+def band_cache( path ):
+    return path + '.bands'
+
+# write an array to path.npy, through a temporary file so a reader never maps a half written column
+def save_column( path, array ):
+
+    with open( path + '.tmp', 'wb' ) as f:
+        np.save( f, array )
+
+    os.replace( path + '.tmp', path + '.npy' )
+
+# the cached columns of a catalog csv (and its sorted source_id), memory mapped, reading any that aren't cached yet from the csv
+def band_columns( path, columns ):
+
+    cache = band_cache( path )
+    os.makedirs( cache, exist_ok=True )
+
+    # empty the cache if it was built from a different version of the csv
+    info = os.stat( path )
+    stamp = { 'size': info.st_size, 'mtime_ns': info.st_mtime_ns }
+    manifest = os.path.join( cache, 'manifest.json' )
+
+    try:
+        with open( manifest ) as f:
+            current = json.load( f ) == stamp
+    except ( FileNotFoundError, ValueError ):
+        current = False
+
+    if not current:
+        for name in os.listdir( cache ):
+            if name.endswith( '.npy' ):
+                os.remove( os.path.join( cache, name ) )
+        with open( manifest, 'w' ) as f:
+            json.dump( stamp, f )
+
+    wanted = [ 'source_id' ] + [ col for col in dict.fromkeys( columns ) if col != 'source_id' ]
+    missing = [ col for col in wanted if not os.path.exists( os.path.join( cache, col + '.npy' ) ) ]
+
+    if missing:
+
+        catalog = pd.read_csv( path, usecols=list( dict.fromkeys( [ 'source_id' ] + missing ) ) )
+
+        # first entry of a repeated source id, sorted by source id (the same order every time the csv is read)
+        ids = catalog['source_id'].to_numpy( dtype=np.int64 )
+        first = np.flatnonzero( ~pd.Index( ids ).duplicated( keep='first' ) )
+        order = first[ np.argsort( ids[ first ], kind='stable' ) ]
+
+        for col in missing:
+            save_column( os.path.join( cache, col ), catalog[ col ].to_numpy()[ order ] )
+
+    return { col: np.load( os.path.join( cache, col + '.npy' ), mmap_mode='r' ) for col in wanted }
+
+# syn_lookup from the band store of a catalog csv instead of a catalog in memory, the same values
+def band_lookup( source_ids, path, columns ):
+
+    store = band_columns( path, columns )
+    ids = store['source_id']
+    source_ids = np.asarray( source_ids, dtype=np.int64 )
+
+    # position of each source id in the sorted ids
+    at = np.minimum( np.searchsorted( ids, source_ids ), max( len(ids) - 1, 0 ) )
+    found = ids[ at ] == source_ids if len(ids) else np.zeros( len(source_ids), dtype=bool )
+
+    return pd.DataFrame({ col: np.where( found, store[ col ][ at ], np.nan ) if len(ids) else np.full( len(source_ids), np.nan )
+                          for col in columns })
+
+# look up columns for source ids in a catalog, a dataframe in memory or the path of a catalog csv (through its band store)
+def catalog_lookup( source_ids, catalog, columns ):
+
+    if isinstance( catalog, str ):
+        return band_lookup( source_ids, catalog, columns )
+
+    return syn_lookup( source_ids, catalog, columns )
+
+######################################################################################################################################################
+
+# add synthetic mags (syn1, syn2) for the gaia primary and secondary of every row in a catalog
+# pri_catalog/sec_catalog are the synthetic photometry results for the primaries and secondaries of one filter system,
+# as dataframes or as paths of the csvs (read through the band store)
+# flux_errors=True also adds the flux errors of the band (syn_flux_error1, syn_flux_error2)
+def add_syn_mags( catalog, pri_catalog, sec_catalog, band, flux_errors=False ):
+
+    columns = [ band['mag'], band['flux_error'] ] if flux_errors else [ band['mag'] ]
+
+    pri = catalog_lookup( gaia_source_ids( catalog, 1 ), pri_catalog, columns )
+    sec = catalog_lookup( gaia_source_ids( catalog, 2 ), sec_catalog, columns )
+
+    catalog['syn1'] = pri[ band['mag'] ].to_numpy()
+    catalog['syn2'] = sec[ band['mag'] ].to_numpy()
+
+    if flux_errors:
+        catalog['syn_flux_error1'] = pri[ band['flux_error'] ].to_numpy()
+        catalog['syn_flux_error2'] = sec[ band['flux_error'] ].to_numpy()
+
+    return catalog
+
+######################################################################################################################################################
+
+# add the separation of the chosen gaia pair (gaia_sep, nan without both) and their Bp-Rp colors to the xmatch, shared by every filter
+def add_gaia_colors( wsi ):
+
+    # calculate separation of gaia choices (when available)
+    pri = SkyCoord( ra=wsi.gaia_ra1.to_list()*u.deg, dec=wsi.gaia_dec1.to_list()*u.deg, frame='icrs' )
+    sec = SkyCoord( ra=wsi.gaia_ra2.to_list()*u.deg, dec=wsi.gaia_dec2.to_list()*u.deg, frame='icrs' )
+    wsi['gaia_sep'] = pri.separation(sec).arcsec
+
+    # calculate Bp-Rp color for primaries and secondaries
+    wsi['gaia_br_diff1'] = wsi.gaia_phot_bp_mean_mag1 - wsi.gaia_phot_rp_mean_mag1
+    wsi['gaia_br_diff2'] = wsi.gaia_phot_bp_mean_mag2 - wsi.gaia_phot_rp_mean_mag2
+
+    return wsi
+
+######################################################################################################################################################
+
+# synthetic mags and dm for the observations taken in one wsi filter
+# reads just the filter's band from the primary and secondary synthetic photometry in syn_dir (see band store)
+def filter_syn_phot( wsi, wsi_filter, syn_dir='data/syn.phot' ):
+
+    band = syn_filters[ wsi_filter ]
+
+    # isolate filter
+    df = wsi.loc[ wsi.wsi_filter==wsi_filter ].reset_index(drop=True)
+
+    # primary and secondary synthetic photometry for this filter system
+    syn_pri = f'{syn_dir}/{band["catalog"]}1.syn.csv'
+    syn_sec = f'{syn_dir}/{band["catalog"]}2.syn.csv'
+
+    # pull synthetic mags for primary and secondary, nan if there is no gaia id or no synthetic photometry
+    df = add_syn_mags( df, syn_pri, syn_sec, band )
+
+    # calculate synthetic dm
+    df['syn_dm'] = np.abs( df.syn1 - df.syn2 )
+
+    return df
+
+######################################################################################################################################################
+
+# combine the per filter results back into one catalog in wsi_oid order
+def merge_filters( frames ):
+
+    wsi_syn = pd.concat( [df.reset_index(drop=True) for df in frames] ).reset_index(drop=True)
+
+    return wsi_syn.sort_values(['wsi_oid']).reset_index(drop=True)
+
+######################################################################################################################################################
+
+# synthetic mags of any bands by name (see band), for the gaia primary and secondary of every row of a catalog
+# adds syn_<name>1 and syn_<name>2 for each band ('.' in a name becomes '_'), only those bands are loaded
+def add_band_mags( catalog, names, syn_dir='data/syn.phot' ):
+
+    for name in names:
+
+        b = band( name )
+        label = name.replace( '.', '_' )
+
+        for n in (1, 2):
+            mags = band_lookup( gaia_source_ids( catalog, n ), f'{syn_dir}/{b["catalog"]}{n}.syn.csv', [ b['mag'] ] )
+            catalog[ f'syn_{label}{n}' ] = mags[ b['mag'] ].to_numpy()
+
+    return catalog
@@ -0,0 +1,384 @@
+import numpy as np
+import pandas as pd
+import astropy.units as u
+from astropy.coordinates import offset_by, angular_separation
+
+from utils_wds import wds_fields
+from utils_storage import prepped_schema, gaia_candidate_schema
+
+######################################################################################################################################################
+
+# synthetic double star catalogs for benchmarking the pipeline at sizes well past wsi24
+# every table has the columns (and column order) of the real one, and the tables are consistent with each other:
+# each wsi observation is of a system in the wds table, the gaia candidates are found around the propagated positions of its
+# primary and secondary, and the synthetic photometry is for the gaia sources of the stars themselves
+# positions are propagated with a small angle offset rather than astropy's space motion, so they are close to but not exactly
+# what wsi_prep would calculate
+
+######################################################################################################################################################
+
+# component formats of a system and how often each shows up
+comp_formats = { 'AB':0.9, 'A,BC':0.05, 'AB,CD':0.05 }
+
+# wsi filters and how often each was used (wsi24 is about 2/3 y)
+wsi_filters = { 'y':0.7, 'V':0.3 }
+
+# search radius (arcsec) and magnitude window of the gaia queries for primaries and secondaries (pri.04mag.05as, sec.04mag.10as)
+query_radius = { 'pri':5.0, 'sec':10.0 }
+query_dmag = 4.0
+
+# columns of the synthetic photometry catalogs, in the order gaiaxpy writes them
+syn_columns = {
+    'STG': [ 'source_id' ] + [ f'Stromgren_{q}_{b}' for q in ('mag', 'flux', 'flux_error') for b in 'uvby' ]
+                           + [ f'StromgrenStd_{q}_{b}' for q in ('mag', 'flux', 'flux_error') for b in 'vby' ],
+    'JKC': [ 'source_id' ] + [ f'{s}_{q}_{b}' for s in ('Jkc', 'JkcStd') for q in ('mag', 'flux', 'flux_error') for b in 'UBVRI' ],
+}
+
+# rough offset of each synthetic band from gaia G (mag)
+syn_offsets = { 'u':1.6, 'v':0.9, 'b':0.35, 'y':0.05, 'U':0.7, 'B':0.55, 'V':0.05, 'R':-0.3, 'I':-0.65 }
+
+# years from the wds epoch to gaia dr3
+epoch_years = 16.0
+
+######################################################################################################################################################
+
+# uniform positions on the sky (degrees)
+def sky_positions( n, rng ):
+
+    ra = rng.uniform( 0, 360, n )
+    dec = np.degrees( np.arcsin( rng.uniform( -1, 1, n ) ) )
+
+    return ra, dec
+
+######################################################################################################################################################
+
+# wds ids ('hhmmm+ddmm') and precise coordinates ('hh mm ss.ss +dd mm ss.s', the wds_coord layout) for J2000 positions in degrees
+# the coordinates are rounded to their printed precision, the ids are truncated like the wds does
+def wds_coord_strings( ra, dec ):
+
+    ra_s = np.round( ra / 15 * 3600, 2 ) % 86400
+    dec_s = np.minimum( np.round( np.abs( dec ) * 3600, 1 ), 90*3600 )
+    sign = np.where( dec < 0, '-', '+' )
+
+    hh, mm, ss = ( ra_s // 3600 ).astype(int), ( ra_s % 3600 // 60 ).astype(int), ra_s % 60
+    dd, dm, ds = ( dec_s // 3600 ).astype(int), ( dec_s % 3600 // 60 ).astype(int), dec_s % 60
+
+    ids = [ f'{h:02d}{m:02d}{int(s // 6)}{g}{d:02d}{n:02d}' for h, m, s, g, d, n in zip( hh, mm, ss, sign, dd, dm ) ]
+    coords = [ f'{h:02d} {m:02d} {s:05.2f} {g}{d:02d} {n:02d} {t:04.1f}' for h, m, s, g, d, n, t in zip( hh, mm, ss, sign, dd, dm, ds ) ]
+
+    # the printed coordinate, back in degrees
+    ra = ( hh*3600 + mm*60 + np.round( ss, 2 ) ) * 15 / 3600
+    dec = np.where( dec < 0, -1, 1 ) * ( dd*3600 + dm*60 + np.round( ds, 1 ) ) / 3600
+
+    return np.array( ids, dtype=object ), np.array( coords, dtype=object ), ra, dec
+
+######################################################################################################################################################
+
+# J2000 degrees of 'hh mm ss.ss +dd mm ss.s' coordinates
+def coord_degrees( coords ):
+
+    c = pd.Series( coords, dtype=object )
+    ra = ( c.str.slice(0, 2).astype(int)*3600 + c.str.slice(3, 5).astype(int)*60 + c.str.slice(6, 11).astype(float) ) * 15 / 3600
+    dec = ( c.str.slice(13, 15).astype(int)*3600 + c.str.slice(16, 18).astype(int)*60 + c.str.slice(19, 23).astype(float) ) / 3600
+    dec = np.where( c.str.slice(12, 13) == '-', -dec, dec )
+
+    return ra.to_numpy(), dec
+
+######################################################################################################################################################
+
+# move positions (degrees) by a proper motion (mas/yr) over some years
+def propagate( ra, dec, pm_ra, pm_dec, years ):
+
+    pa = np.arctan2( pm_ra, pm_dec )
+    distance = np.radians( np.hypot( pm_ra, pm_dec ) * years / 3.6e6 )
+
+    ra, dec = offset_by( np.radians( ra ), np.radians( dec ), pa, distance )
+
+    return ra.to_value( u.degree ), dec.to_value( u.degree )
+
+######################################################################################################################################################
+
+# position (degrees) at a separation (arcsec) and position angle (degrees) from another
+def offset_position( ra, dec, pa, sep ):
+
+    ra, dec = offset_by( np.radians( ra ), np.radians( dec ), np.radians( pa ), np.radians( sep / 3600 ) )
+
+    return ra.to_value( u.degree ), dec.to_value( u.degree )
+
+######################################################################################################################################################
+
+# the systems (one per wds entry), with the true properties of both stars
+# missing_pm is the fraction of secondaries without their own proper motion in the wds
+def synthetic_systems( n, rng, comps=comp_formats, missing_pm=0.2 ):
+
+    ra1, dec1 = sky_positions( n, rng )
+    wds_id, wds_coord, ra1, dec1 = wds_coord_strings( ra1, dec1 )
+
+    # separations are roughly log normal, most systems are a few arcsec apart (wsi24 mean ~8", max ~90")
+    sep = np.clip( rng.lognormal( np.log(4.0), 0.9, n ), 0.2, 90.0 )
+    pa = rng.uniform( 0, 360, n )
+
+    mag1 = rng.uniform( 3.5, 12.5, n )
+    dm = np.clip( rng.exponential( 2.0, n ), 0.05, 7.0 )
+
+    # common proper motion pairs, the secondary moves a little differently
+    pm1_ra, pm1_dec = rng.normal( 0, 40, n ), rng.normal( 0, 40, n )
+    pm2_ra, pm2_dec = pm1_ra + rng.normal( 0, 2, n ), pm1_dec + rng.normal( 0, 2, n )
+
+    return pd.DataFrame({ 'wds_id': wds_id,
+                          'wds_dd': [ f'STF{i % 10000:4d}' for i in range(n) ],
+                          'wds_comp': rng.choice( list( comps ), n, p=list( comps.values() ) ),
+                          'wds_coord': wds_coord,
+                          'ra1': ra1, 'dec1': dec1, 'sep': sep, 'pa': pa,
+                          'mag1': mag1, 'mag2': mag1 + dm,
+                          'pm1_ra': pm1_ra, 'pm1_dec': pm1_dec, 'pm2_ra': pm2_ra, 'pm2_dec': pm2_dec,
+                          'no_pm2': rng.random( n ) < missing_pm,
+                          'p_note': rng.random( n ) < 0.02 })
+
+######################################################################################################################################################
+
+# wds summary table (the columns wds_to_csv writes) for the systems
+# proper motions are whole mas/yr, and 10x too small for systems with a 'P' note
+def synthetic_wds( systems, rng ):
+
+    n = len( systems )
+    scale = np.where( systems.p_note, 0.1, 1.0 )
+
+    wds = pd.DataFrame({
+        'wds_id': systems.wds_id, 'wds_dd': systems.wds_dd, 'wds_comp': systems.wds_comp,
+        'wds_date_first': rng.integers( 1780, 2000, n ), 'wds_date_last': rng.integers( 2000, 2024, n ),
+        'wds_num_obs': rng.integers( 1, 200, n ),
+        'wds_pa_first': rng.integers( 0, 360, n ), 'wds_pa_last': np.round( systems.pa ).astype(int) % 360,
+        'wds_sep_first': np.round( systems.sep * rng.uniform( 0.8, 1.2, n ), 1 ), 'wds_sep_last': np.round( systems.sep, 1 ),
+        'wds_mag1': np.round( systems.mag1, 2 ), 'wds_mag2': np.round( systems.mag2, 2 ),
+        'wds_spt': rng.choice( [ 'G5V', 'K0III', 'F8V+G2V', 'A0V', '' ], n ),
+        'wds_pm1_ra': np.round( systems.pm1_ra * scale ), 'wds_pm1_dec': np.round( systems.pm1_dec * scale ),
+        'wds_pm2_ra': np.where( systems.no_pm2, np.nan, np.round( systems.pm2_ra * scale ) ),
+        'wds_pm2_dec': np.where( systems.no_pm2, np.nan, np.round( systems.pm2_dec * scale ) ),
+        'wds_durch_num': np.nan,
+        'wds_notes': np.where( systems.p_note, 'NP', rng.choice( [ '', 'N', 'O', 'V' ], n, p=[ 0.6, 0.3, 0.05, 0.05 ] ) ),
+        'wds_coord': systems.wds_coord })
+
+    # blank fields are missing, as in the csv
+    return wds[ list( wds_fields ) ].replace( '', np.nan )
+
+######################################################################################################################################################
+
+# wsi observations (the data/wsi24.csv columns), obs_per_system on average, each system observed at least once
+# returns the observations and the system each one is of
+def synthetic_wsi( systems, n_obs, rng, filters=wsi_filters ):
+
+    n_sys = len( systems )
+
+    # every system once, the rest of the observations spread over random systems, a system's observations are next to each other
+    system = np.sort( np.concatenate( [ np.arange( min( n_sys, n_obs ) ), rng.integers( 0, n_sys, max( n_obs - n_sys, 0 ) ) ] ) )
+    s = systems.iloc[ system ].reset_index( drop=True )
+    n = len( s )
+
+    # measured separation, pa and dm, with noise on the true values
+    sep = np.round( s.sep * ( 1 + rng.normal( 0, 0.002, n ) ), 4 )
+    pa = np.round( ( s.pa + rng.normal( 0, 0.1, n ) ) % 360, 2 )
+    dm = np.round( np.clip( s.mag2 - s.mag1 + rng.normal( 0, 0.2, n ), 0.1, 7.4 ), 1 )
+
+    # simbad ids of the stars (when simbad knew them), filled in by the gaia source ids later
+    wsi = pd.DataFrame({
+        'wds_id': s.wds_id, 'wds_dd': s.wds_dd, 'wds_comp': s.wds_comp,
+        'wsi_ra_deg': np.round( s.ra1, 4 ), 'wsi_dec_deg': np.round( s.dec1, 4 ),
+        'wsi_date': np.round( rng.uniform( 2020.43, 2022.5, n ), 4 ),
+        'wsi_filter': rng.choice( list( filters ), n, p=list( filters.values() ) ),
+        'wsi_sep': sep, 'wsi_sep_e': np.round( np.abs( rng.normal( 0, 0.02, n ) ), 4 ),
+        'wsi_pa': pa, 'wsi_pa_e': np.round( np.abs( rng.normal( 0, 0.3, n ) ), 2 ),
+        'wsi_dm': dm, 'wsi_dm_e': np.round( np.abs( rng.normal( 0, 0.05, n ) ), 4 ),
+        'wsi_dm_flag': pd.Series( rng.choice( [ ':', '*', '', 'q' ], n, p=[ 0.4, 0.35, 0.15, 0.1 ] ) ).replace( '', np.nan ),
+        'wsi_nav': rng.choice( [ 1, 2, 3, 6, 9 ], n, p=[ 0.75, 0.1, 0.08, 0.05, 0.02 ] ),
+        'wsi_avg': rng.choice( [ 1, 2, 3, 4 ], n, p=[ 0.87, 0.08, 0.04, 0.01 ] ),
+        'sb_id1': np.full( n, np.nan, dtype=object ), 'sb_id2': np.full( n, np.nan, dtype=object ),
+        'sb_flg1': rng.choice( [ '.', '$', '!' ], n, p=[ 0.72, 0.27, 0.01 ] ),
+        'sb_flg2': rng.choice( [ '.', '$', '!' ], n, p=[ 0.57, 0.42, 0.01 ] ) })
+
+    return wsi, system
+
+######################################################################################################################################################
+
+# the wsi as wsi_prep writes it (the prepped_schema columns), from the wds entry of each observation's system
+def synthetic_prepped( wsi, wds, system ):
+
+    w = wds.iloc[ system ].reset_index( drop=True )
+    prepped = wsi.drop( columns=[ 'wsi_ra_deg', 'wsi_dec_deg' ] ).rename_axis( 'wsi_oid' ).reset_index()
+
+    # secondaries without a proper motion get the primary's, and 'P' proper motions are scaled up
+    no_pm2 = w.wds_pm2_ra.isna().to_numpy()
+    scale = np.where( w.wds_notes.fillna('').str.contains('P'), 10.0, 1.0 )
+
+    pm1_ra, pm1_dec = w.wds_pm1_ra.to_numpy() * scale, w.wds_pm1_dec.to_numpy() * scale
+    pm2_ra = np.where( no_pm2, w.wds_pm1_ra, w.wds_pm2_ra ) * scale
+    pm2_dec = np.where( no_pm2, w.wds_pm1_dec, w.wds_pm2_dec ) * scale
+
+    # J2000 positions from the precise coordinate and the measured separation/pa, then moved to J2016
+    ra1, dec1 = coord_degrees( w.wds_coord )
+    ra2, dec2 = offset_position( ra1, dec1, prepped.wsi_pa.to_numpy(), prepped.wsi_sep.to_numpy() )
+    ra1, dec1 = propagate( ra1, dec1, pm1_ra, pm1_dec, epoch_years )
+    ra2, dec2 = propagate( ra2, dec2, pm2_ra, pm2_dec, epoch_years )
+
+    prepped = prepped.assign( wds_mag1=w.wds_mag1.to_numpy(), wds_mag2=w.wds_mag2.to_numpy(),
+                              wds_pm1_ra=pm1_ra, wds_pm1_dec=pm1_dec, wds_pm2_ra=pm2_ra, wds_pm2_dec=pm2_dec,
+                              wds_notes=w.wds_notes.fillna('').to_numpy(),
+                              epoch_prop_flag=np.where( no_pm2, '!', '.' ),
+                              wds_pm1=np.hypot( pm1_ra, pm1_dec ), wds_pm2=np.hypot( pm2_ra, pm2_dec ),
+                              wds_ra1=ra1, wds_dec1=dec1, wds_ra2=ra2, wds_dec2=dec2 )
+
+    return prepped[ list( prepped_schema ) ]
+
+######################################################################################################################################################
+
+# gaia sources around each system: the primary, the secondary (unless it is too close to resolve or was missed), and unrelated
+# field stars scattered in the search cones of both stars, multiplicity - 1 of them per cone on average
+# returns the sources (gaia_source_schema columns) and the system each is near, sorted by system, and the source of each star
+def synthetic_gaia( systems, rng, multiplicity=1.2 ):
+
+    n = len( systems )
+
+    # true J2016 positions of both stars
+    ra2, dec2 = offset_position( systems.ra1.to_numpy(), systems.dec1.to_numpy(), systems.pa.to_numpy(), systems.sep.to_numpy() )
+    ra1, dec1 = propagate( systems.ra1.to_numpy(), systems.dec1.to_numpy(), systems.pm1_ra.to_numpy(), systems.pm1_dec.to_numpy(), epoch_years )
+    ra2, dec2 = propagate( ra2, dec2, systems.pm2_ra.to_numpy(), systems.pm2_dec.to_numpy(), epoch_years )
+
+    has_sec = ( systems.sep.to_numpy() > 0.4 ) & ( rng.random( n ) > 0.05 )
+
+    # field stars, a random offset inside the cone and a magnitude inside (or a bit past) the query window
+    n_pri = rng.poisson( max( multiplicity - 1, 0 ), n )
+    n_sec = rng.poisson( max( multiplicity - 1, 0 ), n )
+    near_pri, near_sec = np.repeat( np.arange(n), n_pri ), np.repeat( np.arange(n), n_sec )
+
+    def field( near, ra, dec, mag, radius ):
+        m = len( near )
+        ra, dec = offset_position( ra[near], dec[near], rng.uniform( 0, 360, m ), radius * np.sqrt( rng.random( m ) ) )
+        return ra, dec, mag[near] + rng.uniform( -query_dmag - 1, query_dmag + 1, m )
+
+    mag1, mag2 = systems.mag1.to_numpy(), systems.mag2.to_numpy()
+    fra1, fdec1, fmag1 = field( near_pri, ra1, dec1, mag1, query_radius['pri'] )
+    fra2, fdec2, fmag2 = field( near_sec, ra2, dec2, mag2, query_radius['sec'] )
+
+    # star: 1 primary, 2 secondary, 0 field star
+    sec = np.flatnonzero( has_sec )
+    near = np.concatenate( [ np.arange(n), sec, near_pri, near_sec ] )
+    star = np.concatenate( [ np.full( n, 1 ), np.full( len(sec), 2 ), np.zeros( len(near_pri) + len(near_sec), dtype=int ) ] )
+    ra = np.concatenate( [ ra1, ra2[sec], fra1, fra2 ] )
+    dec = np.concatenate( [ dec1, dec2[sec], fdec1, fdec2 ] )
+    g = np.concatenate( [ mag1 + rng.normal( 0, 0.3, n ), mag2[sec] + rng.normal( 0, 0.3, len(sec) ), fmag1, fmag2 ] )
+    pm_ra = np.concatenate( [ systems.pm1_ra, systems.pm2_ra.to_numpy()[sec], rng.normal( 0, 10, len(near_pri) + len(near_sec) ) ] )
+    pm_dec = np.concatenate( [ systems.pm1_dec, systems.pm2_dec.to_numpy()[sec], rng.normal( 0, 10, len(near_pri) + len(near_sec) ) ] )
+
+    order = np.argsort( near, kind='stable' )
+    near, star, ra, dec, g, pm_ra, pm_dec = near[order], star[order], ra[order], dec[order], g[order], pm_ra[order], pm_dec[order]
+    m = len( near )
+
+    # unique source ids in the range dr3 uses
+    source_id = 10**18 + np.arange( m, dtype=np.int64 ) * 1000 + rng.integers( 0, 1000, m )
+    color = rng.uniform( 0.2, 2.5, m )
+    pmra, pmdec = pm_ra + rng.normal( 0, 0.05, m ), pm_dec + rng.normal( 0, 0.05, m )
+
+    gaia = pd.DataFrame({
+        'designation': [ f'Gaia DR3 {i}' for i in source_id ], 'source_id': source_id,
+        'ra': ( ra + rng.normal( 0, 0.03/3600, m ) / np.cos( np.radians( dec ) ) ) % 360, 'dec': dec + rng.normal( 0, 0.03/3600, m ),
+        'parallax': rng.lognormal( np.log(5.0), 0.8, m ), 'pmra': pmra, 'pmdec': pmdec, 'pm': np.hypot( pmra, pmdec ),
+        'phot_g_mean_mag': g, 'phot_bp_mean_mag': g + 0.35*color, 'phot_rp_mean_mag': g - 0.65*color,
+        'has_xp_continuous': ( g < 17.65 ) & ( rng.random( m ) < 0.6 ),
+        'ruwe': rng.lognormal( 0.0, 0.3, m ),
+        'phot_variable_flag': np.where( rng.random( m ) < 0.08, 'VARIABLE', 'NOT_AVAILABLE' ),
+        'non_single_star': rng.choice( 5, m, p=[ 0.9, 0.05, 0.03, 0.015, 0.005 ] ) })
+
+    # row of the primary's and secondary's source for each system, -1 for unresolved secondaries
+    star_row = { s: np.full( n, -1 ) for s in (1, 2) }
+    for s in (1, 2):
+        rows = np.flatnonzero( star == s )
+        star_row[ s ][ near[rows] ] = rows
+
+    return gaia, near, star_row
+
+######################################################################################################################################################
+
+# gaia candidates (gaia_candidate_schema columns) around the primary or secondary of every prepped observation
+# which is 'pri' or 'sec', candidates are every source near the system inside the query cone and magnitude window
+def synthetic_candidates( prepped, system, gaia, near, which ):
+
+    n = 1 if which == 'pri' else 2
+    target_ra = prepped[ f'wds_ra{n}' ].to_numpy()
+    target_dec = prepped[ f'wds_dec{n}' ].to_numpy()
+    target_mag = prepped[ f'wds_mag{n}' ].to_numpy()
+
+    # every (observation, source near its system) pair
+    starts = np.searchsorted( near, system, side='left' )
+    counts = np.searchsorted( near, system, side='right' ) - starts
+    obs = np.repeat( np.arange( len(prepped) ), counts )
+    rows = np.arange( counts.sum() ) - np.repeat( np.cumsum( counts ) - counts, counts ) + np.repeat( starts, counts )
+
+    sep = np.degrees( angular_separation( np.radians( target_ra[obs] ), np.radians( target_dec[obs] ),
+                                          np.radians( gaia.ra.to_numpy()[rows] ), np.radians( gaia.dec.to_numpy()[rows] ) ) ) * 3600
+    dm = np.abs( gaia.phot_g_mean_mag.to_numpy()[rows] - target_mag[obs] )
+
+    keep = ( sep <= query_radius[ which ] ) & ( dm <= query_dmag )
+    obs, rows = obs[keep], rows[keep]
+
+    candidates = pd.concat( [ pd.DataFrame({ 'target_oid': prepped.wsi_oid.to_numpy()[obs],
+                                             'wds_id': prepped.wds_id.to_numpy()[obs], 'wds_comp': prepped.wds_comp.to_numpy()[obs],
+                                             'wsi_sep': prepped.wsi_sep.to_numpy()[obs],
+                                             'target_ra': target_ra[obs], 'target_dec': target_dec[obs], 'target_mag': target_mag[obs] }),
+                              gaia.iloc[ rows ].reset_index( drop=True ),
+                              pd.DataFrame({ 'target_dm': dm[keep], 'target_sep': sep[keep] }) ], axis=1 )
+
+    return candidates[ list( gaia_candidate_schema ) ]
+
+######################################################################################################################################################
+
+# synthetic photometry catalog (syn_columns of 'STG' or 'JKC') for the gaia sources with xp spectra
+def synthetic_syn_phot( sources, catalog, rng ):
+
+    sources = sources.loc[ sources.has_xp_continuous ]
+    m = len( sources )
+    g = sources.phot_g_mean_mag.to_numpy()
+
+    syn = { 'source_id': sources.source_id.to_numpy() }
+    for col in syn_columns[ catalog ][1:]:
+        quantity, band = col.split('_', 1)[1].rsplit('_', 1)
+        mag = g + syn_offsets[ band ] + rng.normal( 0, 0.02, m )
+        flux = 10 ** ( -0.4 * ( mag + 26.0 ) )
+        syn[ col ] = { 'mag': mag, 'flux': flux, 'flux_error': flux * rng.uniform( 0.002, 0.02, m ) }[ quantity ]
+
+    return pd.DataFrame( syn )[ syn_columns[ catalog ] ]
+
+######################################################################################################################################################
+
+# a full set of consistent synthetic tables with n wsi observations
+# comps: component formats and their weights, e.g. { 'AB':0.5, 'A,BC':0.25, 'AB,CD':0.25 }
+# missing_pm: fraction of wds secondaries without a proper motion
+# multiplicity: the star itself plus multiplicity - 1 unrelated field stars in each search cone on average (a companion inside the cone adds to this)
+# obs_per_system: mean number of wsi observations of each wds entry (wsi24 has ~1.36)
+# returns a dict with 'wds', 'wsi', 'prepped', 'gaia_pri', 'gaia_sec', and 'STG1', 'STG2', 'JKC1', 'JKC2' synthetic photometry
+def synthetic_catalog( n, seed=0, comps=comp_formats, missing_pm=0.2, multiplicity=1.2, obs_per_system=1.36, filters=wsi_filters ):
+
+    rng = np.random.default_rng( seed )
+
+    systems = synthetic_systems( max( int( n / obs_per_system ), 1 ), rng, comps, missing_pm )
+    wds = synthetic_wds( systems, rng )
+    wsi, system = synthetic_wsi( systems, n, rng, filters )
+    gaia, near, star_row = synthetic_gaia( systems, rng, multiplicity )
+
+    # simbad knew the gaia id of most stars
+    for s, col, known in [ (1, 'sb_id1', 0.73), (2, 'sb_id2', 0.57) ]:
+        rows = star_row[ s ][ system ]
+        found = ( rows >= 0 ) & ( rng.random( len(wsi) ) < known )
+        wsi.loc[ found, col ] = gaia.designation.to_numpy()[ rows[found] ]
+
+    prepped = synthetic_prepped( wsi, wds, system )
+
+    tables = { 'wds': wds, 'wsi': wsi, 'prepped': prepped,
+               'gaia_pri': synthetic_candidates( prepped, system, gaia, near, 'pri' ),
+               'gaia_sec': synthetic_candidates( prepped, system, gaia, near, 'sec' ) }
+
+    for s in (1, 2):
+        stars = gaia.iloc[ star_row[ s ][ star_row[ s ] >= 0 ] ]
+        for catalog in syn_columns:
+            tables[ f'{catalog}{s}' ] = synthetic_syn_phot( stars, catalog, rng )
+
+    return tables
@@ -0,0 +1,244 @@
+import numpy as np
+import pandas as pd
+
+######################################################################################################################################################
+
+# streaming reader for the fixed width wds summary (with secondary precise coordinates)
+# the file is read in blocks of bytes, and every column is sliced out of the block with numpy instead of line by line
+# blank fields and the '.' placeholders are parsed as missing values
+
+######################################################################################################################################################
+
+# first and last character of each field (the col_starts/col_ends astropy was given in wds_to_csv), and its type ('str', 'int' or 'float')
+wds_fields = { 'wds_id':(0, 9, 'str'), 'wds_dd':(10, 16, 'str'), 'wds_comp':(17, 21, 'str'),
+               'wds_date_first':(23, 26, 'int'), 'wds_date_last':(28, 31, 'int'), 'wds_num_obs':(33, 36, 'int'),
+               'wds_pa_first':(38, 40, 'int'), 'wds_pa_last':(42, 44, 'int'),
+               'wds_sep_first':(46, 50, 'float'), 'wds_sep_last':(52, 56, 'float'),
+               'wds_mag1':(58, 62, 'float'), 'wds_mag2':(64, 68, 'float'), 'wds_spt':(70, 78, 'str'),
+               'wds_pm1_ra':(80, 83, 'float'), 'wds_pm1_dec':(84, 87, 'float'),
+               'wds_pm2_ra':(89, 92, 'float'), 'wds_pm2_dec':(93, 96, 'float'),
+               'wds_durch_num':(98, 105, 'str'), 'wds_notes':(107, 110, 'str'),
+               'wds_coord':(112, 134, 'str') }
+
+# proper motion columns, scaled by 10 for systems with a 'P' note when scale_pm=True
+pm_columns = ['wds_pm1_ra', 'wds_pm1_dec', 'wds_pm2_ra', 'wds_pm2_dec']
+
+space, dot, newline, carriage_return = ord(' '), ord('.'), ord('\n'), ord('\r')
+
+######################################################################################################################################################
+
+# width of a full wds line
+line_width = max( last for _, last, _ in wds_fields.values() ) + 1
+
+# 2d array of bytes with one row per line, padded with spaces past the end of short lines
+# if every line has the same length (the summary is padded to a fixed width) and ends in a newline this is a view of the buffer, not a copy
+# (a last line without a newline is one byte short of the reshape, so it takes the padded path)
+def line_bytes( buf, starts, ends, width=line_width ):
+
+    lengths = ends - starts
+    if len(lengths) and ( lengths == lengths[0] ).all() and lengths[0] >= width and starts[0] == 0 and ends[-1] < len(buf):
+        return buf[ : len(lengths) * (lengths[0] + 1) ].reshape( len(lengths), lengths[0] + 1 )[:, :width]
+
+    positions = starts[:, None] + np.arange( width )
+    inside = positions < ends[:, None]
+
+    return np.where( inside, buf[ np.minimum( positions, len(buf) - 1 ) ], space ).astype( np.uint8 )
+
+######################################################################################################################################################
+
+# first and last (+1) non-space character of each row of a field, and whether the row has any
+# fields are only a few characters wide, so this loops over the characters rather than reducing along the rows
+def field_extent( block ):
+
+    first = np.zeros( len(block), dtype=np.int64 )
+    last = np.zeros( len(block), dtype=np.int64 )
+    present = np.zeros( len(block), dtype=bool )
+
+    for j in range( block.shape[1] ):
+        filled = block[:, j] != space
+        first[ filled & ~present ] = j
+        last[ filled ] = j + 1
+        present |= filled
+
+    return first, last, present
+
+######################################################################################################################################################
+
+# strip the spaces from both ends of each row of a field, returns an object array of str with None for blank fields
+def field_strings( block ):
+
+    block = np.ascontiguousarray( block )
+    width = block.shape[1]
+    first, last, present = field_extent( block )
+
+    # shift each row left past its leading spaces (if there are any), and null out everything past the last character
+    columns = np.arange( width )
+    if first.any():
+        block = np.take_along_axis( block, np.minimum( columns + first[:, None], width - 1 ), axis=1 )
+    shifted = np.where( columns < (last - first)[:, None], block, np.uint8(0) )
+
+    # fixed width bytes drop their trailing nulls, so this is the stripped text
+    strings = shifted.view( f'S{width}' ).ravel().astype( str ).astype( object )
+    strings[ ~present ] = None
+
+    return strings
+
+######################################################################################################################################################
+
+# parse a numeric field, blank fields and '.' placeholders are nan
+# plain decimals are built from their digits (an integer divided by a power of ten, which rounds the same as float())
+# one character at a time across all rows, anything else (exponents, stray characters) goes through pandas, nan if it isn't a number
+def field_numbers( block ):
+
+    # one row per character, so each character of every line is contiguous
+    chars = np.ascontiguousarray( block.T )
+    n = chars.shape[1]
+
+    mantissa = np.zeros( n, dtype=np.int64 )
+    decimals = np.zeros( n, dtype=np.int64 )
+    n_digits = np.zeros( n, dtype=np.int64 )
+    after_dot = np.zeros( n, dtype=bool )
+    signed = np.zeros( n, dtype=bool )
+    ended = np.zeros( n, dtype=bool )
+    negative = np.zeros( n, dtype=bool )
+    other = np.zeros( n, dtype=bool )
+
+    for c in chars:
+        digit = c - np.uint8( ord('0') )
+        is_digit = digit < 10
+        is_dot = c == dot
+        is_sign = ( c == ord('-') ) | ( c == ord('+') )
+
+        mantissa = np.where( is_digit, mantissa * 10 + digit, mantissa )
+        decimals += is_digit & after_dot
+
+        # a second '.', a sign after the number started, anything after a space that ended it, or any other character
+        started = ( n_digits > 0 ) | after_dot | signed
+        other |= ( is_dot & after_dot ) | ( is_sign & started ) | ( ~(c == space) & ended ) | ~( is_digit | is_dot | is_sign | (c == space) )
+        ended |= ( c == space ) & started
+
+        n_digits += is_digit
+        after_dot |= is_dot
+        signed |= is_sign
+        negative |= c == ord('-')
+
+    values = mantissa / 10.0 ** decimals
+    values[ negative ] *= -1
+    values[ n_digits == 0 ] = np.nan
+
+    # too many digits for an exact integer, or not a plain decimal
+    other = ( other | (n_digits > 15) ) & ( n_digits > 0 )
+    if other.any():
+        text = np.ascontiguousarray( block[ other ] ).view( f'S{block.shape[1]}' ).ravel().astype( str )
+        values[ other ] = pd.to_numeric( pd.Series( text ), errors='coerce' ).to_numpy()
+
+    return values
+
+######################################################################################################################################################
+
+# parse a block of complete lines into a dataframe
+# columns limits the fields that are parsed, wds_ids only keeps those systems (the other fields are never sliced for the rest)
+def parse_wds_lines( data, columns=None, wds_ids=None, scale_pm=False ):
+
+    buf = np.frombuffer( data, dtype=np.uint8 )
+
+    # treat windows line endings as trailing spaces
+    if carriage_return in data:
+        buf = np.where( buf == carriage_return, space, buf ).astype( np.uint8 )
+
+    # line boundaries, the last line might not have a newline
+    ends = np.flatnonzero( buf == newline )
+    if len(buf) and buf[-1] != newline:
+        ends = np.append( ends, len(buf) )
+    starts = np.concatenate( [ [0], ends + 1 ] )[ :len(ends) ].astype( np.int64 )
+
+    lines = line_bytes( buf, starts, ends )
+
+    # skip blank lines
+    first, last, _ = wds_fields['wds_id']
+    ids = field_strings( lines[:, first : last + 1] )
+    keep = ids != None
+
+    # predicate pushdown, only keep the wanted systems before slicing anything else
+    if wds_ids is not None:
+        keep &= pd.Series( ids ).isin( wds_ids ).to_numpy()
+
+    if not keep.all():
+        lines, ids = lines[ keep ], ids[ keep ]
+
+    columns = list( wds_fields ) if columns is None else list( columns )
+    chunk = {}
+
+    for name in columns:
+        first, last, kind = wds_fields[ name ]
+
+        if name == 'wds_id':
+            chunk[ name ] = ids
+            continue
+
+        block = lines[:, first : last + 1]
+        if kind == 'str':
+            chunk[ name ] = field_strings( block )
+        elif kind == 'int':
+            values = field_numbers( block )
+            chunk[ name ] = pd.arrays.IntegerArray( np.nan_to_num( values ).astype( np.int64 ), np.isnan( values ) )
+        else:
+            chunk[ name ] = field_numbers( block )
+
+    # proper motions flagged with a 'P' in the notes are 10x too small
+    if scale_pm:
+        first, last, _ = wds_fields['wds_notes']
+        p_flag = ( lines[:, first : last + 1] == ord('P') ).any( axis=1 )
+        for name in pm_columns:
+            if name in chunk:
+                chunk[ name ] = np.where( p_flag, chunk[ name ] * 10, chunk[ name ] )
+
+    return pd.DataFrame( chunk, columns=columns )
+
+######################################################################################################################################################
+
+# stream the wds summary in chunks of about chunk_bytes, yields a dataframe for each chunk with any wanted rows
+# columns: fields to parse (all of them by default)
+# wds_ids: collection of wds ids to keep, everything else is skipped while parsing
+# scale_pm: multiply the proper motions of systems with a 'P' note by 10
+def wds_chunks( path, columns=None, wds_ids=None, scale_pm=False, chunk_bytes=1<<22 ):
+
+    if wds_ids is not None:
+        wds_ids = set( wds_ids )
+
+    with open( path, 'rb' ) as f:
+
+        rest = b''
+        while True:
+            data = f.read( chunk_bytes )
+            if not data:
+                break
+
+            # only parse complete lines, keep the partial last line for the next block
+            data = rest + data
+            cut = data.rfind( b'\n' ) + 1
+            data, rest = data[:cut], data[cut:]
+
+            if data:
+                chunk = parse_wds_lines( data, columns, wds_ids, scale_pm )
+                if len(chunk):
+                    yield chunk
+
+        # last line without a newline
+        if rest.strip():
+            chunk = parse_wds_lines( rest, columns, wds_ids, scale_pm )
+            if len(chunk):
+                yield chunk
+
+######################################################################################################################################################
+
+# read the whole wds summary (or just the wanted systems) into one dataframe
+def read_wds( path, columns=None, wds_ids=None, scale_pm=False, chunk_bytes=1<<22 ):
+
+    chunks = list( wds_chunks( path, columns, wds_ids, scale_pm, chunk_bytes ) )
+
+    # empty frame with the right columns if nothing matched
+    if not chunks:
+        return parse_wds_lines( b'', columns )
+
+    return pd.concat( chunks, ignore_index=True )
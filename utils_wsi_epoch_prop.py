@@ -1,11 +1,15 @@
+import erfa
+import threading
 import numpy as np
 import pandas as pd
+from collections import OrderedDict
 
 import astropy.units as u
 from astropy.time import Time
-from astropy.coordinates import SkyCoord
+from astropy.coordinates import ICRS, SphericalRepresentation, SphericalDifferential
 
-from utils_skycoords import set_wds_skycoord
+from utils_skycoords import set_wds_skycoord, set_wds_skycoords, wds_positions, primary_skycoords, secondary_skycoords
+import utils_profile as profile
 
 import warnings 
 from erfa import ErfaWarning
@@ -13,45 +17,258 @@ from erfa import ErfaWarning
 # ignore erfa warnings
 warnings.simplefilter('ignore', category=ErfaWarning)
 
+######################################################################################################################################################
+
+# column suffix for an epoch, a year (2016.0 -> 'J2016', 2015.5 -> 'J2015.5') or the name of a per row column of years
+def epoch_label( epoch ):
+
+    if isinstance( epoch, pd.Series ):
+        return str( epoch.name )
+
+    return f'J{float( epoch ):g}'
+
+# the icrs position and motion of every star in a skycoord, in the form erfa.pmsafe takes
+# this is the part of apply_space_motion that doesn't depend on the new time, so it only has to be done once for many epochs
+# (the wds stars have no distance or radial velocity, pmsafe gets 0 for both as apply_space_motion gives it)
+def space_motion_state( coord ):
+
+    rep = coord.icrs.represent_as( SphericalRepresentation, SphericalDifferential )
+    vel = rep.differentials['s']
+
+    return ( rep.lon.radian, rep.lat.radian, vel.d_lon.to_value( u.radian/u.yr ), vel.d_lat.to_value( u.radian/u.yr ), coord.obstime.tdb )
+
+# positions (degrees) of the stars in a space_motion_state at a time (scalar or one per star)
+# the same numbers as coord.apply_space_motion( when ).ra/.dec, the result goes through an icrs frame the way astropy builds it
+def move_to( state, when ):
+
+    lon, lat, pm_lon, pm_lat, t1 = state
+    t2 = when.tdb
+
+    moved = erfa.pmsafe( lon, lat, pm_lon, pm_lat, 0.0, 0.0, t1.jd1, t1.jd2, t2.jd1, t2.jd2 )
+
+    icrs = ICRS( ra=u.Quantity( moved[0], u.radian ), dec=u.Quantity( moved[1], u.radian ),
+                 pm_ra=u.Quantity( moved[2], u.radian/u.yr ), pm_dec=u.Quantity( moved[3], u.radian/u.yr ),
+                 radial_velocity=u.Quantity( moved[5], u.km/u.s ), differential_type=SphericalDifferential )
+
+    return icrs.ra.degree, icrs.dec.degree
+
+# propagate whole columns of primaries and secondaries to several epochs in one pass
+# epochs is a list of years (2016.0) and/or per row columns of years (named series, e.g. wsi.wsi_date for the observation dates)
+# the skycoords and their space motion state are built once, so each extra epoch only adds an erfa.pmsafe call per star
+# returns a dataframe with the J2000 positions (in degrees) of both stars, their positions at every epoch
+# (wds_ra1_<label>, wds_dec1_<label>, wds_ra2_<label>, wds_dec2_<label>, labels from epoch_label) and the primary pm substitution flag
+@profile.timed()
+def epoch_prop_batch( coords, pm1_ra, pm1_dec, pm2_ra, pm2_dec, pa, sep, epochs ):
+
+    labels = [ epoch_label( epoch ) for epoch in epochs ]
+    if len( set( labels ) ) < len( labels ):
+        raise ValueError( f'epochs need distinct labels, got {labels}' )
+
+    # skycoord objects holding every row
+    pri, sec, flags = set_wds_skycoords( coords, pm1_ra, pm1_dec, pm2_ra, pm2_dec, pa, sep )
+    pri_state, sec_state = space_motion_state( pri ), space_motion_state( sec )
+
+    prop = { 'wds_ra1_J2000':  pri.ra.degree,  'wds_dec1_J2000': pri.dec.degree,
+             'wds_ra2_J2000':  sec.ra.degree,  'wds_dec2_J2000': sec.dec.degree }
+
+    # propogate motion to each epoch
+    for epoch, label in zip( epochs, labels ):
+        when = Time( np.asarray( epoch, dtype=float ), format='jyear', scale='tcb' )
+        prop[ f'wds_ra1_{label}' ], prop[ f'wds_dec1_{label}' ] = move_to( pri_state, when )
+        prop[ f'wds_ra2_{label}' ], prop[ f'wds_dec2_{label}' ] = move_to( sec_state, when )
+
+    prop['epoch_prop_flag'] = flags
+
+    return pd.DataFrame( prop )
+
+# propagate whole columns of primaries and secondaries to J2016 (gaia dr3) in one pass
+# returns a dataframe with J2000 and J2016 positions (in degrees) of both stars, plus the primary pm substitution flag
+@profile.timed()
+def J2016_prop_batch( coords, pm1_ra, pm1_dec, pm2_ra, pm2_dec, pa, sep ):
+
+    prop = epoch_prop_batch( coords, pm1_ra, pm1_dec, pm2_ra, pm2_dec, pa, sep, [2016.0] )
+
+    return prop.rename( columns={ 'wds_ra1_J2016':'wds_ra1', 'wds_dec1_J2016':'wds_dec1', 'wds_ra2_J2016':'wds_ra2', 'wds_dec2_J2016':'wds_dec2' } )
+
+######################################################################################################################################################
+
+# memoized J2016_prop_batch, for catalogs with many repeat observations of the same pair
+# the primary of a repeat has the same wds_coord1, pm1_ra and pm1_dec every time, so its decoded J2000 position and its
+# propagated position are kept in an lru keyed on those and the epoch, and only the primaries not seen yet are propagated
+# the secondaries are offset from the remembered primary positions (their pa and sep differ between observations)
+# returns a function taking the same columns as J2016_prop_batch plus the epoch to propagate to, with the same results
+# hits (rows whose primary was remembered), misses and evicted entries are counted in the function's stats dict
+def memoized_propagation( max_entries=100_000 ):
+
+    # (coord, pm_ra, pm_dec, epoch) -> slot in store, least recently used first
+    # each slot of store holds ra J2000 (hours), dec J2000, ra at epoch and dec at epoch
+    memo = OrderedDict()
+    store = { 'states': np.empty( (0, 4) ) }
+    lock = threading.Lock()
+    stats = { 'hits':0, 'misses':0, 'evicted':0 }
+
+    # pms as python floats with nans as None, so they match as keys
+    def key_values( x ):
+        values = x.astype( object )
+        values[ np.isnan( x ) ] = None
+        return values
+
+    # remember new states, reusing the slots of the least recently used entries past max_entries
+    def insert( keys, states ):
+
+        new = [ k for k, key in enumerate( keys ) if key not in memo ][ -max_entries: ]
+        extra = max( len( memo ) + len( new ) - max_entries, 0 )
+        slots = [ memo.popitem( last=False )[1] for _ in range( extra ) ]
+        stats['evicted'] += extra
+
+        size = len( store['states'] )
+        slots += range( size, size + len( new ) - extra )
+        if len( new ) > extra:
+            store['states'] = np.concatenate([ store['states'], np.empty( ( len( new ) - extra, 4 ) ) ])
+
+        store['states'][ slots ] = states[ new ]
+        memo.update( zip( [ keys[k] for k in new ], slots ) )
+
+    @profile.timed( 'memoized_propagation' )
+    def propagate( coords, pm1_ra, pm1_dec, pm2_ra, pm2_dec, pa, sep, epoch=2016.0 ):
+
+        coords = np.asarray( coords, dtype=object )
+        pm1_ra = np.asarray( pm1_ra, dtype=float )
+        pm1_dec = np.asarray( pm1_dec, dtype=float )
+
+        # each distinct primary in this batch, and the first row it is in
+        group = pd.DataFrame({ 'coord': coords, 'pm_ra': pm1_ra, 'pm_dec': pm1_dec }) \
+                  .groupby( ['coord', 'pm_ra', 'pm_dec'], sort=False, dropna=False ).ngroup().to_numpy()
+        first = np.unique( group, return_index=True )[1]
+        keys = list( zip( coords[ first ], key_values( pm1_ra[ first ] ), key_values( pm1_dec[ first ] ), [ float( epoch ) ] * len(first) ) )
+
+        # remembered primaries
+        with lock:
+            slots = np.array( [ memo.get( key, -1 ) for key in keys ], dtype=int )
+            found = np.flatnonzero( slots >= 0 )
+            for k in found:
+                memo.move_to_end( keys[k] )
+            states = np.full( ( len(keys), 4 ), np.nan )
+            states[ found ] = store['states'][ slots[ found ] ]
+
+        # propagate the rest
+        missed = np.flatnonzero( slots < 0 )
+        if len(missed):
+            rows = first[ missed ]
+            ra, dec = wds_positions( coords[ rows ] )
+            moved = move_to( space_motion_state( primary_skycoords( (ra, dec), pm1_ra[ rows ], pm1_dec[ rows ] ) ), Time( epoch, format='jyear', scale='tcb' ) )
+            states[ missed ] = np.column_stack([ ra, dec, *moved ])
+
+        with lock:
+            stats['misses'] += len( missed )
+            stats['hits'] += len( coords ) - len( missed )
+            insert( [ keys[k] for k in missed ], states[ missed ] )
+
+        profile.count( 'propagation_memo', 'hits', len( coords ) - len( missed ) )
+        profile.count( 'propagation_memo', 'misses', len( missed ) )
+
+        # secondaries offset from every row's primary
+        state = states[ group ]
+        pri = primary_skycoords( (state[:,0], state[:,1]), pm1_ra, pm1_dec )
+        sec, flags = secondary_skycoords( pri, pm2_ra, pm2_dec, pa, sep )
+        sec_ra, sec_dec = move_to( space_motion_state( sec ), Time( epoch, format='jyear', scale='tcb' ) )
+
+        return pd.DataFrame({ 'wds_ra1_J2000':  pri.ra.degree,  'wds_dec1_J2000': pri.dec.degree,
+                              'wds_ra2_J2000':  sec.ra.degree,  'wds_dec2_J2000': sec.dec.degree,
+                              'wds_ra1':  state[:,2],           'wds_dec1': state[:,3],
+                              'wds_ra2':  sec_ra,               'wds_dec2': sec_dec,
+                              'epoch_prop_flag': flags })
+
+    def clear():
+        with lock:
+            memo.clear()
+            store['states'] = np.empty( (0, 4) )
+
+    propagate.stats = stats
+    propagate.clear = clear
+    return propagate
+
+######################################################################################################################################################
+
 # propagate positions for all primaries and secondaries in the wsi
-def wsi_J2016_prop( wsi ):
+# memo: a memoized_propagation to use instead of J2016_prop_batch, so repeat primaries are only propagated once
+@profile.timed()
+def wsi_J2016_prop( wsi, memo=None ):
+
+    # empty wsi has nothing to propagate, skycoord will not take empty string arrays
+    if len(wsi) == 0:
+        for col in ['wds_ra1', 'wds_dec1', 'wds_ra2', 'wds_dec2']:
+            wsi[col] = np.array( [], dtype=float )
+        return wsi
+
+    # calculate J2000 & J2016 positions of pri and sec for the whole catalog
+    prop = ( memo or J2016_prop_batch )( wsi.wds_coord1, wsi.wds_pm1_ra, wsi.wds_pm1_dec,
+                                         wsi.wds_pm2_ra, wsi.wds_pm2_dec, wsi.wsi_pa, wsi.wsi_sep )
+
+    # add results to wsi data frame
+    # J2000 positions and the pm flag are also in prop if needed
+    wsi['wds_ra1']  = prop.wds_ra1.to_numpy()
+    wsi['wds_dec1'] = prop.wds_dec1.to_numpy()
+    wsi['wds_ra2']  = prop.wds_ra2.to_numpy()
+    wsi['wds_dec2'] = prop.wds_dec2.to_numpy()
+
+    return wsi
+
+######################################################################################################################################################
+
+# propagate positions for all primaries and secondaries in the wsi to several epochs (see epoch_prop_batch)
+# adds wds_ra1_<label>, wds_dec1_<label>, wds_ra2_<label> and wds_dec2_<label> for every epoch, e.g.
+#   wsi_epoch_prop( wsi, [2016.0, 2017.0, wsi.wsi_date] ) -> wds_ra1_J2016, ..., wds_ra1_J2017, ..., wds_ra1_wsi_date, ...
+@profile.timed()
+def wsi_epoch_prop( wsi, epochs ):
+
+    labels = [ epoch_label( epoch ) for epoch in epochs ]
+    columns = [ f'wds_{col}_{label}' for label in labels for col in ['ra1', 'dec1', 'ra2', 'dec2'] ]
+
+    # empty wsi has nothing to propagate, skycoord will not take empty string arrays
+    if len(wsi) == 0:
+        for col in columns:
+            wsi[col] = np.array( [], dtype=float )
+        return wsi
+
+    prop = epoch_prop_batch( wsi.wds_coord1, wsi.wds_pm1_ra, wsi.wds_pm1_dec,
+                             wsi.wds_pm2_ra, wsi.wds_pm2_dec, wsi.wsi_pa, wsi.wsi_sep, epochs )
 
-    # lists to hold coords and flags
-    pri_J2000 = []
+    for col in columns:
+        wsi[col] = prop[col].to_numpy()
+
+    return wsi
+
+######################################################################################################################################################
+
+# original row by row propagation, kept as a reference for checking the batch version
+def wsi_J2016_prop_loop( wsi ):
+
+    # lists to hold coords
     pri_J2016 = []
-    sec_J2000 = []
     sec_J2016 = []
-    # flags = []
-    
+
     # J2016 time for astropy space motion method
     J2016 = Time(2016.0, format='jyear', scale='tcb')
 
-    # loop through wsi, calculate J2000 & J2016 positions of pri and sec
+    # loop through wsi, calculate J2016 positions of pri and sec
     for i in range( len(wsi) ):
 
         # skycoord object for current index
         pri, sec = set_wds_skycoord( wsi, i )
-        
+
         # propogate motion
         pri_prop = pri.apply_space_motion( J2016 )
         sec_prop = sec.apply_space_motion( J2016 )
 
         # add coordinates (in degrees) to results list
-        pri_J2000.append( [pri.ra.degree, pri.dec.degree] )  
         pri_J2016.append( [pri_prop.ra.degree, pri_prop.dec.degree] )
-        sec_J2000.append( [sec.ra.degree, sec.dec.degree] )
         sec_J2016.append( [sec_prop.ra.degree, sec_prop.dec.degree] )
-        # flags.append( flag )
 
     # add results to wsi data frame
-    # wsi['wds_ra1_J2000'] =  [x[0] for x in pri_J2000]
-    # wsi['wds_dec1_J2000'] = [x[1] for x in pri_J2000]
-    # wsi['wds_ra2_J2000'] =  [x[0] for x in sec_J2000]
-    # wsi['wds_dec2_J2000'] = [x[1] for x in sec_J2000]
     wsi['wds_ra1']  = [x[0] for x in pri_J2016]
     wsi['wds_dec1'] = [x[1] for x in pri_J2016]
     wsi['wds_ra2']  = [x[0] for x in sec_J2016]
     wsi['wds_dec2'] = [x[1] for x in sec_J2016]
-    # wsi['epoch_prop_flag'] = flags
 
     return wsi
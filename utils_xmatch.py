@@ -1,8 +1,15 @@
-import math
 import numpy as np
 import pandas as pd
+import multiprocessing as mp
 import astropy.units as u
-from astropy.coordinates import SkyCoord
+from astropy.coordinates import SkyCoord, angular_separation
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+import utils_profile as profile
+from utils_skycoords import wds_id_coords
+from utils_components import comp_labels
+from utils_candidates import candidate_store, target_slices, link_candidates, drop_sources
 # from utils_xmatch_pri_select import primary_selection
 # from utils_xmatch_sec_select import secondary_selection
 
@@ -13,7 +20,7 @@ from astropy.coordinates import SkyCoord
 def primary_selection(matches):
 
         if len(matches)==1:
-            gaia_id = matches['designation'].iloc[ 0 ]
+            gaia_id = matches['source_id'].iloc[ 0 ]
             index = matches['original_index'].iloc[ 0 ]
             flag = '.'
             return gaia_id, index, flag
@@ -29,7 +36,7 @@ def primary_selection(matches):
             min_mag_index = matches['phot_g_mean_mag'].idxmin()
             
             # set the variables for the match
-            gaia_id = matches['designation'].iloc[ min_mag_index ]
+            gaia_id = matches['source_id'].iloc[ min_mag_index ]
             index = matches['original_index'].iloc[ min_mag_index ]
             flag = '!'
             
@@ -42,7 +49,7 @@ def secondary_selection( primary, matches ):
         # if there's only one match, choose it ##################################################        
         if len(matches)==1:
             
-            gaia_id = matches['designation'].iloc[ 0 ]
+            gaia_id = matches['source_id'].iloc[ 0 ]
             index = matches['original_index'].iloc[ 0 ]
             flag = '.'
             
@@ -73,7 +80,7 @@ def secondary_selection( primary, matches ):
         if best_sep_index == min_dm_index:
         
             # set the variables for the match
-            gaia_id = matches['designation'].iloc[ min_dm_index ]
+            gaia_id = matches['source_id'].iloc[ min_dm_index ]
             index = matches['original_index'].iloc[ min_dm_index ]
             flag = ':'
         
@@ -82,7 +89,7 @@ def secondary_selection( primary, matches ):
         # return the closest match otherwise ################################
         else:
             min_sep_index = matches['target_sep'].idxmin()
-            gaia_id = matches['designation'].iloc[ min_sep_index ]
+            gaia_id = matches['source_id'].iloc[ min_sep_index ]
             index = matches['original_index'].iloc[ min_sep_index ]
             flag = '!'
             
@@ -90,98 +97,414 @@ def secondary_selection( primary, matches ):
             
 #################################################################################################################################################
 
-def primary_loop(wsi, gaia):
+# position of the first minimum in each segment of values, -1 for an empty segment
+# segments holds the segment number (0 to n-1) of each value
+# skipna=True ignores nans like pandas idxmin (-1 if the segment is all nan), skipna=False returns the first nan like numpy argmin
+def segment_argmin( values, segments, n, skipna=True ):
+
+    positions = np.arange( len(values) )
+    nans = np.isnan( values )
+
+    # sort by segment, then nans last (or first), then value, then position so ties go to the first occurrence
+    nan_key = nans if skipna else ~nans
+    order = np.lexsort( ( positions, np.where( nans, 0, values ), nan_key, segments ) )
+
+    # first entry of each segment in the sorted order
+    sorted_segments = segments[ order ]
+    first = np.flatnonzero( np.r_[ True, sorted_segments[1:] != sorted_segments[:-1] ] ) if len(order) else np.array( [], dtype=int )
+    firsts = order[ first ]
+
+    if skipna:
+        firsts = firsts[ ~nans[firsts] ]
+
+    argmins = np.full( n, -1 )
+    argmins[ segments[firsts] ] = firsts
+
+    return argmins
+
+#################################################################################################################################################
+
+# secondary_selection for every target at once
+# pri_ra, pri_dec, wsi_sep are per target, the candidate arrays are per candidate with segments giving each candidate's target
+# returns the position of the chosen candidate for each target (-1 if none) and the selection flags
+def secondary_selection_batch( pri_ra, pri_dec, wsi_sep, ra, dec, target_dm, target_sep, segments ):
+
+    n = len(pri_ra)
+    counts = np.bincount( segments, minlength=n )
+
+    # separation between each candidate and its target's primary choice (vincenty formula, same as skycoord.separation)
+    separations = angular_separation( pri_ra[segments] * u.degree, pri_dec[segments] * u.degree,
+                                      ra * u.degree, dec * u.degree ).to_value( u.arcsec )
+
+    # diff in separation compared to our wsi measurement
+    sep_diff = np.abs( separations - wsi_sep[segments] )
+
+    # closest in magnitude, closest to our wsi separation, and closest to the target position
+    min_dm_index   = segment_argmin( target_dm, segments, n )
+    best_sep_index = segment_argmin( sep_diff, segments, n, skipna=False )
+    min_sep_index  = segment_argmin( target_sep, segments, n )
+
+    # if there's only one match, choose it
+    single = counts == 1
+    multiple = counts > 1
+
+    # if the closest in magnitude also has the best wsi separation, choose it
+    agree = multiple & ( best_sep_index == min_dm_index )
+
+    # return the closest match otherwise
+    closest = multiple & ~agree & ( min_sep_index != -1 )
+
+    first_index = np.r_[ 0, np.cumsum( counts )[:-1] ]
+
+    chosen = np.full( n, -1 )
+    chosen[ single ]  = first_index[ single ]
+    chosen[ agree ]   = min_dm_index[ agree ]
+    chosen[ closest ] = min_sep_index[ closest ]
+
+    # flag if there are no potential matches
+    flags = np.full( n, '$' )
+    flags[ single ]  = '.'
+    flags[ agree ]   = ':'
+    flags[ closest ] = '!'
+
+    return chosen, flags
+
+#################################################################################################################################################
+
+# columns the selection functions need from each candidate
+selection_columns = ['original_index', 'source_id', 'ra', 'dec', 'target_sep', 'target_dm', 'phot_g_mean_mag']
+
+#################################################################################################################################################
+
+# candidates of each target, from one phase of the candidate store (see utils_candidates)
+# returns the links as a frame (original_index is the link number) and the start/end offsets of the links of each oid
+def partition_candidates( store, phase, oids ):
+
+    starts, ends = target_slices( phase, oids )
+
+    return link_candidates( store, phase, selection_columns ), starts, ends
+
+# gaia star of each chosen link (nan where nothing was chosen)
+def chosen_sources( phase, indexes ):
+
+    indexes = np.asarray( indexes, dtype=float )
+    found = ~np.isnan( indexes )
+
+    rows = np.full( len(indexes), np.nan )
+    rows[ found ] = phase['source'][ indexes[found].astype( np.int64 ) ]
+
+    return rows
+
+#################################################################################################################################################
+
+# build the crossmatch table from the source chosen for each target (nan where nothing was chosen)
+# a typed reindex leaves the missing targets empty, int and bool columns become nullable types instead of falling back to object
+def assemble_matches( sources, indexes ):
+
+    indexes = np.asarray( indexes, dtype=float )
+    found = ~np.isnan( indexes )
+
+    xmatch = sources.iloc[ indexes[found].astype(int) ]
+
+    if not found.all():
+        nullable = { col: 'Int64' if pd.api.types.is_integer_dtype(dtype) else 'boolean'
+                     for col, dtype in xmatch.dtypes.items()
+                     if pd.api.types.is_integer_dtype(dtype) or pd.api.types.is_bool_dtype(dtype) }
+        xmatch = xmatch.astype( nullable )
+
+    # place each match at its target's position, everything else is left empty
+    xmatch.index = np.flatnonzero( found )
+    xmatch = xmatch.reindex( range( len(indexes) ) )
+
+    return xmatch
+
+#################################################################################################################################################
+
+# parallel primary selection
+# the targets are split into declination bands (from the wds id) with about the same number of candidates in each, and the bands
+# are shared out to a pool of processes, each running select_primaries on its own targets
+# the sorted candidate columns primary_selection needs are put in shared memory once, the workers attach to them and only the
+# target numbers of each band (and the choices coming back) are pickled
+# the pool forks (workers start with the parent's modules, and the pipeline scripts have no __main__ guard for spawn to rerun)
+
+# columns primary_selection reads
+primary_columns = ['original_index', 'source_id', 'target_sep', 'phot_g_mean_mag']
+
+# bands per worker, more bands than workers evens out the load
+bands_per_worker = 4
+
+#################################################################################################################################################
+
+# copy arrays into new shared memory blocks, returns the blocks and the (name, dtype, shape) of each for a worker to attach to
+def share_arrays( arrays ):
+
+    blocks, specs = [], {}
+    for name, array in arrays.items():
+        array = np.ascontiguousarray( array )
+        block = shared_memory.SharedMemory( create=True, size=max( array.nbytes, 1 ) )
+        np.ndarray( array.shape, array.dtype, buffer=block.buf )[...] = array
+        blocks.append( block )
+        specs[ name ] = ( block.name, array.dtype.str, array.shape )
+
+    return blocks, specs
+
+# attach to shared arrays, returns the blocks (close them once the arrays are no longer used) and the arrays
+def attach_arrays( specs ):
+
+    blocks, arrays = [], {}
+    for name, ( block_name, dtype, shape ) in specs.items():
+        block = shared_memory.SharedMemory( name=block_name )
+        blocks.append( block )
+        arrays[ name ] = np.ndarray( shape, np.dtype( dtype ), buffer=block.buf )
+
+    return blocks, arrays
+
+#################################################################################################################################################
+
+# split targets into declination bands holding about equal numbers of candidates, returns the target numbers in each band
+# targets whose wds id has no position go in the last band
+def sky_bands( wds_ids, counts, n_bands ):
+
+    _, dec, _ = wds_id_coords( wds_ids )
+    order = np.argsort( np.nan_to_num( dec, nan=91.0 ), kind='stable' )
+
+    # every target costs a little even without candidates
+    work = np.cumsum( counts[ order ] + 1 )
+    cuts = np.searchsorted( work, work[-1] * np.arange( 1, n_bands ) / n_bands ) if len(work) else []
+
+    return [ band for band in np.split( order, cuts ) if len(band) ]
+
+#################################################################################################################################################
+
+# select the primaries of one band of targets, in a worker process
+def select_band( specs, targets ):
+
+    blocks, arrays = attach_arrays( specs )
+
+    try:
+        # the band's candidates, laid end to end
+        starts, ends = arrays['starts'][ targets ], arrays['ends'][ targets ]
+        counts = ends - starts
+        rows = np.arange( counts.sum() ) - np.repeat( np.cumsum( counts ) - counts, counts ) + np.repeat( starts, counts )
+
+        candidates = pd.DataFrame({ col: arrays[ col ][ rows ] for col in primary_columns })
+
+        band_ends = np.cumsum( counts )
+        indexes, flags = select_primaries( candidates, band_ends - counts, band_ends )
+
+    # drop every view of the shared memory before closing it
+    finally:
+        del arrays
+        for block in blocks:
+            block.close()
+
+    return indexes, flags
+
+# select_primaries over a pool of processes, same results in the same order
+def parallel_select_primaries( wds_ids, candidates, starts, ends, workers ):
+
+    bands = sky_bands( np.asarray( wds_ids, dtype=object ), ends - starts, workers * bands_per_worker )
+
+    arrays = { col: candidates[ col ].to_numpy() for col in primary_columns }
+    arrays['starts'], arrays['ends'] = starts, ends
+
+    # object columns (nullable types) can't be shared, select serially
+    if any( array.dtype.kind == 'O' for array in arrays.values() ):
+        return select_primaries( candidates, starts, ends )
+
+    blocks, specs = share_arrays( arrays )
+
+    indexes = np.full( len(starts), np.nan )
+    flags = np.full( len(starts), '$', dtype=object )
+
+    try:
+        with ProcessPoolExecutor( max_workers=workers, mp_context=mp.get_context('fork') ) as pool:
+            for band, ( band_indexes, band_flags ) in zip( bands, pool.map( select_band, [ specs ] * len(bands), bands ) ):
+                indexes[ band ] = np.asarray( band_indexes, dtype=float )
+                flags[ band ] = band_flags
+
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    return indexes, list( flags )
+
+##################################################################################################################################################
+
+# run primary_selection on each target's slice of the sorted candidates
+# returns the row of gaia chosen for each target (nan if nothing was chosen) and the selection flags
+def select_primaries( candidates, starts, ends ):
 
-    gaia_ids = []
     indexes = [] 
     flags = []
 
-    for oid in wsi.index:
+    for start, end in zip( starts, ends ):
+
+        t0 = profile.item_start()
 
-        # get dataframe of potential matches from xmatch based on oid (index from queried wsi csv, called target_oid in gaia)
-        matches = gaia.loc[ gaia['target_oid'] == oid ].reset_index(names='original_index')
+        # dataframe of potential matches for this target
+        matches = candidates.iloc[ start:end ].reset_index(drop=True)
        
         # run selection function, will fail if matches is empty
         try:
-            gaia_id, index, flag = primary_selection( matches )
+            _, index, flag = primary_selection( matches )
 
         except:
-            gaia_id, index, flag = '', np.nan, '$' # flag if there are no potential matches
+            index, flag = np.nan, '$' # flag if there are no potential matches
 
-        gaia_ids.append( gaia_id )
         indexes.append( index )
         flags.append( flag )
 
-    xmatch = gaia.iloc[ indexes ].drop( columns=['wds_id','wds_comp','wsi_sep','target_ra','target_dec','target_sep','target_dm','target_mag'] )
-    xmatch['flag'] = flags
+        # time and branch of each target
+        profile.item_end( 'primary_selection', t0 )
+        profile.count( 'primary_selection', flag )
 
-    return xmatch
+    return indexes, flags
+
+##################################################################################################################################################
+
+# observations of the same primary component usually have the same candidates, and primary_selection only looks at the candidates
+# returns the target each target can take its selection from: an earlier target of the same (wds_id, primary component) with
+# identical candidates (source_id, separation and G mag, in the same order), or itself
+def repeated_targets( wsi, candidates, starts, ends ):
+
+    n = len( starts )
+    targets = np.arange( n )
+
+    # first target of each primary component
+    pri_label, _ = comp_labels( wsi.wds_comp )
+    group = pd.DataFrame({ 'wds_id': wsi.wds_id.to_numpy(), 'label': pri_label }).groupby( ['wds_id', 'label'], sort=False, dropna=False ).ngroup().to_numpy()
+    first = np.unique( group, return_index=True )[1][ group ]
+
+    # repeats with as many candidates as the first target, compared candidate by candidate
+    counts = ends - starts
+    maybe = np.flatnonzero( ( first != targets ) & ( counts == counts[ first ] ) )
+
+    rows = np.arange( counts[ maybe ].sum() ) - np.repeat( np.cumsum( counts[ maybe ] ) - counts[ maybe ], counts[ maybe ] )
+    owners = np.repeat( np.arange( len(maybe) ), counts[ maybe ] )
+    own_rows = starts[ maybe ][ owners ] + rows
+    first_rows = starts[ first[ maybe ] ][ owners ] + rows
+
+    same = candidates.source_id.to_numpy()[ own_rows ] == candidates.source_id.to_numpy()[ first_rows ]
+    for col in ['target_sep', 'phot_g_mean_mag']:
+        values = candidates[ col ].to_numpy( dtype=float )
+        a, b = values[ own_rows ], values[ first_rows ]
+        same &= ( a == b ) | ( np.isnan( a ) & np.isnan( b ) )
+
+    differs = np.bincount( owners[ ~same ], minlength=len(maybe) ) > 0
+
+    source = targets.copy()
+    source[ maybe[ ~differs ] ] = first[ maybe[ ~differs ] ]
+
+    return source
+
+##################################################################################################################################################
+
+# workers > 1 runs the selection in a pool of processes, sharded by sky region (see parallel_select_primaries)
+# the selection only runs once per primary component (see repeated_targets), the other observations of it get the same choice
+# returns the crossmatch table and the source row of each choice in the store
+def primary_loop( wsi, store, workers=1 ):
+
+    with profile.span( 'primary_loop', rows_in=len(wsi), workers=workers ) as s, profile.sampled( 'primary_loop' ):
+
+        # slices of potential matches for each target, based on oid (index from queried wsi csv, called target_oid in gaia)
+        candidates, starts, ends = partition_candidates( store, store['pri'], wsi.index )
+
+        source = repeated_targets( wsi, candidates, starts, ends )
+        own = np.flatnonzero( source == np.arange( len(source) ) )
+
+        if workers > 1 and 'fork' in mp.get_all_start_methods():
+            own_indexes, own_flags = parallel_select_primaries( wsi.wds_id.to_numpy()[ own ], candidates, starts[ own ], ends[ own ], workers )
+            profile.count_values( 'primary_selection', own_flags )
+        else:
+            own_indexes, own_flags = select_primaries( candidates, starts[ own ], ends[ own ] )
+
+        indexes = np.full( len(source), np.nan )
+        flags = np.empty( len(source), dtype=object )
+        indexes[ own ] = np.asarray( own_indexes, dtype=float )
+        flags[ own ] = own_flags
+
+        # repeats take the candidate at the same place in their own slice
+        repeats = np.flatnonzero( source != np.arange( len(source) ) )
+        firsts = source[ repeats ]
+        found = ~np.isnan( indexes[ firsts ] )
+        indexes[ repeats[found] ] = starts[ repeats[found] ] + indexes[ firsts[found] ] - starts[ firsts[found] ]
+        flags[ repeats ] = flags[ firsts ]
+
+        profile.count( 'primary_selection_repeats', 'reused', len(repeats) )
+
+        rows = chosen_sources( store['pri'], indexes )
+        xmatch = assemble_matches( store['sources'], rows )
+        xmatch['flag'] = flags
+
+        s.rows_out = int( ( xmatch.flag != '$' ).sum() )
+
+    return xmatch, rows
     
 ##################################################################################################################################################
 
 #!!!!!!!!!!!!!!!!!!! the only way this currently works is if you have a match for the primary !!!!!!!!!!!!!!!!!!!!!
 
-def secondary_loop( wsi, gaia ):
+# phase: the secondary links of the store, less the primary choices
+@profile.timed()
+def secondary_loop( wsi, store, phase ):
 
-    gaia_ids = []
-    indexes = [] 
-    flags = []
+    # slices of potential matches for each target, based on oid (index from queried wsi csv, called target_oid in gaia)
+    candidates, starts, ends = partition_candidates( store, phase, wsi.index )
 
-    for oid in wsi.index:
-        
-        # gaia choice of primary
-        primary_choice = wsi.iloc[oid]
-        
-        # get dataframe of potential matches from xmatch based on oid (index from queried wsi csv, called target_oid in gaia)
-        matches = gaia.loc[ gaia['target_oid'] == oid ].reset_index(names='original_index')
-       
-        # run selection function, will fail if matches is empty
-        try:
-            gaia_id, index, flag = secondary_selection( primary_choice, matches )
+    # lay the slices end to end, with the target number of each candidate
+    counts = ends - starts
+    segments = np.repeat( np.arange( len(wsi) ), counts )
+    rows = np.arange( counts.sum() ) - np.repeat( np.cumsum( counts ) - counts, counts ) + np.repeat( starts, counts )
+    candidates = candidates.iloc[ rows ]
 
-        except:
-            gaia_id, index, flag = '', np.nan, '$' # flag if there are no potential matches
+    # select the secondary for every target, using the gaia choice of primary
+    with profile.span( 'secondary_selection_batch', rows_in=len(wsi), candidates=len(candidates) ) as s:
+        chosen, flags = secondary_selection_batch( wsi.gaia_ra1.to_numpy( dtype=float ), wsi.gaia_dec1.to_numpy( dtype=float ),
+                                                   wsi.wsi_sep.to_numpy( dtype=float ),
+                                                   candidates.ra.to_numpy( dtype=float ), candidates.dec.to_numpy( dtype=float ),
+                                                   candidates.target_dm.to_numpy( dtype=float ), candidates.target_sep.to_numpy( dtype=float ),
+                                                   segments )
+        s.rows_out = int( ( chosen != -1 ).sum() )
 
-        gaia_ids.append( gaia_id )
-        indexes.append( index )
-        flags.append( flag )
-    
-    # filter nans out of index
-    filtered_indexes = [x for x in indexes if not math.isnan(x)]
-    
-    # build dataframe of xmatches
-    xmatch = gaia.iloc[ filtered_indexes ].drop( columns=['wds_id','wds_comp','wsi_sep','target_ra','target_dec','target_sep','target_dm','target_mag'] ).reset_index(drop=True)
-    
-    # empty dataframe to hold spots where we are missing secondaries
-    empty_df = pd.DataFrame( index = wsi.index, columns = xmatch.columns )
-    empty_df['target_oid'] = wsi.wsi_oid
+    # branch each target took
+    profile.count_values( 'secondary_selection', flags )
 
-    # loop through the found matches and add them to the empty dataframe
-    for i, oid in enumerate( xmatch.target_oid ):
-        empty_df.iloc[oid] = xmatch.iloc[i]
+    # link chosen for each target, nan if nothing was chosen
+    indexes = np.full( len(wsi), np.nan )
+    indexes[ chosen != -1 ] = candidates.original_index.to_numpy()[ chosen[ chosen != -1 ] ]
+
+    # build dataframe of xmatches, with empty rows where we are missing secondaries
+    xmatch = assemble_matches( store['sources'], chosen_sources( phase, indexes ) )
+    xmatch.index = wsi.index
     
-    empty_df['flag'] = flags
-    return empty_df
+    xmatch['flag'] = flags
+    return xmatch
     
 ##################################################################################################################################################
 
-def wsi_gaia_xmatch( wsi, gaia_query_pri, gaia_query_sec ):
+# crossmatch against a candidate store (see utils_candidates)
+# workers > 1 selects the primaries in that many processes, the output is the same as the serial crossmatch
+# only the primary selection is split across processes, the secondary phase is vectorized and runs once in this process
+@profile.timed()
+def candidate_xmatch( wsi, store, workers=1 ):
     
     # cross match primaries ###########################################################
-    xmatch_pri = primary_loop( wsi, gaia_query_pri )
+    xmatch_pri, primary_rows = primary_loop( wsi, store, workers )
     
     # rename columns
     xmatch_pri = xmatch_pri.add_prefix('gaia_').add_suffix('1')
 
-    # remove primary gaia id choices from secondary search pool #######################
-    primary_gaia_ids = np.unique( xmatch_pri.gaia_designation1 )
-    gaia_query_sec = gaia_query_sec.loc[ ~gaia_query_sec['designation'].isin( primary_gaia_ids ) ].reset_index(drop=True)
+    # remove primary gaia choices from secondary search pool ##########################
+    # a source is one gaia star, so dropping the chosen sources drops every candidate with a chosen source_id
+    sec = drop_sources( store, store['sec'], primary_rows[ ~np.isnan( primary_rows ) ].astype( np.int64 ) )
 
     # add primary matches to wsi ######################################################
     wsi_primaries_matched = pd.concat( [ wsi.reset_index(drop=True), xmatch_pri.reset_index(drop=True) ], axis=1 )
 
     # cross match secondaries #########################################################
-    xmatch_sec = secondary_loop( wsi_primaries_matched, gaia_query_sec )
+    xmatch_sec = secondary_loop( wsi_primaries_matched, store, sec )
     
     # rename columns
     xmatch_sec = xmatch_sec.add_prefix('gaia_').add_suffix('2')
@@ -190,8 +513,10 @@ def wsi_gaia_xmatch( wsi, gaia_query_pri, gaia_query_sec ):
     wsi_xmatch = pd.concat( [ wsi.reset_index(drop=True), 
                               xmatch_pri.reset_index(drop=True), 
                               xmatch_sec.reset_index(drop=True) ], axis=1 )
-
-    # drop any unwanted columns
-    wsi_xmatch = wsi_xmatch.drop(columns=['gaia_target_oid1','gaia_target_oid2'])
     
-    return wsi_xmatch # return combined df
\ No newline at end of file
+    return wsi_xmatch # return combined df
+
+# crossmatch against the primary and secondary candidate tables (gaia_candidate_schema)
+def wsi_gaia_xmatch( wsi, gaia_query_pri, gaia_query_sec, workers=1 ):
+
+    return candidate_xmatch( wsi, candidate_store( gaia_query_pri, gaia_query_sec ), workers )
@@ -1,65 +1,89 @@
 import warnings
 import numpy as np
 import pandas as pd
-from astroquery.simbad import Simbad
+from functools import partial
 from astropy.utils.exceptions import AstropyWarning
 
-from utils_simbad import query_gaia_by_wds
+import utils_profile as profile
+from utils_journal import read_journal, journal_writer, compact_journal
+from utils_simbad import wds_component_search, query_gaia_by_wds, query_gaia_by_wds_tap, query_gaia_by_wds_batch, throttled_query, cached_query, \
+                         resolve_concurrently, resolve_batched, batch_resolve, simbad_tap_url
 
 warnings.simplefilter('ignore', category=AstropyWarning)
 pd.set_option('mode.chained_assignment', None)
 
 
-# load wds component file
-wds = pd.read_csv( 'data/simbad.comp.query/wds_components.summ.csv' ).iloc[225000:]
-
-ids = tuple( wds.wds_id )
-comps = tuple( wds.wds_comp )
-
-# allocate array to hold ids and flags
-simbad_results = []
-simbad_flags = []
-
-# loop through wsi and try to find a matches through simbad
-for i, ID in enumerate( ids ):
-
-    # show and save progress
-    if i % 1000 == 0:
-        print(i)
-        df = pd.DataFrame( {'id':simbad_results, 'flag':simbad_flags} )
-        df.to_csv( 'data/simbad.comp.query/sb.checkpoint.csv' )
-    
-    # if the component is an A, run the AB specific search
-    if comps[i] == 'A':
-    
-        # try to find match for A directly
-        try:
-            simbad_results.append( query_gaia_by_wds( 'WDS J' + ID + 'A' ) )
-            simbad_flags.append( '' )
-        
-        # if nothing is found, try AB
-        except: 
-            try:
-                simbad_results.append( query_gaia_by_wds( 'WDS J' + ID + 'AB' ) )
-                simbad_flags.append( '!' ) # flag that first choice wasnt found
-                 
-            except: # if nothing is still found, flag it
-                simbad_results.append( '' )
-                simbad_flags.append( '$' )
-
-    # run a direct search for everything other component
-    else:
-        try:
-            simbad_results.append( query_gaia_by_wds( 'WDS J' + ID + comps[i] ) )
-            simbad_flags.append( '' )
-
-        except:
-            simbad_results.append( '' )
-            simbad_flags.append( '$' )
-
-# add columns to wds
-wds['sb_id'] = simbad_results
-wds['sb_flag'] = simbad_flags
+# load wds component file, replace empty comps with AB
+wds = pd.read_csv( 'data/simbad.comp.query/wds_components.summ.csv' ).replace({'wds_comp':np.nan},'AB')
+
+# results are appended to the journal as they come in, a rerun picks up where the last one stopped
+journal = 'data/simbad.comp.query/sb.journal.csv'
+
+# unique components that aren't in the journal yet
+done = read_journal( journal )
+todo = [ key for key in dict.fromkeys( zip( wds.wds_id, wds.wds_comp ) ) if key not in done ]
+print( f'{len(done)} components already resolved, {len(todo)} to go' )
+
+# simbad connection settings
+tap = False           # send the single queries straight to url instead of through astroquery, both run the same exact identifier match
+url = simbad_tap_url  # or a local stand-in, see simbad_stub.py (tap and batch queries)
+max_workers = 8       # concurrent requests
+rate = 10             # max requests per second
+retries = 3           # retries for failed requests, with exponential backoff starting at backoff seconds
+backoff = 0.5
+timeout = 30          # seconds per request
+cache = 'data/simbad.cache.sqlite' # lookups are cached here between runs, use another file when url is a stand-in
+batch = True          # resolve identifiers with batched queries (many identifiers per request) instead of one request each
+
+# rate limited query with retries, behind a cache, shared by all threads
+single_query = partial( query_gaia_by_wds_tap, url=url, timeout=timeout ) if tap else partial( query_gaia_by_wds, timeout=timeout )
+query = throttled_query( single_query, rate=rate, retries=retries, backoff=backoff )
+query = cached_query( query, path=cache )
+
+# batched queries, answered from the cache where possible and cached as they come back, failed batches are split down to single (cached) queries
+batch_query = throttled_query( partial( query_gaia_by_wds_batch, url=url, timeout=timeout ), rate=rate, retries=retries, backoff=backoff )
+resolve = lambda wds_ids: batch_resolve( wds_ids, batch_query, query )
+
+# a search that fails (a network error that outlasted the retries) returns None and is kept out of the journal,
+# so the next run queries it again instead of taking it as not found
+failed = []
+def search( wds_id, comp, query ):
+    try:
+        return wds_component_search( wds_id, comp, query )
+    except OSError:
+        failed.append( (wds_id, comp) )
+        return None
+
+# record each result in the journal as soon as it's resolved
+record, close = journal_writer( journal )
+def record_result( key, result ):
+    if result is not None:
+        record( *key, *result )
+
+# run the searches 1000 at a time to show progress
+chunk = 1000
+for i in range( 0, len(todo), chunk ):
+
+    print(i)
+    args = todo[i:i+chunk]
+
+    with profile.span( 'simbad_chunk', rows_in=len(args), first=i ):
+        if batch:
+            for key, result in zip( args, resolve_batched( search, args, resolve ) ):
+                record_result( key, result )
+        else:
+            resolve_concurrently( search, args, query, max_workers=max_workers, callback=record_result )
+
+close()
+
+if failed:
+    print( f'{len(failed)} components failed to resolve and were left out of the journal, rerun to retry them' )
+
+# write the pending cache access times
+query.close()
+
+# compact the journal into the full results
+wds = compact_journal( wds, journal )
 
 # export csv
-wds.to_csv('data/simbad.comp.query/sb.225k.end.csv', index=False)
+wds.to_csv('data/simbad.comp.query/sb.comp.csv', index=False)
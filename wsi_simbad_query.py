@@ -1,13 +1,26 @@
 import warnings
 import numpy as np
 import pandas as pd
-from astroquery.simbad import Simbad
+from functools import partial
 from astropy.utils.exceptions import AstropyWarning
-from utils_simbad import A_search, AB_search, AB_rev_search
+import utils_profile as profile
+from utils_simbad import wsi_component_search, query_gaia_by_wds, query_gaia_by_wds_tap, query_gaia_by_wds_batch, throttled_query, cached_query, \
+                         resolve_concurrently, resolve_batched, batch_resolve, simbad_tap_url
 
 warnings.simplefilter('ignore', category=AstropyWarning)
 pd.set_option('mode.chained_assignment', None)
 
+# simbad connection settings
+tap = False           # send the single queries straight to url instead of through astroquery, both run the same exact identifier match
+url = simbad_tap_url  # or a local stand-in, see simbad_stub.py (tap and batch queries)
+max_workers = 8       # concurrent requests
+rate = 10             # max requests per second
+retries = 3           # retries for failed requests, with exponential backoff starting at backoff seconds
+backoff = 0.5
+timeout = 30          # seconds per request
+cache = 'data/simbad.cache.sqlite' # lookups are cached here between runs, use another file when url is a stand-in
+batch = True          # resolve identifiers with batched queries (many identifiers per request) instead of one request each
+
 # load wsi
 #wsi = pd.read_csv('data/wsi24.csv').replace({'wds_comp':np.NaN},'AB')
 
@@ -15,56 +28,49 @@ pd.set_option('mode.chained_assignment', None)
 ids = list( wsi.wds_id )
 comps = list( wsi.wds_comp )
 
-sim_pri = []
-sim_sec = []
-sim_pri_flg = []
-sim_sec_flg = []
-
-# loop through wsi and try to find a gaia match through simbad
-count = 0
-for id, comp in zip( ids, comps ):
+# rate limited query with retries, behind a cache, shared by all threads
+single_query = partial( query_gaia_by_wds_tap, url=url, timeout=timeout ) if tap else partial( query_gaia_by_wds, timeout=timeout )
+query = throttled_query( single_query, rate=rate, retries=retries, backoff=backoff )
+query = cached_query( query, path=cache )
 
-    # show progress
-    count += 1
-    if count % 100 == 0:
-        print(count)
-        
-    # if it's an AB format comp, run AB_search
-    if len( comp ) == 2:
+# batched queries, answered from the cache where possible and cached as they come back, failed batches are split down to single (cached) queries
+batch_query = throttled_query( partial( query_gaia_by_wds_batch, url=url, timeout=timeout ), rate=rate, retries=retries, backoff=backoff )
+resolve = lambda wds_ids: batch_resolve( wds_ids, batch_query, query )
 
-        # query primary
-        res1, flg1 = AB_search( id, comp )
+# a search that fails (a network error that outlasted the retries) is flagged not found, '$', for both stars,
+# so one failed lookup doesn't lose the rest of the run, and isn't cached so the next run queries it again
+failed = []
+def search( wds_id, comp, query ):
+    try:
+        return wsi_component_search( wds_id, comp, query )
+    except OSError:
+        failed.append( (wds_id, comp) )
+        return '', '$', '', '$'
 
-        # query secondary with A search
-        res2, flg2 = A_search( id, comp[1] ) 
-    
-    # if not, split the components
+# loop through the distinct (wds_id, comp) pairs and try to find a gaia match through simbad
+# each pair is searched once and its result fanned out to every observation of it, in wsi order
+args = list( zip( ids, comps ) )
+pairs = list( dict.fromkeys( args ) )
+with profile.span( 'simbad_search', rows_in=len(args), pairs=len(pairs) ):
+    if batch:
+        found = resolve_batched( search, pairs, resolve )
     else:
-        pri, sec = comp.split( ',' )
-        
-        # query primary
-        if len( pri ) == 1: # check for single letter comp first
-            res1, flg1 = A_search( id, pri )
-        else:
-            res1, flg1 = AB_rev_search( id, pri )
+        found = resolve_concurrently( search, pairs, query, max_workers=max_workers )
+
+found = dict( zip( pairs, found ) )
+results = [ found[a] for a in args ]
 
-        # query secondary
-        if len( sec ) == 1:
-            res2, flg2 = A_search( id, sec )
-        else:
-            res2, flg2 = AB_rev_search( id, sec )
+if failed:
+    print( f'{len(failed)} components failed to resolve and were flagged $, rerun to retry them' )
 
-    # append the results
-    sim_pri.append( res1 )
-    sim_sec.append( res2 )
-    sim_pri_flg.append( flg1 )
-    sim_sec_flg.append( flg2 )
+# write the pending cache access times
+query.close()
 
 # add results to data frame
-wsi['sb_id1'] = sim_pri
-wsi['sb_id2'] = sim_sec
-wsi['sb_flg1'] = sim_pri_flg
-wsi['sb_flg2'] = sim_sec_flg
+wsi['sb_id1'] = [ r[0] for r in results ]
+wsi['sb_id2'] = [ r[2] for r in results ]
+wsi['sb_flg1'] = [ r[1] for r in results ]
+wsi['sb_flg2'] = [ r[3] for r in results ]
 
 # export csv
 #wsi.to_csv('data/wsi24.sb.csv', index=False)
@@ -1,20 +1,36 @@
 import warnings
-import numpy as np
-import pandas as pd
-from utils_xmatch import wsi_gaia_xmatch
+from utils_xmatch import candidate_xmatch
+from utils_candidates import candidate_store, store_summary
+from utils_ids import id_dictionary, encode_ids, designation_to_source_id, source_id_array, same_source
+from utils_storage import read_table, write_table, prepped_schema, gaia_candidate_schema, xmatch_schema
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
+# processes for the primary selection, 1 runs it serially (same output either way)
+workers = 1
+
 # load in data
-wsi = pd.read_csv('data/wsi24.prepped.csv')
-gaia_pri = pd.read_csv('data/gaia.results/pri.04mag.05as-result.csv')
-gaia_sec = pd.read_csv('data/gaia.results/sec.04mag.10as-result.csv')
+wsi = read_table('data/wsi24.prepped', prepped_schema)
+gaia_pri = read_table('data/gaia.results/pri.04mag.05as-result', gaia_candidate_schema)
+gaia_sec = read_table('data/gaia.results/sec.04mag.10as-result', gaia_candidate_schema)
+
+# wds_id and wds_comp as categorical codes from one dictionary shared by all three tables
+ids = id_dictionary( wsi, gaia_pri, gaia_sec )
+wsi, gaia_pri, gaia_sec = [ encode_ids( table, ids ) for table in (wsi, gaia_pri, gaia_sec) ]
+
+# compact candidate store, each gaia star and each target kept once, linked by offsets
+store = candidate_store( gaia_pri, gaia_sec )
+summary = store_summary( gaia_pri, gaia_sec, store )
+print( f"{summary['candidates']} candidates of {summary['targets']} targets, {summary['sources']} distinct sources, "
+       f"{summary['table_bytes_per_candidate']:.0f} -> {summary['store_bytes_per_candidate']:.0f} bytes per candidate" )
+del gaia_pri, gaia_sec
 
 # crossmatch
-xmatch = wsi_gaia_xmatch( wsi, gaia_pri, gaia_sec )
+xmatch = candidate_xmatch( wsi, store, workers=workers )
 
 # see where our answers match simbad
-xmatch['xm_chk1'] = np.where( xmatch.gaia_designation1 == xmatch.sb_id1, True, False )
-xmatch['xm_chk2'] = np.where( xmatch.gaia_designation2 == xmatch.sb_id2, True, False )
+# simbad ids as gaia source ids, compared to the chosen source_id
+xmatch['xm_chk1'] = same_source( source_id_array( xmatch.gaia_source_id1 ), designation_to_source_id( xmatch.sb_id1 ) )
+xmatch['xm_chk2'] = same_source( source_id_array( xmatch.gaia_source_id2 ), designation_to_source_id( xmatch.sb_id2 ) )
 
 # save results
-xmatch.to_csv('data/wsi24.xmatch.csv', index=False)
+write_table( xmatch, 'data/wsi24.xmatch', xmatch_schema, csv=True )